@@ -1,7 +1,7 @@
 from pathlib import Path
 
 from aws_cdk import (BundlingOptions, DockerImage, Duration, Environment,
-                     Stack, aws_iam)
+                     RemovalPolicy, Stack, aws_iam, aws_s3)
 from aws_cdk import aws_s3_assets as assets
 from aws_cdk import aws_sns, aws_sqs
 from aws_cdk.aws_lambda import Code, Function, Runtime
@@ -19,6 +19,11 @@ class CloudFormationSummarizerStack(Stack):
 
         topic = aws_sns.Topic(self, "CFNNotifications")
         queue = aws_sqs.Queue(self, "CFNNotificationQueue", visibility_timeout=VISIBILITY_TIMEOUT)
+        summary_bucket = aws_s3.Bucket(self, "SummaryBucket",
+                                       block_public_access=aws_s3.BlockPublicAccess.BLOCK_ALL,
+                                       enforce_ssl=True,
+                                       removal_policy=RemovalPolicy.DESTROY,
+                                       auto_delete_objects=True)
 
         code = assets.Asset(self, "SummarizerFunctionCode",
                             bundling=BundlingOptions(
@@ -37,16 +42,28 @@ class CloudFormationSummarizerStack(Stack):
                             handler="lambda_src.handler",
                             runtime=Runtime.PYTHON_3_10,
                             timeout=VISIBILITY_TIMEOUT,
-                            log_retention=RetentionDays.TWO_WEEKS
+                            log_retention=RetentionDays.TWO_WEEKS,
+                            environment={
+                                "SUMMARY_STORE": f"s3://{summary_bucket.bucket_name}/summaries",
+                                "FRAGMENT_CACHE_DIR": "/tmp/fragments",
+                            }
                             )
         function.role.add_to_policy(aws_iam.PolicyStatement(
             actions=[
+                "cloudformation:DescribeStackEvents",
                 "cloudformation:DescribeStacks",
                 "cloudformation:ListStacks",
                 "cloudformation:ListStackResources",
+                "cloudwatch:GetMetricData",
+                "ecs:DescribeServices",
+                "elasticloadbalancing:DescribeLoadBalancers",
+                "sqs:GetQueueAttributes",
+                "sts:AssumeRole",
             ],
             resources=["*"]
         ))
+        summary_bucket.grant_read_write(function.role)
         queue.grant_consume_messages(function.role)
         topic.add_subscription(SqsSubscription(queue))
-        function.add_event_source_mapping("QueueSubscription", event_source_arn=queue.queue_arn)
+        function.add_event_source_mapping("QueueSubscription", event_source_arn=queue.queue_arn,
+                                          report_batch_item_failures=True)
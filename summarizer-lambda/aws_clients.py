@@ -0,0 +1,121 @@
+import os
+import threading
+from typing import Optional
+
+import boto3
+import botocore.config
+import botocore.credentials
+import botocore.session
+
+import instrumentation
+import throttling
+
+# clients are shared by all the threads of an invocation, so keep enough connections open for each
+MAX_POOL_CONNECTIONS = int(os.getenv("CLIENT_MAX_POOL_CONNECTIONS", "50"))
+ROLE_SESSION_NAME = "CloudFormationStackSummarizer"
+# CloudFormation API quotas are per account and region, and shared by every client calling it there, so
+# calls are rate limited on the client side and throttled calls retried with botocore's adaptive retry mode
+CLOUDFORMATION_RATE_LIMIT = float(os.getenv("CLOUDFORMATION_RATE_LIMIT", "10"))
+CLOUDFORMATION_BURST = float(os.getenv("CLOUDFORMATION_BURST", "20"))
+CLOUDFORMATION_MAX_ATTEMPTS = int(os.getenv("CLOUDFORMATION_MAX_ATTEMPTS", "5"))
+
+_lock = threading.Lock()
+_session = None
+_session_key = None
+_role_sessions = {}
+_clients = {}
+_rate_limiters = {}
+
+
+def _environment_key():
+    """Return the environment settings a session depends on; a change means the session is stale."""
+    return tuple(os.getenv(name) for name in ("AWS_REGION", "AWS_DEFAULT_REGION", "AWS_PROFILE", "AWS_ACCESS_KEY_ID"))
+
+
+def _current_session() -> boto3.Session:
+    global _session, _session_key
+    key = _environment_key()
+    if _session is None or _session_key != key:
+        _session = boto3.Session()
+        _session_key = key
+        _role_sessions.clear()
+        _clients.clear()
+    return _session
+
+
+def _role_session(role_arn: str) -> boto3.Session:
+    """
+    Return a session using the credentials of `role_arn`, assumed with STS.
+
+    The credentials are only requested when the session is first used, and are refreshed by
+    botocore shortly before they expire, so every client of the role shares one set of credentials.
+    """
+    session = _role_sessions.get(role_arn)
+    if session is None:
+        def assume_role():
+            credentials = get_client("sts").assume_role(RoleArn=role_arn, RoleSessionName=ROLE_SESSION_NAME)["Credentials"]
+            return {
+                "access_key": credentials["AccessKeyId"],
+                "secret_key": credentials["SecretAccessKey"],
+                "token": credentials["SessionToken"],
+                "expiry_time": credentials["Expiration"].isoformat(),
+            }
+
+        botocore_session = botocore.session.get_session()
+        botocore_session._credentials = botocore.credentials.DeferredRefreshableCredentials(
+            refresh_using=assume_role, method="sts-assume-role")
+        session = _role_sessions[role_arn] = boto3.Session(botocore_session=botocore_session,
+                                                           region_name=_session.region_name)
+    return session
+
+
+def get_session() -> boto3.Session:
+    """
+    Return a boto3 Session shared by all invocations of a warm container.
+
+    The session, and every client created from it, is replaced if the region or credentials in the
+    environment change.
+    """
+    with _lock:
+        return _current_session()
+
+
+def get_client(service_name: str, region_name: Optional[str] = None, role_arn: Optional[str] = None):
+    """
+    Return a boto3 client for `service_name` in `region_name` (default: the session's region).
+
+    With `role_arn`, the client uses the credentials of that role, e.g. to reach another account.
+    There is one client per service, role and region, reused, with its connections, by every caller.
+    CloudFormation clients share one rate limiter per role and region.
+    """
+    with _lock:
+        # boto3 sessions are not thread safe, so clients are created while holding the lock
+        session = _current_session()
+        key = (service_name, region_name or session.region_name, role_arn)
+        client = _clients.get(key)
+        if client is None:
+            if role_arn:
+                session = _role_session(role_arn)
+            config = botocore.config.Config(max_pool_connections=MAX_POOL_CONNECTIONS)
+            if service_name == "cloudformation":
+                config = config.merge(botocore.config.Config(
+                    retries={"mode": "adaptive", "max_attempts": CLOUDFORMATION_MAX_ATTEMPTS}))
+            client = _clients[key] = session.client(service_name, region_name=key[1], config=config)
+            client.meta.events.register("before-call", instrumentation.count_api_call)
+            if service_name == "cloudformation" and CLOUDFORMATION_RATE_LIMIT > 0:
+                rate_limiter = _rate_limiters.get(key[1:])
+                if rate_limiter is None:
+                    rate_limiter = _rate_limiters[key[1:]] = throttling.TokenBucket(CLOUDFORMATION_RATE_LIMIT,
+                                                                                   CLOUDFORMATION_BURST)
+                client.meta.events.register("before-call", rate_limiter.acquire)
+        return client
+
+
+def reset() -> None:
+    """Forget the shared session and clients."""
+    global _session, _session_key
+    with _lock:
+        _session = None
+        _session_key = None
+        _role_sessions.clear()
+        _clients.clear()
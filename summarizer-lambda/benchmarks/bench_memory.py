@@ -0,0 +1,98 @@
+"""
+Benchmark the memory held by summarized resources of a large synthetic workload, offline, with tracemalloc.
+
+Run from the summarizer-lambda directory:
+
+    python -m benchmarks.bench_memory --resources 10000 --output bench-memory.json
+
+Models:
+  dataclass  the resource model before StackResourceSummary was slotted: a dataclass with an
+             OrderedDict of {"label", "href"} dicts per resource
+  slotted    StackResourceSummary, with hrefs per resource and link labels shared
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List
+
+import lambda_src
+from benchmarks import synthetic
+from benchmarks.bench_stages import git_revision
+from resource_types.common import StackResourceSummary
+
+
+@dataclass
+class DataclassResourceSummary:
+    physical_id: str
+    logical_id: str
+    aws_region: str
+    links: OrderedDict = field(default_factory=OrderedDict)
+    label: str = None
+    href: str = None
+    metrics: List[dict] = field(default_factory=list)
+
+    def set_resource_link(self, label: str, href: str):
+        self.label = label
+        self.href = href
+
+    def add_link(self, label: str, href: str):
+        self.links[label] = {"label": label, "href": href}
+
+    def add_metric(self, label: str, aws_region: str, metric: dict, stat: str):
+        self.metrics.append({"label": label, "region": aws_region, "metric": metric, "stat": stat, "datapoints": []})
+
+
+def summarize(resources, model):
+    """Return `resources` summarized as instances of `model`, grouped by type."""
+    grouped = {}
+    for resource in resources:
+        grouped.setdefault(resource["ResourceType"], []).append(model(
+            resource["PhysicalResourceId"], resource["LogicalResourceId"], synthetic.REGION))
+    return lambda_src.summarize_resource(grouped)
+
+
+def measure(resources, model):
+    # compile templates and resolve enrichers before measuring
+    summarize(resources[:100], model)
+    gc.collect()
+    tracemalloc.start()
+    summarized = summarize(resources, model)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = sum(len(rows) for rows in summarized.values())
+    return {"summarized_resources": count, "retained_bytes": current, "peak_bytes": peak,
+            "bytes_per_resource": round(current / count) if count else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resources", type=int, default=10000, help="number of synthetic resources")
+    parser.add_argument("--mix", default="",
+                        help="resource type weights as Type=weight,...; default weights every TEMPLATES type and a few hidden types equally")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results to this file instead of stdout")
+    args = parser.parse_args()
+
+    resources = synthetic.synthetic_stack_resources(args.resources, synthetic.parse_mix(args.mix), args.seed)
+    results = {
+        "revision": git_revision(),
+        "resources": args.resources,
+        "models": {
+            "dataclass": measure(resources, DataclassResourceSummary),
+            "slotted": measure(resources, StackResourceSummary),
+        },
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark the peak memory and size of widget output for many large synthetic stacks, offline.
+
+Run from the summarizer-lambda directory:
+
+    python -m benchmarks.bench_output --stacks 20 --resources 500 --output bench-output.json
+
+Modes:
+  concatenated  each stack rendered with Template.render and appended to the result with +=,
+                as the widget output was assembled before it was streamed
+  streamed      each stack rendered with Template.generate through the minifier, and the
+                output joined once, within OUTPUT_BYTE_BUDGET
+"""
+import argparse
+import datetime
+import json
+import time
+import tracemalloc
+
+import lambda_src
+from benchmarks import synthetic
+from benchmarks.bench_stages import git_revision, resources_by_type
+from resource_types.common import StackSummary
+
+
+def stack_summaries(stack_count, resources):
+    """Return unrendered StackSummary objects for `stack_count` stacks with the same `resources`."""
+    summaries = []
+    for i in range(stack_count):
+        summarized = lambda_src.summarize_resource(resources_by_type(resources))
+        summaries.append(StackSummary(None, f"SyntheticStack{i}", resources=summarized,
+                                      resource_count=len(resources), aws_region=synthetic.REGION))
+    return summaries
+
+
+def render_concatenated(summaries):
+    template = lambda_src.get_template_environment().get_template("stack-fragment-table.j2")
+    result = ""
+    for summary in summaries:
+        summary.html = template.render(resources=summary.resources, date=datetime.datetime.now(),
+                                       stack_name=summary.name, omitted_by_type={}, parent_name=None,
+                                       stack_link="")
+        result += summary.html
+    return result
+
+
+def render_streamed(summaries):
+    return lambda_src.WIDGET_STYLE + "".join(lambda_src.bounded_html(
+        summaries, lambda_src.OUTPUT_BYTE_BUDGET - len(lambda_src.WIDGET_STYLE)))
+
+
+def measure(render, stack_count, resources):
+    summaries = stack_summaries(stack_count, resources)
+    tracemalloc.start()
+    started = time.perf_counter()
+    output = render(summaries)
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": seconds, "peak_bytes": peak, "output_bytes": len(output.encode())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stacks", type=int, default=20, help="number of synthetic stacks in the widget")
+    parser.add_argument("--resources", type=int, default=500, help="number of resources in each stack")
+    parser.add_argument("--mix", default="",
+                        help="resource type weights as Type=weight,...; default weights every TEMPLATES type and a few hidden types equally")
+    parser.add_argument("--byte-budget", type=int, default=lambda_src.OUTPUT_BYTE_BUDGET,
+                        help="OUTPUT_BYTE_BUDGET for the streamed mode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results to this file instead of stdout")
+    args = parser.parse_args()
+
+    lambda_src.OUTPUT_BYTE_BUDGET = args.byte_budget
+    resources = synthetic.synthetic_stack_resources(args.resources, synthetic.parse_mix(args.mix), args.seed)
+    results = {
+        "revision": git_revision(),
+        "stacks": args.stacks,
+        "resources": args.resources,
+        "byte_budget": args.byte_budget,
+        "modes": {
+            "concatenated": measure(render_concatenated, args.stacks, resources),
+            "streamed": measure(render_streamed, args.stacks, resources),
+        },
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
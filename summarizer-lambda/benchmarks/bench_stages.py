@@ -0,0 +1,144 @@
+"""
+Benchmark the stages of summarizing a large synthetic stack, offline, and write the timings as JSON.
+
+Run from the summarizer-lambda directory:
+
+    python -m benchmarks.bench_stages --resources 500 --output bench.json
+
+Stages:
+  list        get_stack_resources_by_type over ListStackResources pages
+  summarize   summarize_resource, including stubbed batch enricher calls
+  render      render_html_summary
+  handler     handler end to end, with every AWS call stubbed
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+from unittest import mock
+
+import fetch_engine
+import lambda_src
+from benchmarks import synthetic
+from resource_types.common import StackResourceSummary
+
+STACK_NAME = "SyntheticStack"
+ENRICHMENT_SERVICES = ("elbv2", "ecs", "sqs")
+
+
+def summarize_timings(timings):
+    return {
+        "runs": len(timings),
+        "best_seconds": min(timings),
+        "median_seconds": statistics.median(timings),
+        "mean_seconds": statistics.mean(timings),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def resources_by_type(resources):
+    """Return fresh StackResourceSummary objects grouped by type, as get_stack_resources_by_type would."""
+    grouped = {}
+    for resource in resources:
+        grouped.setdefault(resource["ResourceType"], []).append(StackResourceSummary(
+            resource["PhysicalResourceId"], resource["LogicalResourceId"], synthetic.REGION))
+    return grouped
+
+
+def client_factory(clients):
+    def get_client(service_name, region_name=None, role_arn=None):
+        return clients[service_name][0]
+    return get_client
+
+
+def time_list(resources, page_size):
+    with synthetic.stubbed_clients("cloudformation") as clients:
+        client, stubber = clients["cloudformation"]
+        synthetic.add_list_stack_resources_pages(stubber, STACK_NAME, resources, page_size)
+        started = time.perf_counter()
+        lambda_src.get_stack_resources_by_type(client, STACK_NAME)
+        return time.perf_counter() - started
+
+
+def time_summarize(resources):
+    synthetic.clear_enrichment_caches()
+    grouped = resources_by_type(resources)
+    with synthetic.stubbed_clients(*ENRICHMENT_SERVICES) as clients:
+        synthetic.add_enrichment_responses({name: stubber for name, (_, stubber) in clients.items()}, resources,
+                                           metrics=False)
+        started = time.perf_counter()
+        lambda_src.summarize_resource(grouped, client_factory(clients))
+        return time.perf_counter() - started
+
+
+def time_render(resources):
+    summarized = lambda_src.summarize_resource(resources_by_type(resources))
+    displayed = sum(len(r) for r in summarized.values())
+    started = time.perf_counter()
+    lambda_src.render_html_summary(summarized, STACK_NAME, synthetic.REGION, len(resources), displayed)
+    return time.perf_counter() - started
+
+
+def time_handler(resources, page_size):
+    synthetic.clear_enrichment_caches()
+    if lambda_src.RESOURCE_STATES is not None:
+        lambda_src.RESOURCE_STATES.clear()
+    with synthetic.stubbed_clients("cloudformation", "cloudwatch", *ENRICHMENT_SERVICES) as clients:
+        stubbers = {name: stubber for name, (_, stubber) in clients.items()}
+        synthetic.add_describe_stacks_response(stubbers["cloudformation"], STACK_NAME)
+        synthetic.add_describe_stack_events_response(stubbers["cloudformation"], STACK_NAME)
+        synthetic.add_list_stack_resources_pages(stubbers["cloudformation"], STACK_NAME, resources, page_size)
+        synthetic.add_enrichment_responses(stubbers, resources)
+        event = {"stacks": [STACK_NAME], "widgetContext": {"forceRefresh": True}}
+        # stubbed responses are returned in the order they were added, so the calls are made one after another
+        with mock.patch.object(lambda_src, "get_client", client_factory(clients)), \
+                mock.patch.object(lambda_src, "FETCH_ENGINE", fetch_engine.SyncFetchEngine()):
+            started = time.perf_counter()
+            lambda_src.handler(event, None)
+            return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resources", type=int, default=500, help="number of resources in the synthetic stack")
+    parser.add_argument("--mix", default="",
+                        help="resource type weights as Type=weight,...; default weights every TEMPLATES type and a few hidden types equally")
+    parser.add_argument("--page-size", type=int, default=synthetic.PAGE_SIZE, help="resources per ListStackResources page")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results to this file instead of stdout")
+    args = parser.parse_args()
+
+    resources = synthetic.synthetic_stack_resources(args.resources, synthetic.parse_mix(args.mix), args.seed)
+    stages = {
+        "list": lambda: time_list(resources, args.page_size),
+        "summarize": lambda: time_summarize(resources),
+        "render": lambda: time_render(resources),
+        "handler": lambda: time_handler(resources, args.page_size),
+    }
+    results = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "resources": args.resources,
+        "resource_types": synthetic.count_types(resources),
+        "page_size": args.page_size,
+        "stages": {name: summarize_timings([stage() for _ in range(args.repeat)]) for name, stage in stages.items()},
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Compare rendering resource links with per-call jinja2.Template construction against the compiled
+template registry in lambda_src.
+
+Run from the summarizer-lambda directory:
+
+    python -m benchmarks.bench_templates --resources 400
+"""
+import argparse
+import json
+import timeit
+
+import jinja2
+
+import lambda_src
+from resource_types.common import StackResourceSummary
+
+
+def uncompiled_render_template(template_source: str, template_vars: dict, template_type: str, resource_id: str):
+    """The render_template implementation before compiled templates were cached."""
+    try:
+        return jinja2.Template(template_source).render(**template_vars)
+    except jinja2.TemplateSyntaxError:
+        return ''
+
+
+def make_resources(count: int):
+    return {"AWS::Lambda::Function": [StackResourceSummary(f"function-{i}", f"Function{i}", "us-east-1") for i in range(count)],
+            "AWS::SQS::Queue": [StackResourceSummary(f"https://sqs.us-east-1.amazonaws.com/123456789012/queue-{i}", f"Queue{i}", "us-east-1") for i in range(count)],
+            "AWS::S3::Bucket": [StackResourceSummary(f"bucket-{i}", f"Bucket{i}", "us-east-1") for i in range(count)]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resources", type=int, default=400, help="resources of each type per summarized stack")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed runs for each implementation")
+    args = parser.parse_args()
+
+    compiled_render_template = lambda_src.render_template
+    results = {}
+    for name, implementation in (("uncompiled", uncompiled_render_template), ("compiled", compiled_render_template)):
+        lambda_src.render_template = implementation
+        try:
+            timings = timeit.repeat(lambda: lambda_src.summarize_resource(make_resources(args.resources)),
+                                    number=1, repeat=args.repeat)
+        finally:
+            lambda_src.render_template = compiled_render_template
+        results[name] = {"best_seconds": min(timings), "mean_seconds": sum(timings) / len(timings)}
+    results["speedup"] = results["uncompiled"]["best_seconds"] / results["compiled"]["best_seconds"]
+    print(json.dumps({"resources_per_type": args.resources, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
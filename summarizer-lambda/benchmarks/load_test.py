@@ -0,0 +1,360 @@
+"""
+Load test the widget as a dashboard of many custom widgets refreshing at once, offline.
+
+Every refresh calls lambda_src.handler once per widget, with the events CloudWatch sends custom
+widgets, at the given concurrency. AWS calls are answered by a fake backend with injected latency and
+throttling, so the results show how the summarizer copes with a slow or throttled account.
+
+Run from the summarizer-lambda directory:
+
+    python -m benchmarks.load_test --widgets 20 --concurrency 20 --refreshes 5 --latency-ms 50 \\
+        --throttle-rate 0.02 --output load-test.json
+
+The handlers run in one process and share its caches, as calls to one warm container would; pass
+--cold to clear every cache and client before each refresh. Injected throttling errors are returned
+as the response to an API call, after botocore's retries, so every one of them reaches the summarizer.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import math
+import os
+import platform
+import random
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from unittest import mock
+
+from botocore.awsrequest import AWSResponse
+
+import aws_clients
+import lambda_src
+from benchmarks import synthetic
+from benchmarks.bench_stages import git_revision
+
+THROTTLING_ERROR = {"Code": "Throttling", "Message": "Rate exceeded"}
+FAKE_CREDENTIALS = {
+    "AWS_ACCESS_KEY_ID": "AKIALOADTESTEXAMPLE",
+    "AWS_SECRET_ACCESS_KEY": "load-test-secret",
+    "AWS_DEFAULT_REGION": synthetic.REGION,
+}
+# stacks per ListStacks page, as CloudFormation returns them
+LIST_STACKS_PAGE_SIZE = 100
+
+
+def stack_id(stack_name: str) -> str:
+    return f"arn:aws:cloudformation:{synthetic.REGION}:{synthetic.ACCOUNT_ID}:stack/{stack_name}/synthetic"
+
+
+def stack_name(name_or_id: str) -> str:
+    return name_or_id.split("/")[1] if name_or_id.startswith("arn:") else name_or_id
+
+
+class FakeBackend:
+    """
+    Answers the AWS calls of botocore clients attached to it, in place of the AWS APIs.
+
+    Each call waits `latency_seconds` plus up to `jitter_seconds`, then fails with a throttling error
+    with probability `throttle_rate`, or when CloudFormation has already been called
+    `cloudformation_quota` times in the last second. Calls are counted by service and operation.
+    Stacks named in `last_updated` are described as updated at that time.
+    """
+
+    def __init__(self, stacks: Dict[str, List[dict]], latency_seconds: float = 0, jitter_seconds: float = 0,
+                 throttle_rate: float = 0, cloudformation_quota: Optional[int] = None, seed: int = 0):
+        self.stacks = stacks
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.throttle_rate = throttle_rate
+        self.cloudformation_quota = cloudformation_quota
+        self.calls = Counter()
+        self.throttled = Counter()
+        self._random = random.Random(seed)
+        self._cloudformation_calls = deque()
+        self._lock = threading.Lock()
+        self._attached = set()
+        self.last_updated = {}
+
+    def attach(self, client):
+        """Answer the calls made by `client`; attaching a client more than once has no effect."""
+        with self._lock:
+            if id(client) in self._attached:
+                return client
+            self._attached.add(id(client))
+        client.meta.events.register("before-parameter-build", self._keep_params)
+        client.meta.events.register("before-call", self._respond)
+        return client
+
+    def reset_counts(self):
+        with self._lock:
+            self.calls.clear()
+            self.throttled.clear()
+
+    @staticmethod
+    def _keep_params(params, context, **kwargs):
+        context["load_test_params"] = params
+
+    def _respond(self, model, context, **kwargs):
+        service_name = model.service_model.service_name
+        operation = f"{service_name}.{model.name}"
+        with self._lock:
+            self.calls[operation] += 1
+            delay = self.latency_seconds + self._random.uniform(0, self.jitter_seconds)
+            throttled = self._random.random() < self.throttle_rate or self._over_quota(service_name)
+            if throttled:
+                self.throttled[operation] += 1
+        if delay:
+            time.sleep(delay)
+        if throttled:
+            return AWSResponse(None, 400, {}, None), {
+                "Error": THROTTLING_ERROR, "ResponseMetadata": {"HTTPStatusCode": 400}}
+        answer = getattr(self, f"_{model.name}", None)
+        response = answer(context.get("load_test_params", {})) if answer else {}
+        response["ResponseMetadata"] = {"HTTPStatusCode": 200}
+        return AWSResponse(None, 200, {}, None), response
+
+    def _over_quota(self, service_name: str) -> bool:
+        if service_name != "cloudformation" or not self.cloudformation_quota:
+            return False
+        now = time.monotonic()
+        while self._cloudformation_calls and self._cloudformation_calls[0] <= now - 1:
+            self._cloudformation_calls.popleft()
+        if len(self._cloudformation_calls) >= self.cloudformation_quota:
+            return True
+        self._cloudformation_calls.append(now)
+        return False
+
+    def _stack(self, name: str) -> dict:
+        stack = {
+            "StackName": name,
+            "StackId": stack_id(name),
+            "CreationTime": datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc),
+            "StackStatus": "CREATE_COMPLETE",
+            "Tags": [],
+        }
+        if name in self.last_updated:
+            stack["LastUpdatedTime"] = self.last_updated[name]
+            stack["StackStatus"] = "UPDATE_COMPLETE"
+        return stack
+
+    def _DescribeStacks(self, params):
+        if "StackName" not in params:
+            return {"Stacks": [self._stack(name) for name in self.stacks]}
+        return {"Stacks": [self._stack(stack_name(params["StackName"]))]}
+
+    def _ListStacks(self, params):
+        names = list(self.stacks)
+        start = int(params.get("NextToken", 0))
+        stacks = [self._stack(name) for name in names[start:start + LIST_STACKS_PAGE_SIZE]]
+        response = {"StackSummaries": [{key: stack[key] for key in stack if key != "Tags"} for stack in stacks]}
+        if start + LIST_STACKS_PAGE_SIZE < len(names):
+            response["NextToken"] = str(start + LIST_STACKS_PAGE_SIZE)
+        return response
+
+    def _DescribeStackEvents(self, params):
+        name = stack_name(params["StackName"])
+        return {"StackEvents": [{
+            "StackId": stack_id(name),
+            "EventId": f"{name}-synthetic-event",
+            "StackName": name,
+            "Timestamp": datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc),
+        }]}
+
+    def _ListStackResources(self, params):
+        resources = self.stacks[stack_name(params["StackName"])]
+        start = int(params.get("NextToken", 0))
+        response = {"StackResourceSummaries": resources[start:start + synthetic.PAGE_SIZE]}
+        if start + synthetic.PAGE_SIZE < len(resources):
+            response["NextToken"] = str(start + synthetic.PAGE_SIZE)
+        return response
+
+    def _DescribeLoadBalancers(self, params):
+        return {"LoadBalancers": [{"LoadBalancerArn": arn, "DNSName": f"{arn.split('/')[-2]}.elb.amazonaws.com",
+                                   "State": {"Code": "active"}} for arn in params.get("LoadBalancerArns", [])]}
+
+    def _DescribeServices(self, params):
+        return {"services": [{"serviceArn": arn, "desiredCount": 2, "runningCount": 2}
+                             for arn in params.get("services", [])], "failures": []}
+
+    def _GetQueueAttributes(self, params):
+        return {"Attributes": {"ApproximateNumberOfMessages": "0", "ApproximateNumberOfMessagesNotVisible": "0"}}
+
+    def _GetMetricData(self, params):
+        return {"MetricDataResults": []}
+
+
+class LambdaContext:
+    """The parts of a Lambda context the handler uses, for an invocation with `timeout_seconds` to run."""
+    log_group_name = "/aws/lambda/CloudFormationStackSummarizer"
+    log_stream_name = "load-test"
+
+    def __init__(self, timeout_seconds: float):
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+def widget_event(stacks: List[str], widget_id: str, force_refresh: bool = False) -> dict:
+    """Return the event CloudWatch sends a custom widget showing `stacks` when a dashboard is refreshed."""
+    now = int(time.time() * 1000)
+    return {
+        "stacks": stacks,
+        "widgetContext": {
+            "dashboardName": "LoadTest",
+            "widgetId": widget_id,
+            "accountId": synthetic.ACCOUNT_ID,
+            "locale": "en",
+            "timezone": {"label": "UTC", "offsetISO": "+00:00", "offsetInMinutes": 0},
+            "period": 300,
+            "isAutoPeriod": True,
+            "timeRange": {"mode": "relative", "start": now - 3 * 3600 * 1000, "end": now,
+                          "relativeStart": 3 * 3600 * 1000, "zoom": {"start": now - 3 * 3600 * 1000, "end": now}},
+            "theme": "light",
+            "linkCharts": True,
+            "title": f"Stacks {widget_id}",
+            "forms": {"all": {}},
+            "params": {"stacks": stacks},
+            "width": 1024,
+            "height": 300,
+            "forceRefresh": force_refresh,
+        },
+    }
+
+
+def clear_caches():
+    """Forget everything a warm container keeps between invocations."""
+    lambda_src.SUMMARY_CACHE.clear()
+    if lambda_src.RESOURCE_STATES is not None:
+        lambda_src.RESOURCE_STATES.clear()
+    if lambda_src.FRAGMENT_CACHE is not None:
+        lambda_src.FRAGMENT_CACHE.clear()
+    lambda_src.STACK_INDEX.clear()
+    synthetic.clear_enrichment_caches()
+    aws_clients.reset()
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Return the `p`th percentile of `values` by the nearest-rank method."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def run(backend: FakeBackend, widgets: List[List[str]], concurrency: int, refreshes: int,
+        force_refresh: bool = False, cold: bool = False, timeout_seconds: float = 60) -> dict:
+    """Refresh a dashboard of `widgets`, each a list of stack names, `refreshes` times, and return the results."""
+    latencies = []
+    handler_errors = 0
+    stack_fragments = unavailable_fragments = 0
+    api_calls = []
+
+    def invoke(widget_id: int, stacks: List[str]):
+        event = widget_event(stacks, f"widget-{widget_id}", force_refresh)
+        started = time.perf_counter()
+        try:
+            output = lambda_src.handler(event, LambdaContext(timeout_seconds))
+        except Exception:
+            output = None
+        return time.perf_counter() - started, output
+
+    def get_client(*args, **kwargs):
+        return backend.attach(aws_clients.get_client(*args, **kwargs))
+
+    started = time.perf_counter()
+    with mock.patch.dict(os.environ, FAKE_CREDENTIALS), mock.patch.object(lambda_src, "get_client", get_client), \
+            ThreadPoolExecutor(max_workers=concurrency) as executor, open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull):
+        aws_clients.reset()
+        for _ in range(refreshes):
+            if cold:
+                clear_caches()
+            backend.reset_counts()
+            for latency, output in executor.map(invoke, range(len(widgets)), widgets):
+                latencies.append(latency)
+                if output is None:
+                    handler_errors += 1
+                    continue
+                stack_fragments += output.count('class="stack-summary"') + output.count('class="stack-message"')
+                unavailable_fragments += output.count('class="stack-message"')
+            api_calls.append(dict(backend.calls, throttled=sum(backend.throttled.values())))
+        aws_clients.reset()
+    seconds = time.perf_counter() - started
+
+    total_calls = [sum(count for operation, count in calls.items() if operation != "throttled") for calls in api_calls]
+    operations = sorted({operation for calls in api_calls for operation in calls} - {"throttled"})
+    return {
+        "seconds": seconds,
+        "invocations": len(latencies),
+        "latency_seconds": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies),
+        },
+        "api_calls_per_refresh": {
+            "mean": sum(total_calls) / refreshes,
+            "first": total_calls[0],
+            "by_operation": {operation: sum(calls.get(operation, 0) for calls in api_calls) / refreshes
+                             for operation in operations},
+        },
+        "error_rates": {
+            "handler": handler_errors / len(latencies),
+            "unavailable_stacks": unavailable_fragments / stack_fragments if stack_fragments else 0,
+            "throttled_api_calls": sum(calls["throttled"] for calls in api_calls) / sum(total_calls) if sum(total_calls) else 0,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--widgets", type=int, default=20, help="number of custom widgets on the dashboard")
+    parser.add_argument("--stacks-per-widget", type=int, default=1, help="number of stacks each widget shows")
+    parser.add_argument("--shared-stacks", action="store_true", help="every widget shows the same stacks")
+    parser.add_argument("--resources", type=int, default=200, help="number of resources in each stack")
+    parser.add_argument("--mix", default="",
+                        help="resource type weights as Type=weight,...; default weights every TEMPLATES type and a few hidden types equally")
+    parser.add_argument("--concurrency", type=int, default=20, help="handler calls running at once")
+    parser.add_argument("--refreshes", type=int, default=5, help="number of times the dashboard is refreshed")
+    parser.add_argument("--force-refresh", action="store_true", help="send forceRefresh, as the dashboard's refresh button does")
+    parser.add_argument("--cold", action="store_true", help="clear every cache and client before each refresh")
+    parser.add_argument("--latency-ms", type=float, default=20, help="latency of every API call")
+    parser.add_argument("--jitter-ms", type=float, default=10, help="up to this much random latency added to every API call")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="fraction of API calls failing with a throttling error")
+    parser.add_argument("--cloudformation-quota", type=int,
+                        help="CloudFormation calls per second allowed before calls are throttled")
+    parser.add_argument("--timeout", type=float, default=60, help="Lambda timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results to this file instead of stdout")
+    args = parser.parse_args()
+
+    resources = synthetic.synthetic_stack_resources(args.resources, synthetic.parse_mix(args.mix), args.seed)
+    stack_count = args.stacks_per_widget if args.shared_stacks else args.widgets * args.stacks_per_widget
+    stacks = {f"LoadTestStack{i}": resources for i in range(stack_count)}
+    names = list(stacks)
+    widgets = [names[:args.stacks_per_widget] if args.shared_stacks
+               else names[i * args.stacks_per_widget:(i + 1) * args.stacks_per_widget] for i in range(args.widgets)]
+    backend = FakeBackend(stacks, args.latency_ms / 1000, args.jitter_ms / 1000, args.throttle_rate,
+                          args.cloudformation_quota, args.seed)
+
+    logging.disable(logging.WARNING)
+    results = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "settings": {key: value for key, value in vars(args).items() if key != "output"},
+        **run(backend, widgets, args.concurrency, args.refreshes, args.force_refresh, args.cold, args.timeout),
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
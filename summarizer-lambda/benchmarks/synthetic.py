@@ -0,0 +1,140 @@
+"""
+Synthetic CloudFormation stacks for offline benchmarks, served through botocore Stubbers.
+"""
+import datetime
+import math
+import random
+from contextlib import ExitStack, contextmanager
+from typing import Dict, List
+
+from boto3.session import Session
+from botocore import stub
+
+import lambda_src
+
+ACCOUNT_ID = "123456789012"
+REGION = "us-east-1"
+CLUSTER_NAME = "synthetic-cluster"
+# resource types that are not summarized, but still have to be listed
+HIDDEN_TYPES = ["AWS::IAM::Role", "AWS::IAM::Policy", "AWS::Lambda::Permission"]
+# ListStackResources returns at most 100 resources per page
+PAGE_SIZE = 100
+
+
+def physical_id(resource_type: str, i: int) -> str:
+    """Return a physical id for resource `i` of `resource_type`, in the format CloudFormation reports it."""
+    if resource_type == "AWS::ElasticLoadBalancingV2::LoadBalancer":
+        return f"arn:aws:elasticloadbalancing:{REGION}:{ACCOUNT_ID}:loadbalancer/app/lb-{i}/{i:016x}"
+    if resource_type == "AWS::ECS::TaskDefinition":
+        return f"arn:aws:ecs:{REGION}:{ACCOUNT_ID}:task-definition/task-{i}:{i % 7 + 1}"
+    if resource_type == "AWS::ECS::Service":
+        return f"arn:aws:ecs:{REGION}:{ACCOUNT_ID}:service/{CLUSTER_NAME}/service-{i}"
+    if resource_type == "AWS::SQS::Queue":
+        return f"https://sqs.{REGION}.amazonaws.com/{ACCOUNT_ID}/queue-{i}"
+    if resource_type == "AWS::Route53::HostedZone":
+        return f"Z{i:020d}"
+    return f"{resource_type.split('::')[1].lower()}-{i}"
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Parse "Type=weight,Type=weight"; an empty mix weights every summarized and hidden type equally."""
+    if not mix:
+        return {resource_type: 1.0 for resource_type in list(lambda_src.TEMPLATES) + HIDDEN_TYPES}
+    weights = {}
+    for item in mix.split(","):
+        resource_type, _, weight = item.partition("=")
+        weights[resource_type.strip()] = float(weight or 1)
+    return weights
+
+
+def synthetic_stack_resources(count: int, mix: Dict[str, float], seed: int = 0) -> List[dict]:
+    """Return `count` ListStackResources summaries with resource types drawn from the weighted `mix`."""
+    rng = random.Random(seed)
+    resource_types = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    timestamp = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+    return [{
+        "ResourceType": resource_type,
+        "PhysicalResourceId": physical_id(resource_type, i),
+        "LogicalResourceId": f"Resource{i}",
+        "LastUpdatedTimestamp": timestamp,
+        "ResourceStatus": "CREATE_COMPLETE",
+    } for i, resource_type in enumerate(resource_types)]
+
+
+def count_types(resources: List[dict]) -> Dict[str, int]:
+    counts = {}
+    for resource in resources:
+        counts[resource["ResourceType"]] = counts.get(resource["ResourceType"], 0) + 1
+    return counts
+
+
+def add_describe_stacks_response(stubber: stub.Stubber, stack_name: str):
+    stubber.add_response("describe_stacks", {"Stacks": [{
+        "StackName": stack_name,
+        "StackId": f"arn:aws:cloudformation:{REGION}:{ACCOUNT_ID}:stack/{stack_name}/synthetic",
+        "CreationTime": datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc),
+        "StackStatus": "CREATE_COMPLETE",
+    }]}, {"StackName": stack_name})
+
+
+def add_describe_stack_events_response(stubber: stub.Stubber, stack_name: str):
+    stubber.add_response("describe_stack_events", {"StackEvents": [{
+        "StackId": f"arn:aws:cloudformation:{REGION}:{ACCOUNT_ID}:stack/{stack_name}/synthetic",
+        "EventId": "synthetic-event",
+        "StackName": stack_name,
+        "Timestamp": datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc),
+    }]}, {"StackName": f"arn:aws:cloudformation:{REGION}:{ACCOUNT_ID}:stack/{stack_name}/synthetic"})
+
+
+def add_list_stack_resources_pages(stubber: stub.Stubber, stack_name: str, resources: List[dict], page_size: int = PAGE_SIZE):
+    pages = [resources[i:i + page_size] for i in range(0, len(resources), page_size)] or [[]]
+    for n, page in enumerate(pages):
+        response = {"StackResourceSummaries": page}
+        expected_params = {"StackName": stack_name}
+        if n + 1 < len(pages):
+            response["NextToken"] = f"page-{n + 1}"
+        if n > 0:
+            expected_params["NextToken"] = f"page-{n}"
+        stubber.add_response("list_stack_resources", response, expected_params)
+
+
+def add_enrichment_responses(stubbers: Dict[str, stub.Stubber], resources: List[dict], metrics: bool = True):
+    """Queue the responses to the batch enrichers and, optionally, metrics lookups made for `resources`."""
+    counts = count_types(resources)
+    for _ in range(math.ceil(counts.get("AWS::ElasticLoadBalancingV2::LoadBalancer", 0) / 20)):
+        stubbers["elbv2"].add_response("describe_load_balancers", {"LoadBalancers": []})
+    for _ in range(math.ceil(counts.get("AWS::ECS::Service", 0) / 10)):
+        stubbers["ecs"].add_response("describe_services", {"services": []})
+    for _ in range(counts.get("AWS::SQS::Queue", 0)):
+        stubbers["sqs"].add_response("get_queue_attributes", {"Attributes": {
+            "ApproximateNumberOfMessages": "0", "ApproximateNumberOfMessagesNotVisible": "0"}})
+    if not metrics:
+        return
+    metric_count = sum(len(template.get("metrics", [])) * counts.get(resource_type, 0)
+                       for resource_type, template in lambda_src.TEMPLATES.items())
+    for _ in range(math.ceil(metric_count / 500)):
+        stubbers["cloudwatch"].add_response("get_metric_data", {"MetricDataResults": []})
+
+
+@contextmanager
+def stubbed_clients(*service_names):
+    """Yield {service name: (client, stubber)} for activated Stubbers, checking every response was used."""
+    with ExitStack() as stack:
+        clients = {}
+        for service_name in service_names:
+            client = Session(region_name=REGION).client(service_name)
+            clients[service_name] = (client, stack.enter_context(stub.Stubber(client)))
+        yield clients
+        for _, stubber in clients.values():
+            stubber.assert_no_pending_responses()
+
+
+def clear_enrichment_caches():
+    """Forget memoized batch enricher results and cached rows, so every benchmark run makes the same calls and renders every row."""
+    if lambda_src.FRAGMENT_CACHE is not None:
+        lambda_src.FRAGMENT_CACHE.clear()
+    for template in lambda_src.TEMPLATES.values():
+        for reference in template.get("batch_enrichers", []):
+            enricher = lambda_src.resolve_enricher(reference)
+            if hasattr(enricher, "cache_clear"):
+                enricher.cache_clear()
@@ -0,0 +1,197 @@
+"""
+Export a summary of every stack in an account and region as static HTML files, e.g. for an incident review.
+
+Run from the summarizer-lambda directory, with AWS credentials in the environment:
+
+    python -m export --output-dir stack-summaries --region us-east-1 --workers 8
+
+Each stack is written to its own html file, and index.html links to all of them. Stacks are rendered
+with render_stack_summary by a pool of workers, sharing one set of clients and compiled templates.
+The LastUpdatedTime of every exported stack is kept in manifest.jsonl, so running the export again
+(after an interruption, or later on) only renders the stacks that were updated since.
+"""
+import argparse
+import concurrent.futures
+import contextvars
+import datetime
+import html
+import json
+import logging
+import pathlib
+import sys
+import threading
+import time
+import urllib.parse
+from typing import Dict, Iterator, Optional
+
+import instrumentation
+import lambda_src
+from aws_clients import get_client
+from summary_store import LocalFileSummaryStore, SummaryStore
+
+logger = logging.getLogger()
+
+MANIFEST_NAME = "manifest.jsonl"
+INDEX_NAME = "index.html"
+# every stack status but DELETE_COMPLETE, which ListStacks keeps returning for 90 days after a stack is deleted
+LISTED_STATUSES_EXCLUDED = {"DELETE_COMPLETE"}
+
+
+def list_stacks(cloudformation) -> Iterator[dict]:
+    """Yield the StackSummaries of every stack that has not been deleted, over ListStacks pages."""
+    statuses = cloudformation.meta.service_model.operation_model("ListStacks").input_shape.members[
+        "StackStatusFilter"].member.enum
+    paginator = cloudformation.get_paginator("list_stacks")
+    for page in paginator.paginate(StackStatusFilter=[s for s in statuses if s not in LISTED_STATUSES_EXCLUDED]):
+        yield from page["StackSummaries"]
+
+
+def last_updated(stack: dict) -> str:
+    """Return when `stack` was last updated (or created, if it never was), as an ISO 8601 string."""
+    updated = stack.get("LastUpdatedTime") or stack["CreationTime"]
+    return updated.isoformat() if hasattr(updated, "isoformat") else str(updated)
+
+
+def stack_document(stack_name: str, summary_html: str) -> str:
+    """Return a standalone html document showing the summary of a stack."""
+    return (f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>{html.escape(stack_name)}</title>"
+            f"{lambda_src.WIDGET_STYLE}</head><body>{summary_html}</body></html>")
+
+
+def index_document(manifest: Dict[str, dict]) -> str:
+    """Return an html document linking to the summary of every stack in `manifest`, by stack name."""
+    rows = "".join(
+        f"<tr><td><a href=\"{html.escape(urllib.parse.quote(entry['file']))}\">{html.escape(stack_name)}</a></td>"
+        f"<td>{html.escape(entry['status'])}</td><td>{html.escape(entry['last_updated'])}</td>"
+        f"<td>{html.escape(entry['exported'])}</td></tr>"
+        for stack_name, entry in sorted(manifest.items()))
+    return ("<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Stack summaries</title>"
+            f"{lambda_src.WIDGET_STYLE}</head><body><div class=\"stack-summary\"><h1>Stack summaries</h1>"
+            f"<p>{len(manifest)} stacks</p><table><tr><th>Stack</th><th>Status</th><th>Last updated</th>"
+            f"<th>Exported</th></tr>{rows}</table></div></body></html>")
+
+
+class Export:
+    """
+    The html files of an export in `directory`, and its manifest of {stack name: entry}.
+
+    Each entry records the file, status and LastUpdatedTime of a stack when it was exported. Entries are
+    appended to the manifest as each stack is written, so an interrupted export resumes where it stopped;
+    a line cut short by the interruption is ignored. `write_index` compacts the manifest to one line a stack.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = pathlib.Path(directory)
+        self.store = LocalFileSummaryStore(directory)
+        self.manifest = self._read_manifest()
+        self._lock = threading.Lock()
+
+    def is_current(self, stack: dict) -> bool:
+        """Return whether `stack` was exported as it is now."""
+        entry = self.manifest.get(stack["StackName"])
+        return (entry is not None and entry["last_updated"] == last_updated(stack)
+                and self.directory.joinpath(entry["file"]).exists())
+
+    def add(self, stack: dict, summary_html: str) -> None:
+        """Write the summary of `stack`, and record it in the manifest."""
+        stack_name = stack["StackName"]
+        self.store.put(stack_name, stack_document(stack_name, summary_html))
+        entry = {
+            "stack_name": stack_name,
+            "file": SummaryStore.object_name(stack_name),
+            "status": stack["StackStatus"],
+            "last_updated": last_updated(stack),
+            "exported": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        }
+        with self._lock:
+            self.manifest[stack_name] = entry
+            with open(self.directory.joinpath(MANIFEST_NAME), "a") as manifest_file:
+                manifest_file.write(json.dumps(entry) + "\n")
+
+    def write_index(self) -> None:
+        """Write the index page of the stacks in the manifest, and the manifest compacted."""
+        with self._lock:
+            self._write(MANIFEST_NAME, "".join(json.dumps(entry) + "\n" for entry in self.manifest.values()))
+            self._write(INDEX_NAME, index_document(self.manifest))
+
+    def _read_manifest(self) -> Dict[str, dict]:
+        manifest = {}
+        try:
+            with open(self.directory.joinpath(MANIFEST_NAME)) as manifest_file:
+                for line in manifest_file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    manifest[entry["stack_name"]] = entry
+        except FileNotFoundError:
+            pass
+        return manifest
+
+    def _write(self, name: str, content: str):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory.joinpath(name)
+        partial_path = path.with_suffix(".partial")
+        with open(partial_path, "w") as output_file:
+            output_file.write(content)
+        partial_path.replace(path)
+
+
+def export_stacks(cloudformation, directory: str, workers: int = lambda_src.STACK_WORKERS,
+                  force: bool = False) -> dict:
+    """
+    Export the summary of every stack listed by `cloudformation` to `directory`, `workers` stacks at a time.
+
+    Stacks exported before, and not updated since, are skipped unless `force` is set. Stacks that fail to
+    render are left out of the manifest, so the next export tries them again. Returns the counts of
+    exported, skipped and failed stacks, and the throughput in exported stacks per second.
+    """
+    export = Export(directory)
+    started = time.perf_counter()
+    counts = {"exported": 0, "skipped": 0, "failed": 0}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers))
+    # summaries are rendered outside of a Lambda invocation, so their spans and counters are dropped
+    # with this recorder rather than kept by the default one for as long as the export runs
+    with instrumentation.invocation():
+        try:
+            futures = {}
+            for stack in list_stacks(cloudformation):
+                if not force and export.is_current(stack):
+                    counts["skipped"] += 1
+                    continue
+                future = executor.submit(contextvars.copy_context().run, lambda_src.render_stack_summary,
+                                         stack["StackName"], cloudformation)
+                futures[future] = stack
+            for future in concurrent.futures.as_completed(futures):
+                stack = futures[future]
+                try:
+                    export.add(stack, future.result().html)
+                    counts["exported"] += 1
+                except Exception as e:
+                    logger.error("[%s] could not export stack summary", stack["StackName"], exc_info=e)
+                    counts["failed"] += 1
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            export.write_index()
+    seconds = time.perf_counter() - started
+    return dict(counts, seconds=seconds, stacks_per_second=counts["exported"] / seconds if seconds else 0.0)
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output-dir", default="stack-summaries", help="directory the html files are written to")
+    parser.add_argument("--region", help="region of the stacks; default: the region of the AWS environment")
+    parser.add_argument("--workers", type=int, default=lambda_src.STACK_WORKERS, help="stacks rendered at a time")
+    parser.add_argument("--force", action="store_true", help="export every stack, even if it was exported before")
+    args = parser.parse_args(argv)
+
+    result = export_stacks(get_client("cloudformation", region_name=args.region), args.output_dir,
+                           workers=args.workers, force=args.force)
+    print(f"exported {result['exported']} stacks in {result['seconds']:.1f}s "
+          f"({result['stacks_per_second']:.2f} stacks/sec), skipped {result['skipped']} unchanged, "
+          f"{result['failed']} failed; index: {pathlib.Path(args.output_dir, INDEX_NAME)}")
+    return 1 if result["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List
+
+# threads running blocking AWS calls for the asyncio engine, shared by every stack of an invocation
+ASYNC_ENGINE_WORKERS = int(os.getenv("ASYNC_ENGINE_WORKERS", "32"))
+# pages fetched ahead of the page being processed
+PREFETCH_PAGES = int(os.getenv("PREFETCH_PAGES", "2"))
+
+
+class SyncFetchEngine:
+    """Makes AWS calls one after another, in the calling thread."""
+    concurrent = False
+
+    def pages(self, client, operation: str, **params) -> Iterator[dict]:
+        """Yield the pages of a paginated `operation` of `client`."""
+        yield from client.get_paginator(operation).paginate(**params)
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Call `fn(*args)`, returning a future of its result."""
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def gather(self, calls: Iterable[Callable]) -> List:
+        """Return the results of `calls`, in order."""
+        return [call() for call in calls]
+
+
+class AsyncFetchEngine:
+    """
+    Makes AWS calls as asyncio tasks, on an event loop running in a background thread.
+
+    boto3 calls block, so each one runs in a thread of the loop's executor through asyncio.to_thread, in
+    the contextvars context of its caller. The next `prefetch_pages` pages of a paginated operation are
+    fetched while the current one is processed, and gathered calls all run at once.
+    """
+    concurrent = True
+
+    def __init__(self, workers: int = ASYNC_ENGINE_WORKERS, prefetch_pages: int = PREFETCH_PAGES):
+        self.workers = workers
+        self.prefetch_pages = prefetch_pages
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                loop.set_default_executor(ThreadPoolExecutor(max_workers=self.workers))
+                threading.Thread(target=loop.run_forever, name="fetch-engine", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def pages(self, client, operation: str, **params) -> Iterator[dict]:
+        """Yield the pages of a paginated `operation` of `client`, fetching the next pages ahead."""
+        loop = self._event_loop()
+        fetch_page = functools.partial(contextvars.copy_context().run, next,
+                                       iter(client.get_paginator(operation).paginate(**params)), None)
+
+        async def start():
+            queue = asyncio.Queue(maxsize=max(1, self.prefetch_pages))
+
+            async def produce():
+                try:
+                    while True:
+                        page = await asyncio.to_thread(fetch_page)
+                        await queue.put(page)
+                        if page is None:
+                            return
+                except Exception as e:
+                    await queue.put(e)
+
+            return queue, asyncio.create_task(produce())
+
+        queue, producer = asyncio.run_coroutine_threadsafe(start(), loop).result()
+        try:
+            while True:
+                page = asyncio.run_coroutine_threadsafe(queue.get(), loop).result()
+                if isinstance(page, Exception):
+                    raise page
+                if page is None:
+                    return
+                yield page
+        finally:
+            loop.call_soon_threadsafe(producer.cancel)
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Start `fn(*args)` on the event loop, returning a future of its result."""
+        call = functools.partial(contextvars.copy_context().run, fn, *args)
+        return asyncio.run_coroutine_threadsafe(asyncio.to_thread(call), self._event_loop())
+
+    def gather(self, calls: Iterable[Callable]) -> List:
+        """Return the results of `calls`, run concurrently, in order."""
+        futures = [self.submit(call) for call in calls]
+        return [future.result() for future in futures]
+
+
+def engine_from_environment():
+    """Return the fetch engine named by the FETCH_ENGINE environment variable: "sync" (the default) or "async"."""
+    name = os.getenv("FETCH_ENGINE", "sync")
+    if name == "async":
+        return AsyncFetchEngine()
+    if name != "sync":
+        raise ValueError(f"unknown FETCH_ENGINE '{name}', expected 'sync' or 'async'")
+    return SyncFetchEngine()
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import marshal
+import os
+import pathlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import jinja2
+import jinja2.meta
+
+logger = logging.getLogger()
+
+# changes whenever the layout of a cached fragment changes, so fragments written by older code are never read
+FRAGMENT_FORMAT = 1
+
+# A rendered row: its label, href, (label, href) links and (label, region, metric, stat) metrics
+Fragment = Tuple[str, str, tuple, tuple]
+
+
+def template_sources(template: dict):
+    """Yield every jinja2 source in a resource type template."""
+    yield template["label"]
+    yield template["resource_link"]
+    yield from template["links"].values()
+    for metric in template.get("metrics", []):
+        if "when" in metric:
+            yield metric["when"]
+        yield from metric["dimensions"].values()
+
+
+class FragmentCache:
+    """
+    An LRU cache of rendered resource rows, addressed by the content they are rendered from.
+
+    A fragment's key is a digest of its resource type, physical id and region, the version of its
+    template (a digest of the template itself), and the value of every other variable the template uses.
+    Editing a template, or an enricher returning something new, therefore addresses a new fragment,
+    and fragments of shared resources are rendered once for every stack they appear in.
+
+    When `directory` is given (e.g. under /tmp), fragments evicted from memory spill there as marshal
+    files, named by their key, of which up to `max_disk_entries` are kept.
+    """
+
+    def __init__(self, max_entries: int = 10000, directory: Optional[str] = None, max_disk_entries: int = 100000):
+        self.max_entries = max_entries
+        self.directory = pathlib.Path(directory) if directory else None
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._template_versions = {}
+        self._disk_entries = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls):
+        """Return a FragmentCache configured by FRAGMENT_CACHE_* environment variables."""
+        return cls(
+            max_entries=int(os.getenv("FRAGMENT_CACHE_MAX_ENTRIES", "10000")),
+            directory=os.getenv("FRAGMENT_CACHE_DIR"),
+            max_disk_entries=int(os.getenv("FRAGMENT_CACHE_MAX_DISK_ENTRIES", "100000")),
+        )
+
+    def key(self, template: dict, resource_type: Optional[str], template_vars: dict) -> str:
+        """Return the key of the fragment rendered from `template` with `template_vars`."""
+        version, variables = self._template_version(template)
+        values = [(name, name in template_vars, template_vars.get(name)) for name in variables]
+        content = repr((FRAGMENT_FORMAT, version, resource_type, template_vars["physical_id"],
+                        template_vars["region"], values))
+        return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[Fragment]:
+        """Return the fragment for `key`, or None if it is not cached."""
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is None:
+                fragment = self._read_file(key)
+            if fragment is None:
+                self.misses += 1
+                return None
+            self._entries[key] = fragment
+            self._entries.move_to_end(key)
+            self._evict()
+            self.hits += 1
+            return fragment
+
+    def put(self, key: str, fragment: Fragment) -> None:
+        with self._lock:
+            self._entries[key] = fragment
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._template_versions.clear()
+            self.hits = 0
+            self.misses = 0
+            if self.directory and self.directory.exists():
+                for path in self.directory.glob("*.frag"):
+                    path.unlink(missing_ok=True)
+            self._disk_entries = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _template_version(self, template: dict):
+        """Return a digest of `template`, and the sorted names of the variables its sources use."""
+        # the template is kept with its version, so its id is not reused by another template
+        cached = self._template_versions.get(id(template))
+        if cached is None or cached[0] is not template:
+            environment = jinja2.Environment()
+            variables = set()
+            for source in template_sources(template):
+                try:
+                    variables |= jinja2.meta.find_undeclared_variables(environment.parse(source))
+                except jinja2.TemplateSyntaxError:
+                    pass
+            version = hashlib.blake2b(json.dumps(template, sort_keys=True).encode(), digest_size=16).hexdigest()
+            cached = self._template_versions[id(template)] = (template, version,
+                                                              sorted(variables - {"physical_id", "region"}))
+        return cached[1:]
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            key, fragment = self._entries.popitem(last=False)
+            self._write_file(key, fragment)
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.directory.joinpath(key + ".frag")
+
+    def _read_file(self, key: str) -> Optional[Fragment]:
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), "rb") as fragment_file:
+                return marshal.load(fragment_file)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+    def _write_file(self, key: str, fragment: Fragment):
+        if not self.directory:
+            return
+        try:
+            if self._disk_entries is None:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self._disk_entries = sum(1 for _ in self.directory.glob("*.frag"))
+            path = self._path(key)
+            if path.exists():
+                return
+            with open(path, "wb") as fragment_file:
+                marshal.dump(fragment, fragment_file)
+            self._disk_entries += 1
+            if self._disk_entries > self.max_disk_entries:
+                self._prune_files()
+        except (OSError, ValueError) as e:
+            logger.warning("could not write fragment cache file: %s", e)
+
+    def _prune_files(self):
+        """Delete the oldest tenth of the fragment files once there are more than max_disk_entries."""
+        paths = sorted(self.directory.glob("*.frag"), key=lambda p: p.stat().st_mtime)
+        keep = self.max_disk_entries * 9 // 10
+        for path in paths[:max(0, len(paths) - keep)]:
+            path.unlink(missing_ok=True)
+        self._disk_entries = min(len(paths), keep)
@@ -0,0 +1,147 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import List, Optional
+
+EMF_NAMESPACE = os.getenv("METRICS_NAMESPACE", "StackSummarizer")
+
+
+class Recorder:
+    """Collects stage durations and counters for one invocation, keyed by stack name and resource type."""
+
+    def __init__(self):
+        self.started = time.time()
+        self._durations = defaultdict(list)
+        self._counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add_duration(self, stage: str, milliseconds: float, stack_name: Optional[str], resource_type: Optional[str]):
+        with self._lock:
+            self._durations[(stage, stack_name, resource_type)].append(milliseconds)
+
+    def add_count(self, name: str, value: float, stack_name: Optional[str], resource_type: Optional[str]):
+        with self._lock:
+            self._counters[(name, stack_name, resource_type)] += value
+
+    def breakdown(self) -> dict:
+        """
+        Return the recorded durations and counters as nested dicts, for debug responses.
+
+        Durations are summed per stage and listed along with the number of spans recorded.
+        """
+        result = {}
+        with self._lock:
+            for (stage, stack_name, resource_type), durations in self._durations.items():
+                entry = self._entry(result, stack_name, resource_type)
+                entry[f"{stage}Duration"] = round(sum(durations), 3)
+                entry[f"{stage}Count"] = len(durations)
+            for (name, stack_name, resource_type), value in self._counters.items():
+                self._entry(result, stack_name, resource_type)[name] = value
+        return result
+
+    @staticmethod
+    def _entry(result: dict, stack_name: Optional[str], resource_type: Optional[str]) -> dict:
+        entry = result
+        if stack_name:
+            entry = entry.setdefault("stacks", {}).setdefault(stack_name, {})
+        if resource_type:
+            entry = entry.setdefault("resource_types", {}).setdefault(resource_type, {})
+        return entry
+
+    def emf_records(self) -> List[dict]:
+        """
+        Return Embedded Metric Format records for the invocation.
+
+        EMF records carry a single value per dimension, so the invocation totals are one record and
+        each stack and each (stack, resource type) pair gets a record of its own.
+        """
+        records = {}
+        with self._lock:
+            for (stage, stack_name, resource_type), durations in self._durations.items():
+                records.setdefault((stack_name, resource_type), {})[(f"{stage}Duration", "Milliseconds")] = round(sum(durations), 3)
+            for (name, stack_name, resource_type), value in self._counters.items():
+                records.setdefault((stack_name, resource_type), {})[(name, "Count")] = value
+        hits = records.get((None, None), {}).get(("SummaryCacheHits", "Count"), 0)
+        misses = records.get((None, None), {}).get(("SummaryCacheMisses", "Count"), 0)
+        if hits + misses:
+            records[(None, None)][("SummaryCacheHitRate", "Percent")] = round(100 * hits / (hits + misses), 1)
+
+        emf_records = []
+        for (stack_name, resource_type), metrics in sorted(records.items(), key=lambda item: (item[0][0] or "", item[0][1] or "")):
+            dimensions = {name: value for name, value in (("StackName", stack_name), ("ResourceType", resource_type)) if value}
+            record = {
+                "_aws": {
+                    "Timestamp": int(self.started * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": EMF_NAMESPACE,
+                        "Dimensions": [list(dimensions)],
+                        "Metrics": [{"Name": name, "Unit": unit} for name, unit in metrics],
+                    }],
+                },
+                **dimensions,
+            }
+            if os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+                record["FunctionName"] = os.getenv("AWS_LAMBDA_FUNCTION_NAME")
+            record.update({name: value for (name, _), value in metrics.items()})
+            emf_records.append(record)
+        return emf_records
+
+
+_default_recorder = Recorder()
+_recorder = contextvars.ContextVar("recorder", default=_default_recorder)
+_stack_name = contextvars.ContextVar("stack_name", default=None)
+
+
+def recorder() -> Recorder:
+    return _recorder.get()
+
+
+@contextmanager
+def invocation():
+    """Record spans and counters made inside the block (and in contexts copied from it) with a new Recorder."""
+    token = _recorder.set(Recorder())
+    try:
+        yield _recorder.get()
+    finally:
+        _recorder.reset(token)
+
+
+@contextmanager
+def stack(stack_name: str):
+    """Attribute spans and counters made inside the block to `stack_name`."""
+    token = _stack_name.set(stack_name)
+    try:
+        yield
+    finally:
+        _stack_name.reset(token)
+
+
+@contextmanager
+def span(stage: str, resource_type: Optional[str] = None):
+    """Record how long the block takes as a duration of `stage`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder().add_duration(stage, (time.perf_counter() - started) * 1000, _stack_name.get(), resource_type)
+
+
+def count(name: str, value: float = 1, resource_type: Optional[str] = None, per_stack: bool = True):
+    """Add `value` to the counter `name`, attributed to the current stack unless `per_stack` is False."""
+    recorder().add_count(name, value, _stack_name.get() if per_stack else None, resource_type)
+
+
+def count_api_call(model, **kwargs):
+    """botocore `before-call` event handler counting the AWS API calls made by a client."""
+    count("ApiCalls", per_stack=False)
+    count(f"{model.name}Calls", per_stack=False)
+
+
+def emit() -> None:
+    """Print the EMF records of the current invocation, where Lambda sends them to CloudWatch Logs."""
+    for record in recorder().emf_records():
+        print(json.dumps(record, default=str))
@@ -1,20 +1,42 @@
+import concurrent.futures
+import contextvars
+import copy
+import dataclasses
 import datetime
+import functools
+import html
+import importlib
 import json
 import logging
 import os
 import pathlib
+import re
 import sys
+import time
 import traceback
 import urllib.parse
-from collections import defaultdict
-from typing import List, Mapping, Optional
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Union
 
-import boto3
 import botocore.exceptions
 import jinja2
 
-from resource_types import ecs, elbv2, sqs
-from resource_types.common import StackResourceSummary, StackSummary
+import aws_clients
+import fetch_engine
+import fragment_cache
+import instrumentation
+import resource_metrics
+import stack_events
+import stack_index
+import summary_cache
+import summary_store
+import throttling
+from aws_clients import get_client
+from resource_types import registry
+from resource_types.common import (ENRICHMENT_CACHE_TTL_SECONDS,
+                                   ResourceFilter, StackResourceSummary,
+                                   StackSummary, StackTarget, SummaryOptions,
+                                   per_resource)
 
 
 def render_cloudwatch_logs_url(aws_region: str, log_group: str, log_stream: Optional[str] = None):
@@ -27,167 +49,424 @@ def render_cloudwatch_logs_url(aws_region: str, log_group: str, log_stream: Opti
     return url
 
 
-TEMPLATES = {
-    "AWS::Route53::HostedZone": {
-        "label": "{{ physical_id }}",
-        "resource_link": "https://us-east-1.console.aws.amazon.com/route53/v2/hostedzones#ListRecordSets/{{ physical_id }}",
-        "links": {
-            "Query Metrics": "https://{{ region }}.console.aws.amazon.com/cloudwatch/home?region={{ region }}#metricsV2:graph=~(metrics~(~(~'AWS*2fRoute53~'DNSQueries~'HostedZoneId~'{{ physical_id }}~(region~'us-east-1)))~view~'timeSeries~stacked~false~region~'{{ region }}~stat~'Sum~period~300);query=~'*7bAWS*2fRoute53*2cHostedZoneId*7d;region=us-east-1;forwardXA=no"
-        },
-    },
-    "AWS::CloudFront::Distribution": {
-        "label": "{{ physical_id }}",
-        "resource_link": "https://console.aws.amazon.com/cloudfront/v3/home#/distributions/{{ physical_id }}",
-        "links": {
-            "Metrics": "https://console.aws.amazon.com/cloudfront/v3/home#/monitoring/distribution/{{ physical_id }}"
-        },
-    },
-    "AWS::S3::Bucket": {
-        "label": "{{ physical_id }}",
-        "resource_link": "https://us-east-1.console.aws.amazon.com/s3/buckets/{{ physical_id }}?region={{ region }}&tab=objects",
-        "links": {
-            "Metrics": "https://us-east-1.console.aws.amazon.com/s3/buckets/{{ physical_id }}?region={{ region }}&tab=metrics"
-        },
-    },
-    "AWS::CloudWatch::Alarm": {
-        "label": "{{ physical_id }}",
-        "resource_link": "https://console.aws.amazon.com/cloudwatch/home?region={{ region }}#alarmsV2:alarm/{{ physical_id }}",
-        "links": {},
-    },
-    "AWS::ElasticLoadBalancingV2::LoadBalancer": {
-        "label": "{{ load_balancer_type }}: {{ physical_id }}",
-        "resource_link": "https://console.aws.amazon.com/ec2/v2/home?region={{ region }}#LoadBalancers:search={{ name }};sort=loadBalancerName",
-        "links": {
-            "CloudWatch Metrics": "https://console.aws.amazon.com/cloudwatch/home?region={{ region }}#metricsV2:graph=~(view~'timeSeries~stacked~false~region~'{{ region }}~start~'-PT1H~end~'P0D);query=~'*7bAWS*2fApplicationELB*2cLoadBalancer*7d*20LoadBalancer*3d*22{{ cloudwatch_id }}*22"
-        },
-        "enrichers": [
-            elbv2.enrich_load_balancer_summary
-        ]
-    },
-    "AWS::Kinesis::Stream": {
-        "label": "{{ physical_id }}",
-        "resource_link": "https://console.aws.amazon.com/kinesis/home?region={{ region }}#/streams/details/{{ physical_id }}/details",
-        "links": {
-            "Metrics": "https://console.aws.amazon.com/kinesis/home?region={{ region }}#/streams/details/{{ physical_id }}/monitoring"
-        }
-    },
-    "AWS::Logs::LogGroup": {
-        "label": "{{ physical_id }}",
-        "resource_link": "https://console.aws.amazon.com/cloudwatch/home?region={{ region }}#logsV2:log-groups/log-group/{{ physical_id }}",
-        "links": {
-            "Logs Insights": "https://console.aws.amazon.com/cloudwatch/home?region={{ region }}#logsV2:logs-insights$3FqueryDetail$3D~(end~0~start~-3600~timeType~'RELATIVE~unit~'seconds~editorString~'~isLiveTail~false~queryId~'~source~(~'{{ physical_id }}))",
-        }
-    },
-    "AWS::SQS::Queue": {
-        "label": "{{ queue_path }}",
-        "resource_link": "https://console.aws.amazon.com/sqs/v2/home?region={{ region }}#/queues/{{ encoded_url }}",
-        "links": {},
-        "enrichers": [
-            sqs.enrich_sqs_queue
-        ]
-    },
-    "AWS::DynamoDB::Table": {
-        "label": "{{ physical_id }}",
-        "resource_link": "https://console.aws.amazon.com/dynamodb/home?region={{ region }}#tables:selected={{ physical_id }};tab=overview",
-        "links": {
-            "Metrics": "https://console.aws.amazon.com/dynamodb/home?region={{ region }}#tables:selected={{ physical_id }};tab=metrics"
-        },
-    },
-    "AWS::Lambda::Function": {
-        "label": "{{ physical_id }}",
-        "resource_link": "https://console.aws.amazon.com/lambda/home?region={{ region }}#functions/{{ physical_id }}",
-        "links": {
-            "Logs Insights": "https://console.aws.amazon.com/cloudwatch/home?region={{ region }}#logsV2:logs-insights$3FqueryDetail$3D$257E$2528end$257E0$257Estart$257E-3600$257EtimeType$257E$2527RELATIVE$257Eunit$257E$2527seconds$257EeditorString$257E$2527fields*20*40timestamp*2c*20*40message*0a*7c*20sort*20*40timestamp*20desc*0a*7c*20limit*2020$257EisLiveTail$257Efalse$257EqueryId$257E$2527d2ee3780-2d3d-42c6-98cf-e483b2f3f85f$257Esource$257E$2528$257E$2527*2faws*2flambda*2f{{ physical_id }}$2529$2529",
-            "Monitoring": "https://console.aws.amazon.com/lambda/home?region={{ region }}#/functions/{{ physical_id }}?tab=monitoring",
-        },
-    },
-    "AWS::ECS::TaskDefinition": {
-        "label": "{{ name }}:{{ version }}",
-        "resource_link": "https://console.aws.amazon.com/ecs/home?region={{ region }}#/taskDefinitions/{{ name }}/{{ version }}",
-        "links": {},
-        "enrichers": [
-            ecs.enrich_task_definition
-        ]
-    },
-    "AWS::ECS::Service": {
-        "label": "{{ service_name }}",
-        "resource_link": "{{ base_url }}/details",
-        "links": {
-            "Events": "{{ base_url }}/events",
-            "Metrics": "{{ base_url }}/metrics",
-            "Logs": "{{ base_url }}/logs",
-        },
-        "enrichers": [
-            ecs.enrich_task_definition
-        ]
-    }
-}
+# templates of the summarized resource types, whose modules are imported when a type is first summarized
+TEMPLATES = registry.TemplateRegistry.from_environment()
 
 TAG_GROUP = "StackSummarizer_Group"
 TAG_NAME = "StackSummarizer_Name"
 
 EVENT_TYPE_SUMMARIZE = "update"
 EVENT_TYPE_DESCRIBE = "describe"
+EVENT_TYPE_NOTIFICATION = "notification"
+
+# maximum number of stacks summarized concurrently by one invocation
+STACK_WORKERS = int(os.getenv("STACK_WORKERS", "8"))
+# time kept back from the Lambda deadline for assembling the widget after summarizing stacks
+DEADLINE_MARGIN_SECONDS = 2.0
+THROTTLING_ERROR_CODES = {"Throttling", "ThrottlingException", "RequestLimitExceeded", "TooManyRequestsException"}
+# errors of a stack's account or role rather than of the widget, e.g. a role that cannot be assumed or lacks access
+ACCESS_ERROR_CODES = {"AccessDenied", "AccessDeniedException", "UnauthorizedOperation", "ExpiredToken",
+                      "InvalidClientTokenId", "UnrecognizedClientException", "RegionDisabledException"}
+
+# rendered summaries of unchanged stacks, reused across invocations of a warm container
+SUMMARY_CACHE = summary_cache.SummaryCache.from_environment()
+# summaries pre-rendered from CloudFormation notifications, read by widgets instead of rendering synchronously
+SUMMARY_STORE = summary_store.summary_store_from_environment()
+# pre-rendered summaries embed live values (queue depths, task counts, the last hour of metrics), so older
+# ones are rendered again rather than shown
+SUMMARY_STORE_MAX_AGE_SECONDS = float(os.getenv("SUMMARY_STORE_MAX_AGE_SECONDS", "600"))
+# the resources of recently summarized stacks, updated from stack events rather than listed again
+RESOURCE_STATES = (summary_cache.SummaryCache(max_entries=int(os.getenv("RESOURCE_STATE_MAX_ENTRIES", "64")),
+                                              ttl_seconds=float(os.getenv("RESOURCE_STATE_TTL_SECONDS", "3600")))
+                   if os.getenv("RESOURCE_STATE_MAX_ENTRIES") != "0" else None)
+# rendered rows of resources, reused by every stack and summary rendered from the same template and variables
+FRAGMENT_CACHE = (fragment_cache.FragmentCache.from_environment()
+                  if os.getenv("FRAGMENT_CACHE_MAX_ENTRIES") != "0" else None)
+# makes the AWS calls of summarizing a stack one after another, or with FETCH_ENGINE=async, concurrently
+FETCH_ENGINE = fetch_engine.engine_from_environment()
+# concurrent requests for the same stack summary, e.g. from several widgets, share one prepare_stack_summary call;
+# the requests that joined it get copies of the summary, taken before the request that made it changes it
+STACK_REQUESTS = throttling.SingleFlight(share=copy.deepcopy)
+# names and tags of the stacks in the account, for resolving wildcard and tag stack selectors
+STACK_INDEX = stack_index.StackIndex.from_environment()
+
+
+# resources of a type whose enrichment is started while their stack is still being listed
+PREFETCH_ENRICHMENT_BATCH = int(os.getenv("PREFETCH_ENRICHMENT_BATCH", "50"))
+# widget output beyond this many bytes is left out, well within the 6 MB limit on Lambda responses
+OUTPUT_BYTE_BUDGET = int(os.getenv("OUTPUT_BYTE_BUDGET", "1000000"))
+# styles of the html fragments of every stack, included once per widget
+WIDGET_STYLE = ("<style>.stack-summary{padding:1em}.stack-summary table{width:100%}"
+                ".stack-message{padding:10px;text-align:center}"
+                ".badge{border-radius:3px;padding:0 4px;font-size:small}.badge-problem{background:#fde7e9;color:#b1001c}"
+                ".badge-progress{background:#fff4ce;color:#7a5800}</style>")
+WHITESPACE = re.compile(r"\s+")
+# tags (and comments) that whitespace around is not rendered for, so minify_html removes it; whitespace
+# between inline elements, like a label and its badges, is kept as a single space
+BLOCK_TAG = r"(?:</?(?:table|tr|td|th|div|ul|li|br)\b[^>]*>|<!--.*?-->)"
+BLOCK_TAG_WHITESPACE = re.compile(rf"\s*({BLOCK_TAG})\s*")
+BLOCK_TAG_AT_START = re.compile(BLOCK_TAG)
+BLOCK_TAG_AT_END = re.compile(rf"{BLOCK_TAG}$")
+# where stack-fragment-table.j2 leaves out the stack a summary is nested in, when rendered without a parent
+NESTED_IN_MARKER = "<!--nested-in-->"
+# jinja2 generates many small chunks, which are minified together in batches of this many characters
+MINIFY_BATCH_CHARACTERS = 16384
+# kept free in the byte budget for the footer shown when stacks are left out
+TRUNCATION_FOOTER_BYTES = 200
+
+# compiled jinja2 templates (or the TemplateSyntaxError raised while compiling them), keyed by template source
+_compiled_templates = {}
+
+
+def compile_template(template_source: str):
+    """
+    Return a compiled jinja2.Template for `template_source`, compiling it only on first use.
 
-
-def render_template(template_source: str, template_vars: dict, template_type: str, resource_id: str):
+    A template that fails to compile is remembered as its TemplateSyntaxError, so the error is
+    reported for every resource that uses it without recompiling the template each time.
+    """
     try:
-        return jinja2.Template(template_source).render(**template_vars)
+        return _compiled_templates[template_source]
+    except KeyError:
+        pass
+    try:
+        compiled = jinja2.Template(template_source)
     except jinja2.TemplateSyntaxError as error:
+        compiled = error
+    _compiled_templates[template_source] = compiled
+    return compiled
+
+
+def render_template(template_source: str, template_vars: dict, template_type: str, resource_id: str):
+    compiled = compile_template(template_source)
+    if isinstance(compiled, jinja2.TemplateSyntaxError):
         logger.error(
-            f"error rendering {template_type} for '{resource_id}': {error.message}\nTemplate Source:{error.source}")
-    return ''
+            f"error rendering {template_type} for '{resource_id}': {compiled.message}\nTemplate Source:{compiled.source}")
+        return ''
+    return compiled.render(**template_vars)
 
 
-def populate_resource_summary(template: dict, resource: StackResourceSummary) -> None:
+@functools.lru_cache(maxsize=None)
+def resolve_enricher(reference: str):
+    """
+    Return the enricher function named by `reference` ("module:function"), importing its module on first use.
+    """
+    module_name, _, function_name = reference.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def enrich_resources(template: dict, resources: List[StackResourceSummary], clients=None,
+                     resource_type: Optional[str] = None) -> List[dict]:
+    """
+    Return the template variables added by a template's enrichers, one dict per resource.
+
+    Per-resource `enrichers` are always applied; `batch_enrichers`, which look resources up with the AWS
+    clients returned by `clients(service_name)`, only when `clients` is given. Enrichers are named by
+    "module:function" references so their modules are only imported by stacks that use them.
+    """
+    enrichers = [per_resource(resolve_enricher(enricher)) for enricher in template.get("enrichers", [])]
+    if clients is not None:
+        enrichers += [resolve_enricher(enricher) for enricher in template.get("batch_enrichers", [])]
+    enriched_vars = [{} for _ in resources]
+    for enricher in enrichers:
+        with instrumentation.span("Enrichment", resource_type):
+            results = enricher(resources, clients)
+        for variables, result in zip(enriched_vars, results):
+            variables.update(result)
+    return enriched_vars
+
+
+def populate_resource_summary(template: dict, resource: StackResourceSummary, enriched_vars: Optional[dict] = None,
+                              resource_type: Optional[str] = None) -> bool:
+    """
+    Set the label, links and metrics of a resource from its type's template, returning True if they were
+    taken from a fragment rendered before and cached in FRAGMENT_CACHE.
+    """
     template_vars = {
         "physical_id": resource.physical_id,
         "logical_id": resource.logical_id,
         "region": resource.aws_region
     }
 
-    for enricher in template.get("enrichers", []):
-        template_vars.update(enricher(resource))
-
-    resource.set_resource_link(
+    if enriched_vars is None:
+        enriched_vars = enrich_resources(template, [resource])[0]
+    template_vars.update(enriched_vars)
+
+    key = FRAGMENT_CACHE.key(template, resource_type, template_vars) if FRAGMENT_CACHE is not None else None
+    fragment = FRAGMENT_CACHE.get(key) if key is not None else None
+    cached = fragment is not None
+    if not cached:
+        fragment = render_fragment(template, template_vars, resource)
+        if key is not None:
+            FRAGMENT_CACHE.put(key, fragment)
+
+    label, href, links, metrics = fragment
+    resource.set_resource_link(label, href)
+    for link_label, link_href in links:
+        resource.add_link(link_label, link_href)
+    for metric_label, metric_region, metric, stat in metrics:
+        resource.add_metric(metric_label, metric_region, metric, stat)
+    return cached
+
+
+def render_fragment(template: dict, template_vars: dict, resource: StackResourceSummary) -> fragment_cache.Fragment:
+    """Render the label, href, links and metrics of a resource from its type's template."""
+    links = tuple(
+        (label, render_template(template["links"][label], template_vars, label, resource.logical_id))
+        for label in template["links"]
+    )
+    metrics = []
+    for metric in template.get("metrics", []):
+        # a metric that only some resources of the type have is kept for the resources its `when` renders True for
+        if "when" in metric and render_template(metric["when"], template_vars, f"{metric['label']} metric condition",
+                                                resource.logical_id).strip() != "True":
+            continue
+        dimensions = [
+            {"Name": name, "Value": render_template(value, template_vars, f"{metric['label']} metric", resource.logical_id)}
+            for name, value in metric["dimensions"].items()
+        ]
+        metrics.append((metric["label"], metric.get("region", resource.aws_region), {
+            "Namespace": metric["namespace"],
+            "MetricName": metric["name"],
+            "Dimensions": dimensions,
+        }, metric["stat"]))
+    return (
         render_template(template["label"], template_vars, 'resource label', resource.logical_id),
         render_template(template["resource_link"], template_vars, 'resource link', resource.logical_id),
+        links,
+        tuple(metrics),
     )
-    for label in template["links"]:
-        resource.add_link(label, render_template(template["links"][label], template_vars, label, resource.logical_id))
 
 
-def render_stack_summary(stack_name: str, cloudformation) -> StackSummary:
+def prepare_stack_summary(stack_name: str, cloudformation, force_refresh: bool = False,
+                          options: SummaryOptions = SummaryOptions(), role_arn: Optional[str] = None) -> StackSummary:
     """
-    Return a StackSummary for stack given by `stack_name`
+    Return a StackSummary for stack given by `stack_name` with its resources summarized.
+
+    Pre-rendered summaries from SUMMARY_STORE are used when available and at most
+    SUMMARY_STORE_MAX_AGE_SECONDS old, and rendered summaries are cached until the stack is updated or
+    changes status; `force_refresh` skips both. Otherwise the summary's html is rendered by
+    finish_stack_summary, after the metrics of its resources have been fetched.
+
+    `options` select the resources that are summarized; pre-rendered summaries are only used with the
+    default options, for stacks in the Lambda's own account and region. `cloudformation` is a client for
+    the stack's region, and `role_arn` the role it was created with, which is also used for enrichment.
     """
+    if (SUMMARY_STORE and not force_refresh and options.is_default and role_arn is None
+            and cloudformation.meta.region_name == aws_clients.get_session().region_name):
+        html = SUMMARY_STORE.get(stack_name, max_age_seconds=SUMMARY_STORE_MAX_AGE_SECONDS)
+        if html is not None:
+            logger.info("[%s] using pre-rendered summary", stack_name)
+            return StackSummary(html, stack_name)
+
     logger.info("[%s] preparing to update stack document", stack_name)
+    cache_key = None
+    stack_id = None
+    display_name = stack_name
     try:
-        cloudformation.describe_stacks(StackName=stack_name)
+        with instrumentation.span("DescribeStacks"):
+            response = cloudformation.describe_stacks(StackName=stack_name)
+        stack = response["Stacks"][0]
+        stack_id = stack["StackId"]
+        if stack_name.startswith("arn:"):
+            display_name = stack["StackName"]
+        cache_key = summary_cache.stack_cache_key(stack_name, stack) + options.cache_key()
     except botocore.exceptions.ClientError as e:
         if 'does not exist' in str(e):
             logger.warning("[%s] stack could not be found", stack_name)
-            return StackSummary(f"<p style=\"padding: 10; text-align: center\">no CloudFormation stack named '{stack_name}'</p>", stack_name)
-
-    logger.info("[%s] looking up stack resources", stack_name)
-    all_resources = get_stack_resources_by_type(cloudformation, stack_name)
-    resource_count = sum(len(all_resources[i]) for i in all_resources)
-    logger.info("[%s] resources in stack: %d", stack_name, resource_count)
+            return render_unavailable_summary(stack_name, f"no CloudFormation stack named '{stack_name}'")
+
+    if cache_key and not force_refresh:
+        cached = SUMMARY_CACHE.get(cache_key)
+        instrumentation.count("SummaryCacheHits" if cached is not None else "SummaryCacheMisses", per_stack=False)
+        if cached is not None:
+            logger.info("[%s] stack unchanged, using cached summary", stack_name)
+            return StackSummary(cached["html"], display_name, stack_id=stack_id, nested_stacks=cached["nested_stacks"],
+                                displayed_resources=cached.get("displayed_resources", 0))
+
+    state_key = stack_id + options.cache_key() if stack_id and RESOURCE_STATES is not None else None
+    state = RESOURCE_STATES.get(state_key) if state_key else None
+    if state is not None and time.time() - state.listed_at >= RESOURCE_STATES.ttl_seconds:
+        # putting the state back renews its expiry, so it is listed again once its drift could be stale
+        logger.info("[%s] listing stack resources again, to refresh their drift", stack_name)
+        state = None
+    if state is not None:
+        try:
+            with instrumentation.span("DescribeStackEvents"):
+                events = stack_events.new_stack_events(cloudformation, stack_id, state.last_event_id)
+            logger.info("[%s] updating stack resources from %d stack event(s)", stack_name, len(events))
+            records = dict(state.resources)
+            stack_events.apply_stack_events(records, events)
+            last_event_id = events[-1]["EventId"] if events else state.last_event_id
+            listed_at = state.listed_at
+            resources = iter(records.values())
+            instrumentation.count("IncrementalUpdates")
+        except stack_events.EventHistoryGap as e:
+            logger.info("[%s] listing stack resources again: %s", stack_name, e)
+            state = None
+    if state is None:
+        last_event_id = None
+        listed_at = time.time()
+        if state_key:
+            try:
+                with instrumentation.span("DescribeStackEvents"):
+                    last_event_id = stack_events.latest_event_id(cloudformation, stack_id)
+            except botocore.exceptions.ClientError as e:
+                logger.warning("[%s] could not get stack events: %s", stack_name, e)
+        logger.info("[%s] looking up stack resources", stack_name)
+        records = {}
+        resources = iter_stack_resources(cloudformation, stack_name)
+        if last_event_id:
+            resources = record_resources(resources, records)
+
+    listed_counts = Counter()
+    nested_stacks = []
     region_name = cloudformation.meta.region_name
-    filtered_resources = summarize_resource(all_resources)
-    filtered_resources_count = sum(len(filtered_resources[i]) for i in filtered_resources)
-    logger.info("[%s] resources for document: %d", stack_name, filtered_resources_count)
-    html = render_html_summary(filtered_resources, stack_name, region_name, resource_count, filtered_resources_count)
-    return StackSummary(html, stack_name)
+    clients = functools.partial(get_client, region_name=region_name, role_arn=role_arn)
+    prefetch = EnrichmentPrefetch(clients) if FETCH_ENGINE.concurrent else None
+    all_resources = group_stack_resources(resources, region_name, options.resource_filter, listed_counts,
+                                          nested_stacks, prefetch)
+    if prefetch is not None:
+        prefetch.wait()
+    resource_count = sum(listed_counts.values())
+    logger.info("[%s] resources in stack: %d", stack_name, resource_count)
+    instrumentation.count("Resources", resource_count)
+    # every row is enriched and populated again, even when its resource is unchanged, as enrichers look up
+    # live values; the memoized batch enrichers and FRAGMENT_CACHE keep that cheap
+    filtered_resources = summarize_resource(all_resources, clients)
+    if last_event_id:
+        RESOURCE_STATES.put(state_key, stack_events.StackResourceState(last_event_id, records, listed_at))
+    omitted_by_type = {resource_type: listed_counts[resource_type] - len(filtered_resources[resource_type])
+                       for resource_type in filtered_resources
+                       if listed_counts[resource_type] > len(filtered_resources[resource_type])}
+    return StackSummary(None, display_name, resources=filtered_resources, resource_count=resource_count,
+                        aws_region=region_name, cache_key=cache_key, omitted_by_type=omitted_by_type,
+                        stack_id=stack_id, nested_stacks=nested_stacks, role_arn=role_arn)
+
+
+def coalesced_prepare_stack_summary(stack_name: str, cloudformation, force_refresh: bool = False,
+                                    options: SummaryOptions = SummaryOptions(),
+                                    role_arn: Optional[str] = None) -> StackSummary:
+    """
+    Same as prepare_stack_summary, but concurrent calls for the same stack share one call.
 
+    Callers sharing a call each get their own copy of the summary (see STACK_REQUESTS), as summaries
+    are changed when finished.
+    """
+    key = (stack_name, id(cloudformation), role_arn, force_refresh, options)
+    summary, shared = STACK_REQUESTS.do(key, prepare_stack_summary, stack_name, cloudformation,
+                                        force_refresh=force_refresh, options=options, role_arn=role_arn)
+    if shared:
+        logger.info("[%s] sharing summary with a concurrent request", stack_name)
+        instrumentation.count("CoalescedRequests")
+    return summary
 
-def render_html_summary(resources: Mapping[str, List[StackResourceSummary]], stack_name: str, aws_region: str, resource_count: int, displayed_resources: int):
-    """Return a string w/ an HTML document about a CFN stack and its resources."""
-    j2env = jinja2.Environment(
+
+def with_parent_name(summary_html: str, parent_name: Optional[str]) -> str:
+    """Return `summary_html` saying which stack it is nested in, in place of its NESTED_IN_MARKER."""
+    nested_in = f"<small>nested in {html.escape(parent_name)}</small><br/>" if parent_name else ""
+    return summary_html.replace(NESTED_IN_MARKER, nested_in, 1)
+
+
+def finish_stack_summary(summary: StackSummary) -> StackSummary:
+    """
+    Render the html of a StackSummary returned by prepare_stack_summary.
+
+    The html is cached without the stack it is nested in, which depends on the stacks a widget lists
+    rather than on the stack itself, and that is filled in afterwards.
+    """
+    if summary.html is None:
+        filtered_resources_count = sum(len(summary.resources[i]) for i in summary.resources)
+        logger.info("[%s] resources for document: %d", summary.name, filtered_resources_count)
+        with instrumentation.stack(summary.name), instrumentation.span("RenderHtml"):
+            summary.html = render_html_summary(summary.resources, summary.name, summary.aws_region,
+                                               summary.resource_count, filtered_resources_count,
+                                               summary.omitted_by_type)
+        summary.resources = None
+        summary.displayed_resources = filtered_resources_count
+        if summary.cache_key:
+            SUMMARY_CACHE.put(summary.cache_key, {"html": summary.html, "nested_stacks": summary.nested_stacks,
+                                                  "displayed_resources": filtered_resources_count})
+    summary.html = with_parent_name(summary.html, summary.parent_name)
+    return summary
+
+
+def fetch_stack_metrics(summaries: List[StackSummary], deadline: Optional[float] = None) -> None:
+    """
+    Fetch the metrics of every resource of the unrendered `summaries` together, per account.
+
+    Metrics not fetched by `deadline` are left out, rather than holding up the rendering of the summaries.
+    """
+    resources_by_role = defaultdict(list)
+    for summary in summaries:
+        if summary.html is None:
+            for resources in summary.resources.values():
+                resources_by_role[summary.role_arn] += resources
+    with instrumentation.span("GetMetricData"):
+        for role_arn, resources in resources_by_role.items():
+            resource_metrics.fetch_resource_metrics(resources, functools.partial(get_client, "cloudwatch",
+                                                                                 role_arn=role_arn), deadline)
+
+
+def render_stack_summary(stack_name: str, cloudformation, force_refresh: bool = False,
+                         options: SummaryOptions = SummaryOptions()) -> StackSummary:
+    """
+    Return a StackSummary for stack given by `stack_name`
+    """
+    with instrumentation.stack(stack_name):
+        summary = coalesced_prepare_stack_summary(stack_name, cloudformation, force_refresh=force_refresh,
+                                                  options=options)
+        fetch_stack_metrics([summary])
+        return finish_stack_summary(summary)
+
+
+@functools.lru_cache(maxsize=None)
+def get_template_environment() -> jinja2.Environment:
+    """Return the jinja2 Environment for html templates, which caches compiled templates across invocations."""
+    return jinja2.Environment(
         loader=jinja2.FileSystemLoader(pathlib.Path(__file__).parent),
-        autoescape=jinja2.select_autoescape(default=True, default_for_string=True)
+        autoescape=jinja2.select_autoescape(default=True, default_for_string=True),
+        auto_reload=False
     )
-    template = j2env.get_template("stack-fragment-table.j2")
+
+
+def batched_chunks(chunks: Iterable[str], size: int) -> Iterator[str]:
+    """Yield `chunks` joined into strings of at least `size` characters, but for the last."""
+    batch = []
+    batch_size = 0
+    for chunk in chunks:
+        batch.append(chunk)
+        batch_size += len(chunk)
+        if batch_size >= size:
+            yield "".join(batch)
+            batch = []
+            batch_size = 0
+    if batch:
+        yield "".join(batch)
+
+
+def minify_html(chunks: Iterable[str]) -> Iterator[str]:
+    """Yield html `chunks` with runs of whitespace collapsed to a space, and whitespace around block tags removed."""
+    after_block_tag = True
+    space_pending = False
+    for chunk in batched_chunks(chunks, MINIFY_BATCH_CHARACTERS):
+        chunk = BLOCK_TAG_WHITESPACE.sub(r"\1", WHITESPACE.sub(" ", chunk))
+        stripped = chunk.strip()
+        if not stripped:
+            space_pending = space_pending or bool(chunk)
+            continue
+        if (space_pending or chunk[0] == " ") and not after_block_tag and not BLOCK_TAG_AT_START.match(stripped):
+            stripped = " " + stripped
+        yield stripped
+        after_block_tag = BLOCK_TAG_AT_END.search(stripped) is not None
+        space_pending = chunk[-1] == " "
+
+
+def generate_html_summary(resources: Mapping[str, List[StackResourceSummary]], stack_name: str, aws_region: str,
+                          resource_count: int, displayed_resources: int, omitted_by_type: Optional[Mapping[str, int]] = None,
+                          parent_name: Optional[str] = None) -> Iterator[str]:
+    """Yield the minified HTML document about a CFN stack and its resources in chunks, as it is rendered."""
+    template = get_template_environment().get_template("stack-fragment-table.j2")
 
     template_vars = {
         "resources": resources,
@@ -195,40 +474,174 @@ def render_html_summary(resources: Mapping[str, List[StackResourceSummary]], sta
         "stack_name": stack_name,
         "resource_count": resource_count,
         "displayed_resources": displayed_resources,
+        "omitted_by_type": omitted_by_type or {},
+        "parent_name": parent_name,
         "stack_link": f"https://console.aws.amazon.com/cloudformation/home?region={aws_region}#/stacks?filteringStatus=active&filteringText={stack_name}&viewNested=true&hideStacks=false&stackId="
     }
 
-    return template.render(**template_vars)
+    return minify_html(template.generate(**template_vars))
+
+
+def render_html_summary(resources: Mapping[str, List[StackResourceSummary]], stack_name: str, aws_region: str, resource_count: int, displayed_resources: int,
+                        omitted_by_type: Optional[Mapping[str, int]] = None, parent_name: Optional[str] = None):
+    """Return a string w/ an HTML document about a CFN stack and its resources."""
+    return "".join(generate_html_summary(resources, stack_name, aws_region, resource_count, displayed_resources,
+                                         omitted_by_type, parent_name))
 
 
-def summarize_resource(resources_by_type: Mapping[str, List[StackResourceSummary]]) -> Mapping[str, List[StackResourceSummary]]:
+class EnrichmentPrefetch:
+    """
+    Starts the memoized batch enrichers of a stack's resources on FETCH_ENGINE while the stack is still
+    being listed, in batches of PREFETCH_ENRICHMENT_BATCH resources of a type, or fewer when an enricher
+    of the type has a smaller `prefetch_batch_size`.
+
+    Enriching the resources once the stack is listed then reuses the memoized results, rather than
+    looking every resource up only after the last page of the stack has arrived.
+    """
+
+    def __init__(self, clients):
+        self.clients = clients
+        self._batches = defaultdict(list)
+        self._batch_sizes = {}
+        self._futures = []
+
+    def add(self, resource_type: str, resource: StackResourceSummary):
+        batch = self._batches[resource_type]
+        batch.append(resource)
+        if len(batch) >= self._batch_size(resource_type):
+            self._start(resource_type)
+
+    def wait(self):
+        """Start the batch enrichers of the resources left, then wait for every batch enricher started."""
+        for resource_type in self._batches:
+            self._start(resource_type)
+        for future in self._futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning("prefetching enrichment failed: %s", e)
+
+    def _start(self, resource_type: str):
+        batch = self._batches[resource_type]
+        if batch and ENRICHMENT_CACHE_TTL_SECONDS > 0 and resource_type in TEMPLATES:
+            for reference in TEMPLATES[resource_type].get("batch_enrichers", []):
+                enricher = resolve_enricher(reference)
+                # only memoized enrichers keep their results for enriching the resources again
+                if hasattr(enricher, "cache_clear"):
+                    self._futures.append(FETCH_ENGINE.submit(enricher, list(batch), self.clients))
+        batch.clear()
+
+    def _batch_size(self, resource_type: str) -> int:
+        size = self._batch_sizes.get(resource_type)
+        if size is None:
+            size = PREFETCH_ENRICHMENT_BATCH
+            if resource_type in TEMPLATES:
+                for reference in TEMPLATES[resource_type].get("batch_enrichers", []):
+                    size = min(size, getattr(resolve_enricher(reference), "prefetch_batch_size", size))
+            self._batch_sizes[resource_type] = size
+        return size
+
+
+def summarize_resource(resources_by_type: Mapping[str, List[StackResourceSummary]],
+                       clients=None) -> Mapping[str, List[StackResourceSummary]]:
     """
     For each StackResourceSummary, call the summarizer function for resource type.
+
+    `clients(service_name)` returns the AWS client used by batch enrichers; without it they are skipped.
+    With clients, the resources of each type are enriched concurrently by a concurrent FETCH_ENGINE.
     """
+    resource_types = [cfn_type for cfn_type in resources_by_type if cfn_type in TEMPLATES]
+    enrichment = [functools.partial(enrich_resources, TEMPLATES[cfn_type], resources_by_type[cfn_type], clients,
+                                    resource_type=cfn_type)
+                  for cfn_type in resource_types]
+    enriched_by_type = FETCH_ENGINE.gather(enrichment) if clients is not None else [enrich() for enrich in enrichment]
     resources_with_links = {}
-    for cfn_type in resources_by_type:
-        if cfn_type not in TEMPLATES:
-            continue
+    for cfn_type, enriched_vars in zip(resource_types, enriched_by_type):
         resources = resources_by_type[cfn_type]
         template = TEMPLATES[cfn_type]
-        [populate_resource_summary(template, r) for r in resources]
+        instrumentation.count("DisplayedResources", len(resources), resource_type=cfn_type)
+        cached = sum(populate_resource_summary(template, r, v, cfn_type) for r, v in zip(resources, enriched_vars))
+        instrumentation.count("FragmentCacheHits", cached, per_stack=False)
+        instrumentation.count("FragmentCacheMisses", len(resources) - cached, per_stack=False)
         if len(resources) > 0:
             resources_with_links[cfn_type] = resources
     return resources_with_links
 
 
-def get_stack_resources_by_type(cloudformation, stack_name):
-    """Return a list of StackResourceSummary grouped by CFN resource type."""
-    paginator = cloudformation.get_paginator('list_stack_resources')
-    response_iterator = paginator.paginate(StackName=stack_name)
+def iter_stack_resources(cloudformation, stack_name: str) -> Iterator[dict]:
+    """Yield the ListStackResources summaries of a stack as each page arrives."""
+    response_iterator = FETCH_ENGINE.pages(cloudformation, 'list_stack_resources', StackName=stack_name)
+    while True:
+        with instrumentation.span("ListStackResourcesPage"):
+            page = next(response_iterator, None)
+        if page is None:
+            return
+        yield from page["StackResourceSummaries"]
+
+
+def record_resources(resources: Iterator[dict], records: Dict[str, dict]) -> Iterator[dict]:
+    """Yield `resources`, keeping the type and ids of each in `records` by logical id."""
+    for resource in resources:
+        records[resource["LogicalResourceId"]] = stack_events.resource_record(resource)
+        yield resource
+
+
+def collect_nested_stacks(resources: Iterator[dict], nested_stacks: List[str]) -> Iterator[dict]:
+    """Yield `resources`, appending the stack ids of nested stacks to `nested_stacks`."""
+    for resource in resources:
+        if resource["ResourceType"] == "AWS::CloudFormation::Stack" and resource.get("PhysicalResourceId"):
+            nested_stacks.append(resource["PhysicalResourceId"])
+        yield resource
+
+
+def count_resource_types(resources: Iterator[dict], counts: Counter) -> Iterator[dict]:
+    """Yield `resources`, counting them by type in `counts`."""
+    for resource in resources:
+        counts[resource["ResourceType"]] += 1
+        yield resource
+
+
+def get_stack_resources_by_type(cloudformation, stack_name, resource_filter: Optional[ResourceFilter] = None,
+                                listed_counts: Optional[Counter] = None, nested_stacks: Optional[List[str]] = None):
+    """
+    Return a list of StackResourceSummary grouped by CFN resource type.
+
+    With a `resource_filter`, only resources of types in TEMPLATES that the filter selects are returned,
+    and other resources are dropped as pages arrive. `listed_counts`, when given, counts every listed
+    resource by type, and the stack ids of nested stacks are appended to `nested_stacks`.
+    """
+    return group_stack_resources(iter_stack_resources(cloudformation, stack_name), cloudformation.meta.region_name,
+                                 resource_filter, listed_counts, nested_stacks)
+
+
+def group_stack_resources(resources: Iterator[dict], region_name: str, resource_filter: Optional[ResourceFilter] = None,
+                          listed_counts: Optional[Counter] = None, nested_stacks: Optional[List[str]] = None,
+                          prefetch: Optional["EnrichmentPrefetch"] = None):
+    """
+    Group ListStackResources summaries by CFN resource type as StackResourceSummary objects, with the
+    failed, rolled back and drifted resources of each type first.
+
+    See get_stack_resources_by_type. Each resource is also added to `prefetch`, when given.
+    """
+    if listed_counts is not None:
+        resources = count_resource_types(resources, listed_counts)
+    if nested_stacks is not None:
+        resources = collect_nested_stacks(resources, nested_stacks)
+    if resource_filter is not None:
+        resources = resource_filter.select(resources, TEMPLATES)
     resources_by_type = defaultdict(list)
-    for page in response_iterator:
-        for resource in page["StackResourceSummaries"]:
-            resources_by_type[resource["ResourceType"]].append(StackResourceSummary(
-                physical_id=resource["PhysicalResourceId"],
-                logical_id=resource["LogicalResourceId"],
-                aws_region=cloudformation.meta.region_name
-            ))
+    for resource in resources:
+        summary = StackResourceSummary(
+            physical_id=resource["PhysicalResourceId"],
+            logical_id=resource["LogicalResourceId"],
+            aws_region=region_name
+        )
+        if prefetch is not None:
+            prefetch.add(resource["ResourceType"], summary)
+        summary.set_status(resource)
+        resources_by_type[resource["ResourceType"]].append(summary)
+    for summaries in resources_by_type.values():
+        summaries.sort(key=lambda summary: not summary.has_problem)
     return resources_by_type
 
 
@@ -242,8 +655,63 @@ def get_event_type(event):
     elif 'stacks' in event:
         logger.info("detected EVENT_TYPE_SUMMARIZE")
         return EVENT_TYPE_SUMMARIZE
+    elif any(record.get('eventSource') == 'aws:sqs' for record in event.get('Records', [])):
+        logger.info("detected EVENT_TYPE_NOTIFICATION")
+        return EVENT_TYPE_NOTIFICATION
+
 
+def parse_stack_notification(record: dict) -> dict:
+    """
+    Return the fields of a CloudFormation stack event notification delivered by an SQS record.
 
+    The record body is either an SNS notification wrapping the message or, with raw message
+    delivery, the message itself: lines of the form `Key='Value'`.
+    """
+    message = record["body"]
+    try:
+        envelope = json.loads(message)
+        if isinstance(envelope, dict) and "Message" in envelope:
+            message = envelope["Message"]
+    except ValueError:
+        pass
+    fields = {}
+    for line in message.splitlines():
+        key, separator, value = line.partition("=")
+        if separator:
+            fields[key.strip()] = value.strip().strip("'")
+    return fields
+
+
+def render_notifications(event, cloudformation) -> dict:
+    """
+    Re-render and store the summary of every stack named by a batch of SQS notification records.
+
+    Several notifications for the same stack are collapsed into one render. Returns a partial batch
+    response listing the records whose stack could not be rendered or stored.
+    """
+    if SUMMARY_STORE is None:
+        raise RuntimeError("SUMMARY_STORE must be configured to pre-render summaries from notifications")
+    message_ids_by_stack = defaultdict(list)
+    for record in event["Records"]:
+        stack_name = parse_stack_notification(record).get("StackName")
+        if not stack_name:
+            logger.warning("ignoring message without a stack name: %s", record.get("messageId"))
+            continue
+        message_ids_by_stack[stack_name].append(record["messageId"])
+
+    failures = []
+    for stack_name, message_ids in message_ids_by_stack.items():
+        logger.info("[%s] pre-rendering summary for %d notification(s)", stack_name, len(message_ids))
+        try:
+            summary = render_stack_summary(stack_name, cloudformation, force_refresh=True)
+            SUMMARY_STORE.put(stack_name, summary.html)
+        except Exception as e:
+            logger.error("[%s] could not pre-render summary", stack_name, exc_info=e)
+            failures += [{"itemIdentifier": message_id} for message_id in message_ids]
+    return {"batchItemFailures": failures}
+
+
+@functools.lru_cache(maxsize=None)
 def render_documentation():
     """
     Return markdown help text (used by CloudWatch console)
@@ -255,32 +723,219 @@ def render_documentation():
     return docs_markdown
 
 
-def render(event, cloudformation):
+def render_unavailable_summary(stack_name: str, reason: str) -> StackSummary:
+    """Return a StackSummary with an inline message in place of the stack's resources."""
+    return StackSummary(f"<p class=\"stack-message\">{html.escape(reason)}</p>", stack_name)
+
+
+def prepare_stack_summary_or_unavailable(stack_name: str, cloudformation, force_refresh: bool = False,
+                                         options: SummaryOptions = SummaryOptions(),
+                                         role_arn: Optional[str] = None) -> StackSummary:
+    """
+    Same as coalesced_prepare_stack_summary, but a stack that keeps getting throttled is rendered as timed
+    out, and a stack that cannot be accessed (its role cannot be assumed, or lacks access) as unavailable.
+    """
+    try:
+        with instrumentation.stack(stack_name):
+            return coalesced_prepare_stack_summary(stack_name, cloudformation, force_refresh=force_refresh,
+                                                   options=options, role_arn=role_arn)
+    except botocore.exceptions.ClientError as e:
+        code = e.response.get("Error", {}).get("Code")
+        if code in THROTTLING_ERROR_CODES:
+            logger.warning("[%s] throttled while summarizing stack: %s", stack_name, e)
+            return render_unavailable_summary(stack_name, f"timed out summarizing stack '{stack_name}' (throttled)")
+        if code in ACCESS_ERROR_CODES or e.operation_name == "AssumeRole":
+            logger.warning("[%s] could not access stack: %s", stack_name, e)
+            return render_unavailable_summary(stack_name, f"could not access stack '{stack_name}' ({code})")
+        raise
+
+
+def get_render_deadline(context) -> Optional[float]:
     """
-    Return HTML for rendering a custom widget.
+    Return the time.monotonic() value by which stack summaries must be ready, or None without a Lambda context.
+    """
+    if context is None:
+        return None
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - DEADLINE_MARGIN_SECONDS
+
+
+def stack_client(target: StackTarget, cloudformation):
+    """Return the CloudFormation client for `target`; `cloudformation` when it is in the Lambda's own account and region."""
+    if target.region is None and target.role_arn is None:
+        return cloudformation
+    return get_client("cloudformation", region_name=target.region, role_arn=target.role_arn)
+
+
+def render_stack_summaries(stacks: List[Union[str, StackTarget]], cloudformation, deadline: Optional[float] = None,
+                           force_refresh: bool = False, options: SummaryOptions = SummaryOptions()) -> List[StackSummary]:
+    """Summarize stacks concurrently, returning summaries in the same order as `stacks`; see iter_stack_summaries."""
+    return list(iter_stack_summaries(stacks, cloudformation, deadline, force_refresh, options))
+
+
+def iter_stack_summaries(stacks: List[Union[str, StackTarget]], cloudformation, deadline: Optional[float] = None,
+                         force_refresh: bool = False, options: SummaryOptions = SummaryOptions(),
+                         finish: bool = True) -> Iterator[StackSummary]:
+    """
+    Summarize stacks concurrently, yielding summaries in the same order as `stacks`.
+
+    `stacks` are stack names, looked up with `cloudformation`, or StackTargets in any account and region.
+
+    With `options.nested_depth` set, the nested stacks of each stack are summarized too, down to that
+    depth, and listed right after their parent. Every stack shares the one pool of STACK_WORKERS, and a
+    stack reachable from more than one listed stack is only summarized once.
+
+    Stacks that are not summarized by `deadline` are rendered as timed out instead. The metrics of the
+    resources of all stacks are fetched together, leaving out those not fetched by `deadline`, then each
+    summary is rendered as it is yielded, or without `finish`, left for the caller to render with
+    finish_stack_summary. Summaries are not kept once yielded.
+    """
+    if not stacks:
+        return
+    submitted = {}
+    # nested stacks submitted by stack id, the first summary made of each stack id, and the
+    # nested stacks of each stack whose nested stacks are summarized
+    nested_futures = {}
+    summarized = {}
+    expanded = {}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, STACK_WORKERS))
+    try:
+        def submit(target, depth):
+            future = executor.submit(contextvars.copy_context().run, prepare_stack_summary_or_unavailable,
+                                     target.name, stack_client(target, cloudformation), force_refresh, options,
+                                     target.role_arn)
+            submitted[future] = (target, depth)
+            return future
+
+        targets = [StackTarget.from_event(stack) for stack in stacks]
+        roots = [(target.name, submit(target, options.nested_depth)) for target in targets]
+        pending = set(submitted)
+        while pending:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = concurrent.futures.wait(pending, timeout=timeout,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                summary = future.result()
+                if not summary.stack_id:
+                    continue
+                summarized.setdefault(summary.stack_id, future)
+                target, depth = submitted[future]
+                if depth <= 0 or summary.stack_id in expanded:
+                    continue
+                expanded[summary.stack_id] = summary.nested_stacks
+                for nested_stack_id in summary.nested_stacks:
+                    if nested_stack_id not in nested_futures and nested_stack_id not in summarized:
+                        nested_futures[nested_stack_id] = submit(dataclasses.replace(target, name=nested_stack_id),
+                                                                 depth - 1)
+                        pending.add(nested_futures[nested_stack_id])
+
+        summaries = []
+        summarized_stack_ids = set()
+
+        def collect(stack_name, future, parent_name=None):
+            if not future.done():
+                logger.warning("[%s] stack summary not ready before deadline", stack_name)
+                summaries.append(render_unavailable_summary(stack_name, f"timed out summarizing stack '{stack_name}'"))
+                return
+            summary = future.result()
+            if summary.stack_id:
+                if summary.stack_id in summarized_stack_ids:
+                    return
+                summarized_stack_ids.add(summary.stack_id)
+            summary.parent_name = parent_name
+            summaries.append(summary)
+            for nested_stack_id in expanded.get(summary.stack_id, []):
+                nested_future = summarized.get(nested_stack_id) or nested_futures.get(nested_stack_id)
+                if nested_future:
+                    collect(nested_stack_id, nested_future, summary.name)
+
+        for stack_name, future in roots:
+            collect(stack_name, future)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    fetch_stack_metrics(summaries, deadline)
+    summaries.reverse()
+    while summaries:
+        summary = summaries.pop()
+        yield finish_stack_summary(summary) if finish else summary
+
+
+def bounded_html(summaries: Iterable[StackSummary], byte_budget: int) -> Iterator[str]:
+    """
+    Yield the html of `summaries`, rendered with finish_stack_summary, for as long as it fits in
+    `byte_budget` bytes.
+
+    The summaries that do not fit are left out whole, and a footer counting their resources is yielded
+    in their place. Room for the footer is kept within the budget. Once a summary is left out, the
+    summaries after it are only counted, not rendered.
+    """
+    byte_budget -= TRUNCATION_FOOTER_BYTES
+    left_out_stacks = 0
+    left_out_resources = 0
+    for summary in summaries:
+        if left_out_stacks:
+            left_out_stacks += 1
+            left_out_resources += (summary.displayed_resources if summary.html is not None
+                                   else sum(len(resources) for resources in summary.resources.values()))
+            continue
+        summary = finish_stack_summary(summary)
+        size = len(summary.html.encode())
+        if size > byte_budget:
+            left_out_stacks += 1
+            left_out_resources += summary.displayed_resources
+            continue
+        logger.info("creating summary for %s", summary.name)
+        byte_budget -= size
+        yield summary.html
+    if left_out_stacks:
+        logger.warning("output byte budget reached, %d stack(s) left out", left_out_stacks)
+        instrumentation.count("TruncatedStacks", left_out_stacks, per_stack=False)
+        stacks = f"{left_out_stacks} {'stack' if left_out_stacks == 1 else 'stacks'}"
+        left_out = f"{left_out_resources} more resources in {stacks}" if left_out_resources else f"{stacks} more"
+        yield f"<p class=\"stack-message\">{left_out} not shown (output size limit reached)</p>"
+
+
+def resolve_stack_targets(entries: List[Union[str, dict]], cloudformation) -> List[StackTarget]:
+    """
+    Return the StackTargets for the entries of the widget's `stacks`, resolving wildcard and tag selectors.
+
+    Selectors are resolved against the stack index of the account and region of their entry.
+    """
+    targets = []
+    for entry in entries:
+        target = StackTarget.from_event(entry)
+        if not stack_index.is_selector(target.name):
+            targets.append(target)
+            continue
+        client = stack_client(target, cloudformation)
+        stack_names = STACK_INDEX.resolve([target.name], client, key=(target.role_arn, client.meta.region_name))
+        targets += [dataclasses.replace(target, name=stack_name) for stack_name in stack_names]
+    return list(dict.fromkeys(targets))
+
+
+def render(event, cloudformation, context=None):
+    """
+    Return HTML for rendering a custom widget, or a partial batch response for notification events.
     """
     event_type = get_event_type(event)
-    summaries: List[StackSummary] = []
-    stack_names = []
+    stacks = []
     if event_type == EVENT_TYPE_SUMMARIZE:
-        stack_names += event["stacks"]
+        stacks += resolve_stack_targets(event["stacks"], cloudformation)
     elif event_type == EVENT_TYPE_DESCRIBE:
         return render_documentation()
+    elif event_type == EVENT_TYPE_NOTIFICATION:
+        return render_notifications(event, cloudformation)
     else:
         raise RuntimeError("unknown event type")
-    result = ''
-
-    for stack_name in stack_names:
-        stack_summary = render_stack_summary(
-            stack_name,
-            cloudformation=cloudformation
-        )
-        summaries.append(stack_summary)
 
-    for summary in summaries:
-        logger.info("creating summary for %s", summary.name)
-        result += summary.html
-    return result
+    force_refresh = bool(event.get("widgetContext", {}).get("forceRefresh"))
+    summaries = iter_stack_summaries(stacks, cloudformation, deadline=get_render_deadline(context),
+                                     force_refresh=force_refresh, options=SummaryOptions.from_event(event),
+                                     finish=False)
+    result = "".join(bounded_html(summaries, OUTPUT_BYTE_BUDGET - len(WIDGET_STYLE)))
+    logger.info("summary cache: %s", SUMMARY_CACHE.stats())
+    return WIDGET_STYLE + result
 
 
 DEBUG = 'true'
@@ -291,19 +946,28 @@ logger.setLevel(logging.INFO)
 
 def handler(event, context):
     """Lambda entry point."""
-    boto_session = boto3.Session()
-    cloudformation = boto_session.client("cloudformation")
+    with instrumentation.invocation() as recorder:
+        try:
+            with instrumentation.span("Handler"):
+                return render_widget(event, context, recorder)
+        finally:
+            instrumentation.emit()
+
+
+def render_widget(event, context, recorder: instrumentation.Recorder):
+    """Return the rendered widget, or the debug response built when rendering fails and DEBUG is 'true'."""
+    cloudformation = get_client("cloudformation")
     logging.info("event: %r", event)
 
     try:
-        return render(event, cloudformation)
+        return render(event, cloudformation, context)
     except BaseException as e:
         logger.error("exception during render", exc_info=e)
         response = {"event": event, "error": traceback.format_exception(type(e), e, sys.exc_info()[2])}
         error_message = "Error rendering widget"
         if context:
             log_url = render_cloudwatch_logs_url(
-                boto_session.region_name,
+                aws_clients.get_session().region_name,
                 context.log_group_name,
                 context.log_stream_name)
             error_message = "Error rendering widget: see error information in CloudWatch log stream: %s" % log_url
@@ -311,6 +975,7 @@ def handler(event, context):
             response['log_url'] = log_url
 
         if os.getenv('DEBUG') == 'true':
+            response['timings'] = recorder.breakdown()
             return json.dumps(response)
         else:
             raise Exception(error_message)
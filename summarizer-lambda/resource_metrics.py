@@ -0,0 +1,112 @@
+import concurrent.futures
+import contextvars
+import datetime
+import logging
+import time
+from collections import defaultdict
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import botocore.exceptions
+
+from resource_types.common import StackResourceSummary
+
+logger = logging.getLogger()
+
+SPARKLINE_CHARACTERS = "▁▂▃▄▅▆▇█"
+METRIC_PERIOD_SECONDS = 300
+METRIC_WINDOW = datetime.timedelta(hours=1)
+# GetMetricData accepts at most 500 queries per call
+GET_METRIC_DATA_MAX_QUERIES = 500
+
+
+def sparkline(datapoints: List[float]) -> str:
+    """Return a string of block characters tracing `datapoints`."""
+    if not datapoints:
+        return ""
+    low, high = min(datapoints), max(datapoints)
+    if high == low:
+        return SPARKLINE_CHARACTERS[0] * len(datapoints)
+    scale = (len(SPARKLINE_CHARACTERS) - 1) / (high - low)
+    return "".join(SPARKLINE_CHARACTERS[round((value - low) * scale)] for value in datapoints)
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.1f}"
+
+
+def fetch_resource_metrics(resources: Iterable[StackResourceSummary], cloudwatch_for_region: Callable,
+                           deadline: Optional[float] = None) -> int:
+    """
+    Fill in the recent datapoints of every metric of `resources`, returning the number of GetMetricData calls.
+
+    Metrics are queried together per region, in as few GetMetricData calls as possible, and the
+    regions are queried concurrently. `cloudwatch_for_region(region)` returns the CloudWatch client
+    used for a region. The metrics of regions not queried by `deadline` (a time.monotonic() time)
+    are left without datapoints, and so are not shown.
+    """
+    metrics_by_region = defaultdict(list)
+    for resource in resources:
+        for metric in resource.metrics:
+            metrics_by_region[metric["region"]].append(metric)
+    if not metrics_by_region:
+        return 0
+    if deadline is not None and time.monotonic() >= deadline:
+        logger.warning("deadline passed, resource metrics not fetched")
+        return 0
+
+    end_time = datetime.datetime.now(datetime.timezone.utc).replace(second=0, microsecond=0)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(metrics_by_region))
+    try:
+        # each region is queried in a copy of the caller's context, taken here rather than in the worker thread
+        futures = {executor.submit(contextvars.copy_context().run, fetch_region_metrics, region, metrics,
+                                   cloudwatch_for_region, end_time): metrics
+                   for region, metrics in metrics_by_region.items()}
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        done, not_done = concurrent.futures.wait(futures, timeout=timeout)
+    finally:
+        # regions still being queried are left behind, and their results dropped
+        executor.shutdown(wait=False, cancel_futures=True)
+    if not_done:
+        logger.warning("metrics of %d region(s) not fetched before deadline", len(not_done))
+    calls = 0
+    for future in done:
+        region_calls, datapoints = future.result()
+        calls += region_calls
+        for metric, values in zip(futures[future], datapoints):
+            if values is not None:
+                metric["datapoints"] += values
+                metric["sparkline"] = sparkline(metric["datapoints"])
+                metric["latest"] = format_value(metric["datapoints"][-1]) if metric["datapoints"] else None
+    logger.info("fetched %d resource metrics with %d GetMetricData call(s)",
+                sum(len(metrics) for metrics in metrics_by_region.values()), calls)
+    return calls
+
+
+def fetch_region_metrics(region: str, metrics: List[dict], cloudwatch_for_region: Callable,
+                         end_time: datetime.datetime) -> Tuple[int, List[Optional[List[float]]]]:
+    """
+    Return the number of GetMetricData calls made for `metrics`, all in `region`, and the datapoints
+    of each metric, or None for the metrics that could not be queried.
+    """
+    calls = 0
+    datapoints = [None] * len(metrics)
+    paginator = cloudwatch_for_region(region).get_paginator("get_metric_data")
+    for start in range(0, len(metrics), GET_METRIC_DATA_MAX_QUERIES):
+        batch = metrics[start:start + GET_METRIC_DATA_MAX_QUERIES]
+        queries = [{
+            "Id": f"m{i}",
+            "MetricStat": {"Metric": metric["metric"], "Period": METRIC_PERIOD_SECONDS, "Stat": metric["stat"]},
+            "ReturnData": True,
+        } for i, metric in enumerate(batch)]
+        values = [[] for _ in batch]
+        try:
+            for page in paginator.paginate(MetricDataQueries=queries, StartTime=end_time - METRIC_WINDOW,
+                                           EndTime=end_time, ScanBy="TimestampAscending"):
+                calls += 1
+                for result in page["MetricDataResults"]:
+                    values[int(result["Id"][1:])] += result["Values"]
+        except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+            logger.warning("could not get metric data in %s: %s", region, e)
+            continue
+        datapoints[start:start + len(batch)] = values
+    return calls, datapoints
@@ -0,0 +1,15 @@
+TEMPLATES = {
+    "AWS::CloudFront::Distribution": {
+        "label": "{{ physical_id }}",
+        "resource_link": "https://console.aws.amazon.com/cloudfront/v3/home#/distributions/{{ physical_id }}",
+        "links": {
+            "Metrics": "https://console.aws.amazon.com/cloudfront/v3/home#/monitoring/distribution/{{ physical_id }}"
+        },
+        "metrics": [
+            {"label": "Requests", "namespace": "AWS/CloudFront", "name": "Requests", "stat": "Sum", "region": "us-east-1",
+             "dimensions": {"DistributionId": "{{ physical_id }}", "Region": "Global"}},
+            {"label": "5xx", "namespace": "AWS/CloudFront", "name": "5xxErrorRate", "stat": "Average", "region": "us-east-1",
+             "dimensions": {"DistributionId": "{{ physical_id }}", "Region": "Global"}},
+        ]
+    }
+}
@@ -0,0 +1,8 @@
+TEMPLATES = {
+    "AWS::CloudWatch::Alarm": {
+        "label": "{{ physical_id }}",
+        "resource_link": "https://console.aws.amazon.com/cloudwatch/home?region={{ region }}#alarmsV2:alarm/{{ physical_id }}",
+        "links": {},
+        "metrics": []
+    }
+}
@@ -1,27 +1,334 @@
-from collections import OrderedDict
+import datetime
+import fnmatch
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Mapping
 from dataclasses import dataclass, field
+from functools import cached_property, wraps
+from typing import Callable, Collection, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
+import instrumentation
 
-@dataclass
-class StackSummary:
-    """A summary with rendered-html for a single stack."""
-    html: str
-    name: str
 
+# drift statuses of resources that no longer match their template
+DRIFTED_STATUSES = {"MODIFIED", "DELETED"}
 
-@dataclass
+
+def resource_status_severity(status: Optional[str], drift_status: Optional[str] = None) -> Optional[str]:
+    """
+    Return "problem" for a failed, rolled back or drifted resource, "progress" while its stack operation
+    is in progress, or None for a healthy resource.
+    """
+    if status and (status.endswith("_FAILED") or "ROLLBACK" in status) or drift_status in DRIFTED_STATUSES:
+        return "problem"
+    if status and status.endswith("_IN_PROGRESS"):
+        return "progress"
+    return None
+
+
+# every distinct sequence of link labels, so that resources with the same links (usually all resources of
+# a type) share one tuple of labels
+_link_labels = {(): ()}
+
+
+class Links(Mapping):
+    """
+    The links of a resource, read as {label: {"label": label, "href": href}}.
+
+    Only the hrefs are stored per resource; the labels are interned and shared by every Links with the
+    same labels.
+    """
+    __slots__ = ("_labels", "_hrefs")
+
+    def __init__(self):
+        self._labels = ()
+        self._hrefs = ()
+
+    def add(self, label: str, href: str):
+        if label in self._labels:
+            hrefs = list(self._hrefs)
+            hrefs[self._labels.index(label)] = href
+            self._hrefs = tuple(hrefs)
+            return
+        labels = self._labels + (sys.intern(label),)
+        self._labels = _link_labels.setdefault(labels, labels)
+        self._hrefs += (href,)
+
+    def __getitem__(self, label: str) -> dict:
+        try:
+            return {"label": label, "href": self._hrefs[self._labels.index(label)]}
+        except ValueError:
+            raise KeyError(label) from None
+
+    def __iter__(self):
+        return iter(self._labels)
+
+    def __len__(self):
+        return len(self._labels)
+
+    def __repr__(self):
+        return f"Links({dict(zip(self._labels, self._hrefs))!r})"
+
+
+@dataclass(slots=True)
 class StackResourceSummary:
     """An single resource of a CFN stack."""
     physical_id: str
     logical_id: str
     aws_region: str
-    links: OrderedDict = field(default_factory=OrderedDict)
+    links: Links = field(default_factory=Links)
     label: str = None
     href: str = None
+    # a shared empty tuple until the first metric is added
+    metrics: Sequence[dict] = ()
+    status: str = None
+    status_reason: str = None
+    last_updated: datetime.datetime = None
+    drift_status: str = None
+
+    def set_status(self, resource: dict):
+        """Set the status of the resource from its ListStackResources summary."""
+        self.status = sys.intern(resource["ResourceStatus"]) if resource.get("ResourceStatus") else None
+        self.status_reason = resource.get("ResourceStatusReason")
+        self.last_updated = resource.get("LastUpdatedTimestamp")
+        drift_status = (resource.get("DriftInformation") or {}).get("StackResourceDriftStatus")
+        self.drift_status = sys.intern(drift_status) if drift_status else None
+
+    @property
+    def status_severity(self) -> Optional[str]:
+        """The severity of the resource's status alone, as returned by resource_status_severity."""
+        return resource_status_severity(self.status)
+
+    @property
+    def has_problem(self) -> bool:
+        return resource_status_severity(self.status, self.drift_status) == "problem"
+
+    @property
+    def drifted(self) -> bool:
+        return self.drift_status in DRIFTED_STATUSES
 
     def set_resource_link(self, label: str, href: str):
         self.label = label
         self.href = href
 
     def add_link(self, label: str, href: str):
-        self.links[label] = {"label": label, "href": href}
+        self.links.add(label, href)
+
+    def add_metric(self, label: str, aws_region: str, metric: dict, stat: str):
+        """Add a CloudWatch metric (as accepted by GetMetricData) whose recent datapoints are shown with the resource."""
+        if not self.metrics:
+            self.metrics = []
+        self.metrics.append({"label": label, "region": aws_region, "metric": metric, "stat": stat, "datapoints": []})
+
+
+@dataclass
+class StackSummary:
+    """
+    A summary with rendered-html for a single stack.
+
+    Until its html is rendered, a summary holds the summarized resources and details needed to render it.
+    """
+    html: str
+    name: str
+    resources: Mapping[str, List[StackResourceSummary]] = None
+    resource_count: int = 0
+    aws_region: str = None
+    cache_key: str = None
+    omitted_by_type: Mapping[str, int] = None
+    stack_id: str = None
+    nested_stacks: List[str] = field(default_factory=list)
+    parent_name: str = None
+    role_arn: str = None
+    displayed_resources: int = 0
+
+
+@dataclass(frozen=True)
+class StackTarget:
+    """
+    A stack to summarize: its name or id, and the region and IAM role to reach it with.
+
+    Without `region` or `role_arn`, the stack is looked up in the Lambda's own region and account.
+    """
+    name: str
+    region: Optional[str] = None
+    role_arn: Optional[str] = None
+
+    @classmethod
+    def from_event(cls, entry: Union[str, dict, "StackTarget"]):
+        """Return the target for an entry of the widget's `stacks`: a stack name, or a dict with name, region and roleArn."""
+        if isinstance(entry, StackTarget):
+            return entry
+        if isinstance(entry, str):
+            return cls(entry)
+        return cls(entry["name"], entry.get("region"), entry.get("roleArn"))
+
+
+def _glob_pattern(globs: Iterable[str]):
+    """Return a compiled regular expression matching any of the shell-style `globs`."""
+    return re.compile("|".join(fnmatch.translate(glob) for glob in globs))
+
+
+@dataclass(frozen=True)
+class ResourceFilter:
+    """
+    Selects which listed stack resources are summarized.
+
+    Types and logical ids are matched with shell-style globs (e.g. `AWS::ECS::*`, `Api*`). With
+    `problems_only`, only failed, rolled back and drifted resources are selected. Once
+    `max_rows_per_type` resources of a type are selected, further healthy resources of that type are
+    skipped; failed, rolled back and drifted resources are selected past the cap, wherever they are listed.
+    """
+    include_types: Optional[Tuple[str, ...]] = None
+    exclude_types: Tuple[str, ...] = ()
+    logical_ids: Optional[Tuple[str, ...]] = None
+    max_rows_per_type: Optional[int] = None
+    problems_only: bool = False
+
+    @classmethod
+    def from_event(cls, event: dict):
+        """Return the filter given by the `resourceTypes`, `excludeResourceTypes`, `logicalIds`, `maxRowsPerType` and `problemsOnly` widget parameters."""
+        def globs(name):
+            value = event.get(name)
+            return tuple([value] if isinstance(value, str) else value) if value else None
+
+        max_rows = event.get("maxRowsPerType")
+        return cls(
+            include_types=globs("resourceTypes"),
+            exclude_types=globs("excludeResourceTypes") or (),
+            logical_ids=globs("logicalIds"),
+            max_rows_per_type=int(max_rows) if max_rows is not None else None,
+            problems_only=bool(event.get("problemsOnly")),
+        )
+
+    @cached_property
+    def _include_types(self):
+        return _glob_pattern(self.include_types) if self.include_types is not None else None
+
+    @cached_property
+    def _exclude_types(self):
+        return _glob_pattern(self.exclude_types) if self.exclude_types else None
+
+    @cached_property
+    def _logical_ids(self):
+        return _glob_pattern(self.logical_ids) if self.logical_ids is not None else None
+
+    def matches_type(self, resource_type: str) -> bool:
+        if self._include_types is not None and not self._include_types.match(resource_type):
+            return False
+        return not (self._exclude_types and self._exclude_types.match(resource_type))
+
+    def select(self, resources: Iterable[dict], summarized_types: Collection[str] = None) -> Iterator[dict]:
+        """
+        Yield the ListStackResources summaries in `resources` that the filter selects, skipping
+        types not in `summarized_types` (when given) before anything else is checked.
+        """
+        type_matches = {}
+        selected = Counter()
+        for resource in resources:
+            resource_type = resource["ResourceType"]
+            if summarized_types is not None and resource_type not in summarized_types:
+                continue
+            matches = type_matches.get(resource_type)
+            if matches is None:
+                matches = type_matches[resource_type] = self.matches_type(resource_type)
+            if not matches:
+                continue
+            if self._logical_ids is not None and not self._logical_ids.match(resource["LogicalResourceId"]):
+                continue
+            has_problem = resource_status_severity(
+                resource.get("ResourceStatus"),
+                (resource.get("DriftInformation") or {}).get("StackResourceDriftStatus")) == "problem"
+            if self.problems_only and not has_problem:
+                continue
+            if (self.max_rows_per_type is not None and selected[resource_type] >= self.max_rows_per_type
+                    and not has_problem):
+                continue
+            selected[resource_type] += 1
+            yield resource
+
+
+MAX_NESTED_DEPTH = 5
+
+
+@dataclass(frozen=True)
+class SummaryOptions:
+    """
+    Widget parameters that change what a stack summary contains.
+
+    `nested_depth` is how many levels of nested stacks are summarized below each listed stack.
+    """
+    resource_filter: ResourceFilter = ResourceFilter()
+    nested_depth: int = 0
+
+    @classmethod
+    def from_event(cls, event: dict):
+        return cls(
+            resource_filter=ResourceFilter.from_event(event),
+            nested_depth=max(0, min(int(event.get("nestedDepth", 0)), MAX_NESTED_DEPTH)),
+        )
+
+    @property
+    def is_default(self) -> bool:
+        return self == SummaryOptions()
+
+    def cache_key(self) -> str:
+        """Return a string identifying these options, to keep summaries with different options apart."""
+        return "" if self.is_default else repr(self)
+
+
+# A batch enricher receives every resource of one type and a function returning a boto3 client for a
+# service name, and returns one dict of template variables per resource, in the same order. It may set
+# `prefetch_batch_size` to the most resources it looks up with calls made at once, so that resources
+# prefetched while their stack is listed are passed to it in batches taking a single round of calls.
+BatchEnricher = Callable[[List[StackResourceSummary], Callable], List[dict]]
+
+ENRICHMENT_CACHE_TTL_SECONDS = float(os.getenv("ENRICHMENT_CACHE_TTL_SECONDS", "60"))
+
+
+def per_resource(enricher: Callable[[StackResourceSummary], dict]) -> BatchEnricher:
+    """Adapt an enricher taking a single StackResourceSummary to the batch enricher interface."""
+    @wraps(enricher)
+    def batch_enricher(resources: List[StackResourceSummary], clients) -> List[dict]:
+        return [enricher(resource) for resource in resources]
+    return batch_enricher
+
+
+def chunks(items: list, size: int):
+    """Yield successive lists of at most `size` items."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def memoized(batch_enricher: BatchEnricher, ttl_seconds: float = None) -> BatchEnricher:
+    """
+    Cache the results of a batch enricher per resource for `ttl_seconds`, so only resources without a
+    fresh result are passed to it.
+    """
+    results = {}
+    lock = threading.Lock()
+
+    @wraps(batch_enricher)
+    def memoized_enricher(resources: List[StackResourceSummary], clients) -> List[dict]:
+        ttl = ENRICHMENT_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        now = time.monotonic()
+        keys = [(r.aws_region, r.physical_id) for r in resources]
+        with lock:
+            cached = {key: results[key][1] for key in keys if key in results and results[key][0] > now}
+        missing = [r for r, key in zip(resources, keys) if key not in cached]
+        instrumentation.count("EnrichmentCacheHits", len(resources) - len(missing), per_stack=False)
+        instrumentation.count("EnrichmentCacheMisses", len(missing), per_stack=False)
+        if missing:
+            fetched = batch_enricher(missing, clients)
+            with lock:
+                for r, variables in zip(missing, fetched):
+                    if variables:
+                        results[(r.aws_region, r.physical_id)] = (now + ttl, variables)
+            cached.update(((r.aws_region, r.physical_id), variables) for r, variables in zip(missing, fetched))
+        return [cached[key] for key in keys]
+
+    memoized_enricher.cache_clear = results.clear
+    return memoized_enricher
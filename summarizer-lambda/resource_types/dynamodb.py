@@ -0,0 +1,15 @@
+TEMPLATES = {
+    "AWS::DynamoDB::Table": {
+        "label": "{{ physical_id }}",
+        "resource_link": "https://console.aws.amazon.com/dynamodb/home?region={{ region }}#tables:selected={{ physical_id }};tab=overview",
+        "links": {
+            "Metrics": "https://console.aws.amazon.com/dynamodb/home?region={{ region }}#tables:selected={{ physical_id }};tab=metrics"
+        },
+        "metrics": [
+            {"label": "Read", "namespace": "AWS/DynamoDB", "name": "ConsumedReadCapacityUnits", "stat": "Sum",
+             "dimensions": {"TableName": "{{ physical_id }}"}},
+            {"label": "Write", "namespace": "AWS/DynamoDB", "name": "ConsumedWriteCapacityUnits", "stat": "Sum",
+             "dimensions": {"TableName": "{{ physical_id }}"}},
+        ]
+    }
+}
@@ -1,4 +1,46 @@
-from resource_types.common import StackResourceSummary
+import logging
+from collections import defaultdict
+from typing import List
+
+import botocore.exceptions
+
+from resource_types.common import StackResourceSummary, chunks, memoized
+
+logger = logging.getLogger()
+
+# DescribeServices accepts at most 10 services per call, all from the same cluster
+DESCRIBE_SERVICES_BATCH_SIZE = 10
+
+TEMPLATES = {
+    "AWS::ECS::TaskDefinition": {
+        "label": "{{ name }}:{{ version }}",
+        "resource_link": "https://console.aws.amazon.com/ecs/home?region={{ region }}#/taskDefinitions/{{ name }}/{{ version }}",
+        "links": {},
+        "metrics": [],
+        "enrichers": [
+            "resource_types.ecs:enrich_task_definition"
+        ]
+    },
+    "AWS::ECS::Service": {
+        "label": "{{ service_name }}{% if desired_count is defined %} ({{ running_count }}/{{ desired_count }} tasks running){% endif %}",
+        "resource_link": "{{ base_url }}/details",
+        "links": {
+            "Events": "{{ base_url }}/events",
+            "Metrics": "{{ base_url }}/metrics",
+            "Logs": "{{ base_url }}/logs",
+        },
+        "metrics": [
+            {"label": "CPU %", "namespace": "AWS/ECS", "name": "CPUUtilization", "stat": "Average",
+             "dimensions": {"ClusterName": "{{ cluster_name }}", "ServiceName": "{{ service_name }}"}},
+        ],
+        "enrichers": [
+            "resource_types.ecs:enrich_service"
+        ],
+        "batch_enrichers": [
+            "resource_types.ecs:describe_services"
+        ]
+    }
+}
 
 
 def enrich_task_definition(resource: StackResourceSummary) -> dict:
@@ -21,3 +63,30 @@ def enrich_service(resource: StackResourceSummary) -> dict:
         "cluster_name": cluster_name,
         "base_url": base_url
     }
+
+
+@memoized
+def describe_services(resources: List[StackResourceSummary], clients) -> List[dict]:
+    """Add the desired and running task counts of each service, describing up to 10 per call."""
+    services_by_cluster = defaultdict(list)
+    for r in resources:
+        services_by_cluster[enrich_service(r)["cluster_name"]].append(r.physical_id)
+
+    services = {}
+    ecs = clients("ecs")
+    for cluster_name, service_arns in services_by_cluster.items():
+        for batch in chunks(service_arns, DESCRIBE_SERVICES_BATCH_SIZE):
+            try:
+                response = ecs.describe_services(cluster=cluster_name, services=batch)
+            except botocore.exceptions.ClientError as e:
+                logger.warning("could not describe services in cluster '%s': %s", cluster_name, e)
+                continue
+            for service in response["services"]:
+                services[service["serviceArn"]] = {
+                    "desired_count": service["desiredCount"],
+                    "running_count": service["runningCount"],
+                }
+    return [services.get(r.physical_id, {}) for r in resources]
+
+
+describe_services.prefetch_batch_size = DESCRIBE_SERVICES_BATCH_SIZE
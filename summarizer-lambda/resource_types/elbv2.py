@@ -1,4 +1,46 @@
-from resource_types.common import StackResourceSummary
+import logging
+from typing import List
+
+import botocore.exceptions
+
+from resource_types.common import StackResourceSummary, chunks, memoized
+
+logger = logging.getLogger()
+
+# DescribeLoadBalancers accepts at most 20 load balancer ARNs per call
+DESCRIBE_LOAD_BALANCERS_BATCH_SIZE = 20
+# the CloudWatch namespace (after "AWS/") of the metrics of each type of load balancer, by its type in the ARN
+METRIC_NAMESPACES = {"app": "ApplicationELB", "net": "NetworkELB", "gwy": "GatewayELB"}
+
+TEMPLATES = {
+    "AWS::ElasticLoadBalancingV2::LoadBalancer": {
+        "label": "{{ load_balancer_type }}: {{ physical_id }}{% if state %} ({{ state }}){% endif %}",
+        "resource_link": "https://console.aws.amazon.com/ec2/v2/home?region={{ region }}#LoadBalancers:search={{ name }};sort=loadBalancerName",
+        "links": {
+            "CloudWatch Metrics": "https://console.aws.amazon.com/cloudwatch/home?region={{ region }}#metricsV2:graph=~(view~'timeSeries~stacked~false~region~'{{ region }}~start~'-PT1H~end~'P0D);query=~'*7bAWS*2f{{ metric_namespace }}*2cLoadBalancer*7d*20LoadBalancer*3d*22{{ cloudwatch_id }}*22"
+        },
+        "metrics": [
+            {"label": "Requests", "namespace": "AWS/ApplicationELB", "name": "RequestCount", "stat": "Sum",
+             "dimensions": {"LoadBalancer": "{{ metric_id }}"}, "when": "{{ load_balancer_type == 'app' }}"},
+            {"label": "5xx", "namespace": "AWS/ApplicationELB", "name": "HTTPCode_ELB_5XX_Count", "stat": "Sum",
+             "dimensions": {"LoadBalancer": "{{ metric_id }}"}, "when": "{{ load_balancer_type == 'app' }}"},
+            {"label": "Flows", "namespace": "AWS/NetworkELB", "name": "ActiveFlowCount", "stat": "Average",
+             "dimensions": {"LoadBalancer": "{{ metric_id }}"}, "when": "{{ load_balancer_type == 'net' }}"},
+            {"label": "Bytes", "namespace": "AWS/NetworkELB", "name": "ProcessedBytes", "stat": "Sum",
+             "dimensions": {"LoadBalancer": "{{ metric_id }}"}, "when": "{{ load_balancer_type == 'net' }}"},
+            {"label": "Flows", "namespace": "AWS/GatewayELB", "name": "ActiveFlowCount", "stat": "Average",
+             "dimensions": {"LoadBalancer": "{{ metric_id }}"}, "when": "{{ load_balancer_type == 'gwy' }}"},
+            {"label": "Bytes", "namespace": "AWS/GatewayELB", "name": "ProcessedBytes", "stat": "Sum",
+             "dimensions": {"LoadBalancer": "{{ metric_id }}"}, "when": "{{ load_balancer_type == 'gwy' }}"},
+        ],
+        "enrichers": [
+            "resource_types.elbv2:enrich_load_balancer_summary"
+        ],
+        "batch_enrichers": [
+            "resource_types.elbv2:describe_load_balancers"
+        ]
+    }
+}
 
 
 def enrich_load_balancer_summary(resource: StackResourceSummary) -> dict:
@@ -7,6 +49,30 @@ def enrich_load_balancer_summary(resource: StackResourceSummary) -> dict:
     variables = {
         "name": name,
         "load_balancer_type": load_balancer_type,
-        "cloudwatch_id": '*2f'.join((load_balancer_type, name, id))
+        "metric_namespace": METRIC_NAMESPACES.get(load_balancer_type, "ApplicationELB"),
+        "cloudwatch_id": '*2f'.join((load_balancer_type, name, id)),
+        "metric_id": '/'.join((load_balancer_type, name, id))
     }
     return variables
+
+
+@memoized
+def describe_load_balancers(resources: List[StackResourceSummary], clients) -> List[dict]:
+    """Add the DNS name and state of each load balancer, describing up to 20 per call."""
+    load_balancers = {}
+    elbv2 = clients("elbv2")
+    for batch in chunks([r.physical_id for r in resources], DESCRIBE_LOAD_BALANCERS_BATCH_SIZE):
+        try:
+            response = elbv2.describe_load_balancers(LoadBalancerArns=batch)
+        except botocore.exceptions.ClientError as e:
+            logger.warning("could not describe load balancers: %s", e)
+            continue
+        for load_balancer in response["LoadBalancers"]:
+            load_balancers[load_balancer["LoadBalancerArn"]] = {
+                "dns_name": load_balancer["DNSName"],
+                "state": load_balancer["State"]["Code"],
+            }
+    return [load_balancers.get(r.physical_id, {}) for r in resources]
+
+
+describe_load_balancers.prefetch_batch_size = DESCRIBE_LOAD_BALANCERS_BATCH_SIZE
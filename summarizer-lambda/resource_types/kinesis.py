@@ -0,0 +1,13 @@
+TEMPLATES = {
+    "AWS::Kinesis::Stream": {
+        "label": "{{ physical_id }}",
+        "resource_link": "https://console.aws.amazon.com/kinesis/home?region={{ region }}#/streams/details/{{ physical_id }}/details",
+        "links": {
+            "Metrics": "https://console.aws.amazon.com/kinesis/home?region={{ region }}#/streams/details/{{ physical_id }}/monitoring"
+        },
+        "metrics": [
+            {"label": "Records", "namespace": "AWS/Kinesis", "name": "IncomingRecords", "stat": "Sum",
+             "dimensions": {"StreamName": "{{ physical_id }}"}},
+        ]
+    }
+}
@@ -0,0 +1,16 @@
+TEMPLATES = {
+    "AWS::Lambda::Function": {
+        "label": "{{ physical_id }}",
+        "resource_link": "https://console.aws.amazon.com/lambda/home?region={{ region }}#functions/{{ physical_id }}",
+        "links": {
+            "Logs Insights": "https://console.aws.amazon.com/cloudwatch/home?region={{ region }}#logsV2:logs-insights$3FqueryDetail$3D$257E$2528end$257E0$257Estart$257E-3600$257EtimeType$257E$2527RELATIVE$257Eunit$257E$2527seconds$257EeditorString$257E$2527fields*20*40timestamp*2c*20*40message*0a*7c*20sort*20*40timestamp*20desc*0a*7c*20limit*2020$257EisLiveTail$257Efalse$257EqueryId$257E$2527d2ee3780-2d3d-42c6-98cf-e483b2f3f85f$257Esource$257E$2528$257E$2527*2faws*2flambda*2f{{ physical_id }}$2529$2529",
+            "Monitoring": "https://console.aws.amazon.com/lambda/home?region={{ region }}#/functions/{{ physical_id }}?tab=monitoring",
+        },
+        "metrics": [
+            {"label": "Invocations", "namespace": "AWS/Lambda", "name": "Invocations", "stat": "Sum",
+             "dimensions": {"FunctionName": "{{ physical_id }}"}},
+            {"label": "Errors", "namespace": "AWS/Lambda", "name": "Errors", "stat": "Sum",
+             "dimensions": {"FunctionName": "{{ physical_id }}"}},
+        ]
+    }
+}
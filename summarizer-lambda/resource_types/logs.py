@@ -0,0 +1,13 @@
+TEMPLATES = {
+    "AWS::Logs::LogGroup": {
+        "label": "{{ physical_id }}",
+        "resource_link": "https://console.aws.amazon.com/cloudwatch/home?region={{ region }}#logsV2:log-groups/log-group/{{ physical_id }}",
+        "links": {
+            "Logs Insights": "https://console.aws.amazon.com/cloudwatch/home?region={{ region }}#logsV2:logs-insights$3FqueryDetail$3D~(end~0~start~-3600~timeType~'RELATIVE~unit~'seconds~editorString~'~isLiveTail~false~queryId~'~source~(~'{{ physical_id }}))",
+        },
+        "metrics": [
+            {"label": "Events", "namespace": "AWS/Logs", "name": "IncomingLogEvents", "stat": "Sum",
+             "dimensions": {"LogGroupName": "{{ physical_id }}"}},
+        ]
+    }
+}
@@ -0,0 +1,125 @@
+"""
+The registry of resource type templates, and the index of the resource_types modules declaring them.
+
+After adding a module, or a type to a module's TEMPLATES, rebuild the index from the summarizer-lambda
+directory:
+
+    python -m resource_types.registry
+"""
+import importlib
+import json
+import os
+import pkgutil
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+PACKAGE = "resource_types"
+INDEX_PATH = Path(__file__).with_name("index.json")
+# modules of the package that declare no templates
+SUPPORT_MODULES = {"common", "registry"}
+# keys every template must have; see populate_resource_summary
+REQUIRED_KEYS = ("label", "resource_link")
+
+
+class TemplateRegistry(Mapping):
+    """
+    The templates of the summarized resource types, by CFN resource type.
+
+    Each module of the resource_types package declares the templates of its types in a TEMPLATES dict,
+    and `index` maps every type to its module. A module is only imported the first time one of its types
+    is looked up. `user_templates` are added to, and take precedence over, the templates of the modules.
+    """
+
+    def __init__(self, index: Mapping[str, str], user_templates: Optional[Mapping[str, dict]] = None):
+        self._index = dict(index)
+        self._templates = dict(user_templates or {})
+
+    @classmethod
+    def from_environment(cls):
+        """Return a registry of the indexed modules and the templates configured by load_user_templates."""
+        return cls(load_index(), load_user_templates())
+
+    def __getitem__(self, resource_type: str) -> dict:
+        try:
+            return self._templates[resource_type]
+        except KeyError:
+            module = importlib.import_module(self._index[resource_type])
+        for module_type, template in module.TEMPLATES.items():
+            self._templates.setdefault(module_type, template)
+        return self._templates[resource_type]
+
+    def __contains__(self, resource_type) -> bool:
+        return resource_type in self._templates or resource_type in self._index
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._index
+        yield from (resource_type for resource_type in self._templates if resource_type not in self._index)
+
+    def __len__(self) -> int:
+        return len(self._index.keys() | self._templates.keys())
+
+
+def load_index(path: Path = INDEX_PATH) -> Dict[str, str]:
+    """Return the index of {resource type: module name} written by build_index."""
+    with open(path) as index_file:
+        return json.load(index_file)
+
+
+def build_index() -> Dict[str, str]:
+    """Return the index of every resource type declared by a module of the resource_types package, sorted by type."""
+    index = {}
+    for module_info in pkgutil.iter_modules([str(INDEX_PATH.parent)]):
+        if module_info.name in SUPPORT_MODULES:
+            continue
+        module_name = f"{PACKAGE}.{module_info.name}"
+        for resource_type in importlib.import_module(module_name).TEMPLATES:
+            if resource_type in index:
+                raise ValueError(f"{resource_type} is declared by both {index[resource_type]} and {module_name}")
+            index[resource_type] = module_name
+    return dict(sorted(index.items()))
+
+
+def load_user_templates() -> Dict[str, dict]:
+    """
+    Return the templates configured without deploying code: from the JSON file named by the
+    RESOURCE_TEMPLATES_FILE environment variable, then from the JSON in RESOURCE_TEMPLATES, which
+    takes precedence.
+
+    Both hold an object of {resource type: template}, in the format of the TEMPLATES of the resource_types
+    modules. Enrichers are named by "module:function" references, to modules on the Lambda's path.
+    """
+    templates = {}
+    path = os.getenv("RESOURCE_TEMPLATES_FILE")
+    if path:
+        with open(path) as templates_file:
+            templates.update(parse_user_templates(templates_file.read(), path))
+    if os.getenv("RESOURCE_TEMPLATES"):
+        templates.update(parse_user_templates(os.environ["RESOURCE_TEMPLATES"], "RESOURCE_TEMPLATES"))
+    return templates
+
+
+def parse_user_templates(source: str, origin: str) -> Dict[str, dict]:
+    """Parse and check the JSON templates in `source`, read from `origin`, raising ValueError if they are invalid."""
+    try:
+        templates = json.loads(source)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"templates in {origin} are not valid JSON: {e}") from None
+    if not isinstance(templates, dict):
+        raise ValueError(f"templates in {origin} must be an object of {{resource type: template}}")
+    for resource_type, template in templates.items():
+        missing = [key for key in REQUIRED_KEYS if not isinstance(template, dict) or key not in template]
+        if missing:
+            raise ValueError(f"template for {resource_type} in {origin} is missing {', '.join(missing)}")
+        template.setdefault("links", {})
+    return templates
+
+
+def main():
+    with open(INDEX_PATH, "w") as index_file:
+        json.dump(build_index(), index_file, indent=2)
+        index_file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
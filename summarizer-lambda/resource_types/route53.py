@@ -0,0 +1,13 @@
+TEMPLATES = {
+    "AWS::Route53::HostedZone": {
+        "label": "{{ physical_id }}",
+        "resource_link": "https://us-east-1.console.aws.amazon.com/route53/v2/hostedzones#ListRecordSets/{{ physical_id }}",
+        "links": {
+            "Query Metrics": "https://{{ region }}.console.aws.amazon.com/cloudwatch/home?region={{ region }}#metricsV2:graph=~(metrics~(~(~'AWS*2fRoute53~'DNSQueries~'HostedZoneId~'{{ physical_id }}~(region~'us-east-1)))~view~'timeSeries~stacked~false~region~'{{ region }}~stat~'Sum~period~300);query=~'*7bAWS*2fRoute53*2cHostedZoneId*7d;region=us-east-1;forwardXA=no"
+        },
+        "metrics": [
+            {"label": "Queries", "namespace": "AWS/Route53", "name": "DNSQueries", "stat": "Sum", "region": "us-east-1",
+             "dimensions": {"HostedZoneId": "{{ physical_id }}"}},
+        ]
+    }
+}
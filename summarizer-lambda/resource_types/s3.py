@@ -0,0 +1,10 @@
+TEMPLATES = {
+    "AWS::S3::Bucket": {
+        "label": "{{ physical_id }}",
+        "resource_link": "https://us-east-1.console.aws.amazon.com/s3/buckets/{{ physical_id }}?region={{ region }}&tab=objects",
+        "links": {
+            "Metrics": "https://us-east-1.console.aws.amazon.com/s3/buckets/{{ physical_id }}?region={{ region }}&tab=metrics"
+        },
+        "metrics": []
+    }
+}
@@ -1,6 +1,35 @@
+import concurrent.futures
+import contextvars
+import logging
 import urllib.parse
+from typing import List
 
-from resource_types.common import StackResourceSummary
+import botocore.exceptions
+
+from resource_types.common import StackResourceSummary, memoized
+
+logger = logging.getLogger()
+
+# GetQueueAttributes has no batch form, so queues are looked up concurrently
+QUEUE_ATTRIBUTE_WORKERS = 8
+
+TEMPLATES = {
+    "AWS::SQS::Queue": {
+        "label": "{{ queue_path }}{% if messages_visible is defined %} ({{ messages_visible }} visible, {{ messages_in_flight }} in flight){% endif %}",
+        "resource_link": "https://console.aws.amazon.com/sqs/v2/home?region={{ region }}#/queues/{{ encoded_url }}",
+        "links": {},
+        "metrics": [
+            {"label": "Visible", "namespace": "AWS/SQS", "name": "ApproximateNumberOfMessagesVisible", "stat": "Maximum",
+             "dimensions": {"QueueName": "{{ queue_path }}"}},
+        ],
+        "enrichers": [
+            "resource_types.sqs:enrich_sqs_queue"
+        ],
+        "batch_enrichers": [
+            "resource_types.sqs:get_queue_depths"
+        ]
+    }
+}
 
 
 def enrich_sqs_queue(resource: StackResourceSummary) -> dict:
@@ -8,3 +37,31 @@ def enrich_sqs_queue(resource: StackResourceSummary) -> dict:
         "queue_path": resource.physical_id.split('/')[-1],
         "encoded_url": urllib.parse.quote_plus(resource.physical_id)
     }
+
+
+@memoized
+def get_queue_depths(resources: List[StackResourceSummary], clients) -> List[dict]:
+    """Add the number of visible and in-flight messages of each queue."""
+    sqs = clients("sqs")
+
+    def get_queue_depth(resource: StackResourceSummary) -> dict:
+        try:
+            attributes = sqs.get_queue_attributes(
+                QueueUrl=resource.physical_id,
+                AttributeNames=["ApproximateNumberOfMessages", "ApproximateNumberOfMessagesNotVisible"]
+            )["Attributes"]
+        except botocore.exceptions.ClientError as e:
+            logger.warning("could not get attributes of queue '%s': %s", resource.physical_id, e)
+            return {}
+        return {
+            "messages_visible": int(attributes["ApproximateNumberOfMessages"]),
+            "messages_in_flight": int(attributes["ApproximateNumberOfMessagesNotVisible"]),
+        }
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=QUEUE_ATTRIBUTE_WORKERS) as executor:
+        # each lookup runs in a copy of the caller's context, so its API call is counted for the invocation
+        futures = [executor.submit(contextvars.copy_context().run, get_queue_depth, resource) for resource in resources]
+        return [future.result() for future in futures]
+
+
+get_queue_depths.prefetch_batch_size = QUEUE_ATTRIBUTE_WORKERS
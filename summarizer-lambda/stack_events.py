@@ -0,0 +1,87 @@
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger()
+
+ADDED_STATUSES = {"CREATE_COMPLETE", "UPDATE_COMPLETE", "IMPORT_COMPLETE"}
+REMOVED_STATUSES = {"DELETE_COMPLETE", "DELETE_SKIPPED"}
+# beyond this many new events, listing the stack's resources again is cheaper than applying them
+MAX_INCREMENTAL_EVENTS = int(os.getenv("MAX_INCREMENTAL_EVENTS", "500"))
+
+
+class EventHistoryGap(Exception):
+    """The events since a stack's resources were last listed are not all available."""
+
+
+@dataclass
+class StackResourceState:
+    """
+    The resources of a stack as of its event `last_event_id`, to be updated from later stack events.
+
+    `resources` holds every resource of the stack by logical id, as ListStackResources summaries reduced
+    to their type, ids, status and drift. Their rows are summarized again from these on every use, since
+    enrichers look up live values. `listed_at` is when the resources were last listed (as a time.time()
+    timestamp): drift detection writes no stack events, so their drift is only as recent as that listing.
+    """
+    last_event_id: str
+    resources: Dict[str, dict]
+    listed_at: float
+
+
+def resource_record(resource: dict) -> dict:
+    """Return the parts of a ListStackResources summary or stack event that a StackResourceState keeps."""
+    record = {key: resource[key] for key in ("ResourceType", "LogicalResourceId", "PhysicalResourceId", "ResourceStatus")}
+    record["LastUpdatedTimestamp"] = resource.get("LastUpdatedTimestamp") or resource.get("Timestamp")
+    for key in ("ResourceStatusReason", "DriftInformation"):
+        if resource.get(key):
+            record[key] = resource[key]
+    return record
+
+
+def latest_event_id(cloudformation, stack_name: str) -> Optional[str]:
+    """Return the id of the most recent event of a stack, or None if it has none."""
+    events = cloudformation.describe_stack_events(StackName=stack_name)["StackEvents"]
+    return events[0]["EventId"] if events else None
+
+
+def new_stack_events(cloudformation, stack_name: str, last_event_id: str) -> List[dict]:
+    """
+    Return the events of a stack that came after the event `last_event_id`, oldest first.
+
+    Raises EventHistoryGap if `last_event_id` is no longer in the stack's history, or if there are
+    more than MAX_INCREMENTAL_EVENTS newer events.
+    """
+    events = []
+    for page in cloudformation.get_paginator("describe_stack_events").paginate(StackName=stack_name):
+        for event in page["StackEvents"]:
+            if event["EventId"] == last_event_id:
+                return events[::-1]
+            if len(events) == MAX_INCREMENTAL_EVENTS:
+                raise EventHistoryGap(f"more than {MAX_INCREMENTAL_EVENTS} new stack events")
+            events.append(event)
+    raise EventHistoryGap(f"stack event {last_event_id} is no longer in the stack's history")
+
+
+def apply_stack_events(resources: Dict[str, dict], events: Iterable[dict]) -> None:
+    """
+    Apply stack `events`, oldest first, to `resources` by logical id.
+
+    Resources are added, or replaced by their new physical resource, when they are created or updated,
+    and removed when their physical resource is deleted. A resource whose replacement is already in
+    `resources` is kept when the physical resource it replaced is deleted afterwards. Other events of
+    a resource, such as failures, update its status. As events carry no drift information, a resource
+    changed by an event is no longer known to have drifted.
+    """
+    for event in events:
+        if event.get("PhysicalResourceId") == event["StackId"] or not event.get("PhysicalResourceId"):
+            continue
+        logical_id = event["LogicalResourceId"]
+        if event["ResourceStatus"] in ADDED_STATUSES:
+            resources[logical_id] = resource_record(event)
+        elif event["ResourceStatus"] in REMOVED_STATUSES:
+            if resources.get(logical_id, {}).get("PhysicalResourceId") == event["PhysicalResourceId"]:
+                del resources[logical_id]
+        elif resources.get(logical_id, {}).get("PhysicalResourceId") == event["PhysicalResourceId"]:
+            resources[logical_id] = resource_record(event)
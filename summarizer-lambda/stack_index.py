@@ -0,0 +1,135 @@
+import fnmatch
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, Hashable, Iterable, List, Optional
+
+import botocore.exceptions
+
+import instrumentation
+
+logger = logging.getLogger()
+
+GLOB_CHARACTERS = re.compile(r"[*?\[]")
+# above this many new or updated stacks, one DescribeStacks sweep is cheaper than describing each stack
+INCREMENTAL_REFRESH_LIMIT = 20
+
+
+def is_selector(stack_name: str) -> bool:
+    """Return whether `stack_name` is a glob or a Key=Value tag selector rather than the name of one stack."""
+    return "=" in stack_name or bool(GLOB_CHARACTERS.search(stack_name))
+
+
+class StackIndex:
+    """
+    The names, tags and last update times of the root stacks of an account region, cached for `ttl_seconds`.
+
+    The index is built with one paginated DescribeStacks sweep. Once it expires it is refreshed
+    incrementally: ListStacks finds the stacks that were created, updated or deleted since, and only
+    those are described again.
+    """
+
+    def __init__(self, ttl_seconds: float = 300):
+        self.ttl_seconds = ttl_seconds
+        self._stacks = {}
+        self._refreshed_at = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls):
+        """Return a StackIndex configured by the STACK_INDEX_TTL_SECONDS environment variable."""
+        return cls(ttl_seconds=float(os.getenv("STACK_INDEX_TTL_SECONDS", "300")))
+
+    def resolve(self, selectors: Iterable[str], cloudformation, key: Optional[Hashable] = None) -> List[str]:
+        """
+        Return the stack names selected by `selectors`, in order and without duplicates.
+
+        Plain stack names are returned as they are. A glob such as `prod-*` selects the root stacks
+        whose names match it, and `Key=Value` selects the root stacks tagged with Key set to Value
+        (the value may be a glob too). Stacks matched by one selector are sorted by name. The index
+        is only looked up, and refreshed when expired, if there is a selector.
+        """
+        stack_names = []
+        for selector in selectors:
+            if not is_selector(selector):
+                stack_names.append(selector)
+                continue
+            stacks = self.stacks(cloudformation, key)
+            if "=" in selector:
+                tag_key, _, tag_value = selector.partition("=")
+                matched = [stack["name"] for stack in stacks.values()
+                           if tag_key in stack["tags"] and fnmatch.fnmatchcase(stack["tags"][tag_key], tag_value)]
+            else:
+                matched = [stack["name"] for stack in stacks.values() if fnmatch.fnmatchcase(stack["name"], selector)]
+            if not matched:
+                logger.warning("stack selector '%s' matched no stacks", selector)
+            stack_names += sorted(matched)
+        return list(dict.fromkeys(stack_names))
+
+    def stacks(self, cloudformation, key: Optional[Hashable] = None) -> Dict[str, dict]:
+        """
+        Return {stack id: {"name", "tags", "updated"}} for the root stacks, refreshing the index if it expired.
+
+        There is one index per `key`, by default the region of `cloudformation`.
+        """
+        key = key or cloudformation.meta.region_name
+        with self._lock:
+            refreshed_at = self._refreshed_at.get(key)
+            if refreshed_at is None:
+                with instrumentation.span("StackIndexBuild"):
+                    self._stacks[key] = self._describe_all(cloudformation)
+            elif time.time() - refreshed_at > self.ttl_seconds:
+                with instrumentation.span("StackIndexRefresh"):
+                    self._stacks[key] = self._refresh(cloudformation, self._stacks[key])
+            else:
+                return self._stacks[key]
+            self._refreshed_at[key] = time.time()
+            return self._stacks[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stacks.clear()
+            self._refreshed_at.clear()
+
+    @staticmethod
+    def _entry(stack: dict) -> dict:
+        return {
+            "name": stack["StackName"],
+            "tags": {tag["Key"]: tag["Value"] for tag in stack.get("Tags", [])},
+            "updated": stack.get("LastUpdatedTime") or stack.get("CreationTime"),
+        }
+
+    def _describe_all(self, cloudformation) -> Dict[str, dict]:
+        stacks = {}
+        for page in cloudformation.get_paginator("describe_stacks").paginate():
+            for stack in page["Stacks"]:
+                if not stack.get("ParentId"):
+                    stacks[stack["StackId"]] = self._entry(stack)
+        logger.info("indexed %d stacks", len(stacks))
+        return stacks
+
+    def _refresh(self, cloudformation, indexed: Dict[str, dict]) -> Dict[str, dict]:
+        stacks = {}
+        changed = []
+        for page in cloudformation.get_paginator("list_stacks").paginate():
+            for summary in page["StackSummaries"]:
+                if summary.get("ParentId") or summary["StackStatus"] == "DELETE_COMPLETE":
+                    continue
+                stack_id = summary["StackId"]
+                updated = summary.get("LastUpdatedTime") or summary.get("CreationTime")
+                if stack_id in indexed and indexed[stack_id]["updated"] == updated:
+                    stacks[stack_id] = indexed[stack_id]
+                else:
+                    changed.append(stack_id)
+        if len(changed) > INCREMENTAL_REFRESH_LIMIT:
+            return self._describe_all(cloudformation)
+        for stack_id in changed:
+            try:
+                stacks[stack_id] = self._entry(cloudformation.describe_stacks(StackName=stack_id)["Stacks"][0])
+            except botocore.exceptions.ClientError as e:
+                if 'does not exist' not in str(e):
+                    raise
+        logger.info("refreshed stack index: %d stacks, %d new or updated", len(stacks), len(changed))
+        return stacks
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger()
+
+
+def stack_cache_key(stack_name: str, stack: dict) -> str:
+    """
+    Return the cache key for a stack as described by DescribeStacks.
+
+    The key changes whenever the stack is updated or changes status, so a cached summary is
+    only reused while the stack itself is unchanged.
+    """
+    last_updated = stack.get("LastUpdatedTime") or stack.get("CreationTime")
+    if hasattr(last_updated, "isoformat"):
+        last_updated = last_updated.isoformat()
+    return "|".join((stack_name, stack["StackId"], str(last_updated), stack["StackStatus"]))
+
+
+class SummaryCache:
+    """
+    An LRU cache of rendered stack summaries whose entries expire after `ttl_seconds`.
+
+    Cached values can be anything JSON serializable, such as the summary's html or a dict holding it.
+
+    When `directory` is given, entries are also written there (e.g. under /tmp) so they can be
+    recovered after the in-memory cache drops them.
+    """
+
+    def __init__(self, max_entries: int = 128, ttl_seconds: float = 300, directory: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.directory = pathlib.Path(directory) if directory else None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls):
+        """Return a SummaryCache configured by SUMMARY_CACHE_* environment variables."""
+        return cls(
+            max_entries=int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "128")),
+            ttl_seconds=float(os.getenv("SUMMARY_CACHE_TTL_SECONDS", "300")),
+            directory=os.getenv("SUMMARY_CACHE_DIR"),
+        )
+
+    def get(self, key: str):
+        """Return the cached value for `key`, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._read_file(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                self._evict()
+                self._touch_file(key)
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value) -> None:
+        entry = (time.time() + self.ttl_seconds, value)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict()
+            self._write_file(key, entry)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            if self.directory and self.directory.exists():
+                for path in self.directory.glob("*.json"):
+                    path.unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.directory.joinpath(hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    def _read_file(self, key: str):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), "r") as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if cached.get("key") != key:
+            return None
+        return cached["expires_at"], cached["value"]
+
+    def _touch_file(self, key: str):
+        if self.directory:
+            try:
+                os.utime(self._path(key))
+            except OSError:
+                pass
+
+    def _write_file(self, key: str, entry):
+        if not self.directory:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(self._path(key), "w") as cache_file:
+                json.dump({"key": key, "expires_at": entry[0], "value": entry[1]}, cache_file)
+            cached_files = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+            for path in cached_files[:-self.max_entries]:
+                path.unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning("could not write summary cache file: %s", e)
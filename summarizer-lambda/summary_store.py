@@ -0,0 +1,119 @@
+import abc
+import logging
+import os
+import pathlib
+import time
+import urllib.parse
+from typing import Optional
+
+import botocore.exceptions
+
+from aws_clients import get_client
+
+logger = logging.getLogger()
+
+
+def is_expired(stored_at: float, max_age_seconds: float) -> bool:
+    """Return whether a summary stored at the epoch time `stored_at` is more than `max_age_seconds` old."""
+    return time.time() - stored_at > max_age_seconds
+
+
+class SummaryStore(abc.ABC):
+    """Storage for pre-rendered stack summaries, keyed by stack name."""
+
+    @abc.abstractmethod
+    def get(self, stack_name: str, max_age_seconds: Optional[float] = None) -> Optional[str]:
+        """
+        Return the stored html for `stack_name`, or None if nothing has been stored, or if it was stored
+        more than `max_age_seconds` ago.
+        """
+
+    @abc.abstractmethod
+    def put(self, stack_name: str, html: str) -> None:
+        """Store `html` as the summary of `stack_name`."""
+
+    @staticmethod
+    def object_name(stack_name: str) -> str:
+        return urllib.parse.quote(stack_name, safe='') + ".html"
+
+
+class LocalFileSummaryStore(SummaryStore):
+    """Stores each summary as an html file in `directory`."""
+
+    def __init__(self, directory: str):
+        self.directory = pathlib.Path(directory)
+
+    def get(self, stack_name: str, max_age_seconds: Optional[float] = None) -> Optional[str]:
+        try:
+            with open(self.directory.joinpath(self.object_name(stack_name)), "r") as summary_file:
+                if max_age_seconds is not None and is_expired(os.fstat(summary_file.fileno()).st_mtime,
+                                                              max_age_seconds):
+                    return None
+                return summary_file.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, stack_name: str, html: str) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory.joinpath(self.object_name(stack_name))
+        partial_path = path.with_suffix(".partial")
+        with open(partial_path, "w") as summary_file:
+            summary_file.write(html)
+        partial_path.replace(path)
+
+
+class S3SummaryStore(SummaryStore):
+    """
+    Stores each summary as an html object under `prefix` in an S3 bucket.
+
+    Without an `s3` client, the shared S3 client of aws_clients is used, so the store's calls reuse its
+    connections and credentials and are counted with the invocation's API calls.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", s3=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self._s3 = s3
+
+    @property
+    def s3(self):
+        # looked up on every use rather than kept, as aws_clients replaces its clients when reset
+        return self._s3 if self._s3 is not None else get_client("s3")
+
+    def key(self, stack_name: str) -> str:
+        return "/".join(filter(None, (self.prefix, self.object_name(stack_name))))
+
+    def get(self, stack_name: str, max_age_seconds: Optional[float] = None) -> Optional[str]:
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.key(stack_name))
+        except botocore.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise
+        with response["Body"] as body:
+            if max_age_seconds is not None and is_expired(response["LastModified"].timestamp(), max_age_seconds):
+                return None
+            return body.read().decode("utf-8")
+
+    def put(self, stack_name: str, html: str) -> None:
+        self.s3.put_object(Bucket=self.bucket, Key=self.key(stack_name), Body=html.encode("utf-8"),
+                           ContentType="text/html; charset=utf-8")
+
+
+def summary_store_from_url(url: Optional[str]) -> Optional[SummaryStore]:
+    """
+    Return a SummaryStore for `url`, which is either `s3://bucket/prefix` or a local directory path.
+    """
+    if not url:
+        return None
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme == "s3":
+        return S3SummaryStore(parsed.netloc, parsed.path)
+    if parsed.scheme == "file":
+        return LocalFileSummaryStore(parsed.path)
+    return LocalFileSummaryStore(url)
+
+
+def summary_store_from_environment() -> Optional[SummaryStore]:
+    """Return the SummaryStore configured by the SUMMARY_STORE environment variable, if any."""
+    return summary_store_from_url(os.getenv("SUMMARY_STORE"))
@@ -1,11 +1,36 @@
+import concurrent.futures
+import copy
 import datetime
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
 from contextlib import contextmanager
 
+import pytest
 from boto3.session import Session
 from botocore import stub
+from botocore.exceptions import ClientError
 
+import aws_clients
+import export
+import fetch_engine
+import fragment_cache
+import instrumentation
 import lambda_src
-from resource_types.common import StackResourceSummary
+import resource_metrics
+import stack_index
+import summary_cache
+import summary_store
+import throttling
+from benchmarks import bench_memory, bench_output, bench_stages, load_test, synthetic
+from resource_types import common, ecs, elbv2, registry, sqs
+from resource_types.common import (ResourceFilter, StackResourceSummary,
+                                   StackSummary, SummaryOptions)
 
 
 @contextmanager
@@ -56,6 +81,15 @@ def test_populate_resource_links():
     assert resource_b.label == "bucket-123"
 
 
+def test_resource_summaries_slotted_and_share_link_labels():
+    resource_a = lambda_src.StackResourceSummary("bucket-abc", "SomeBucket", "us-east-1")
+    resource_b = lambda_src.StackResourceSummary("bucket-123", "OtherBucket", "us-east-1")
+    lambda_src.summarize_resource({"AWS::S3::Bucket": [resource_a, resource_b]})
+    assert list(resource_a.links) == list(resource_b.links) == ["Metrics"]
+    assert resource_a.links._labels is resource_b.links._labels
+    assert not hasattr(resource_a, "__dict__")
+
+
 def test_summarize_resource():
     r = StackResourceSummary("my-bucket", "MyBucket", "us-west-1")
     lambda_src.populate_resource_summary({
@@ -68,3 +102,977 @@ def test_summarize_resource():
     assert r.label == "my-bucket"
     assert r.href == f"https://us-east-1.console.aws.amazon.com/s3/buckets/{r.physical_id}?region={r.aws_region}&tab=objects"
     assert r.links["Metrics"]["href"] == f"https://us-east-1.console.aws.amazon.com/s3/buckets/{r.physical_id}?region={r.aws_region}&tab=metrics"
+
+
+def test_load_balancer_metrics_follow_load_balancer_type():
+    arn = "arn:aws:elasticloadbalancing:us-east-1:123456789012:loadbalancer/{}/lb/0123456789abcdef"
+    template = lambda_src.TEMPLATES["AWS::ElasticLoadBalancingV2::LoadBalancer"]
+    metrics = {}
+    for load_balancer_type in ("app", "net", "gwy"):
+        resource = StackResourceSummary(arn.format(load_balancer_type), "LoadBalancer", "us-east-1")
+        lambda_src.populate_resource_summary(template, resource)
+        metrics[load_balancer_type] = [(m["metric"]["Namespace"], m["metric"]["MetricName"]) for m in resource.metrics]
+    assert metrics == {
+        "app": [("AWS/ApplicationELB", "RequestCount"), ("AWS/ApplicationELB", "HTTPCode_ELB_5XX_Count")],
+        "net": [("AWS/NetworkELB", "ActiveFlowCount"), ("AWS/NetworkELB", "ProcessedBytes")],
+        "gwy": [("AWS/GatewayELB", "ActiveFlowCount"), ("AWS/GatewayELB", "ProcessedBytes")],
+    }
+
+
+def test_templates_compiled_once_per_source(monkeypatch):
+    compiled_sources = []
+    template_class = lambda_src.jinja2.Template
+
+    def counting_template(source):
+        compiled_sources.append(source)
+        return template_class(source)
+
+    monkeypatch.setattr(lambda_src, "_compiled_templates", {})
+    monkeypatch.setattr(lambda_src, "FRAGMENT_CACHE", None)
+    monkeypatch.setattr(lambda_src.jinja2, "Template", counting_template)
+    resources = [StackResourceSummary(f"fn-{i}", f"Function{i}", "us-east-1") for i in range(50)]
+    lambda_src.summarize_resource({"AWS::Lambda::Function": resources})
+    lambda_src.summarize_resource({"AWS::Lambda::Function": [StackResourceSummary("fn", "Function", "us-east-1")]})
+
+    template = lambda_src.TEMPLATES["AWS::Lambda::Function"]
+    distinct_sources = {template["label"], template["resource_link"], *template["links"].values()}
+    assert sorted(compiled_sources) == sorted(distinct_sources)
+    assert resources[-1].label == "fn-49"
+
+
+def test_template_syntax_error_reported_per_resource(monkeypatch, caplog):
+    monkeypatch.setattr(lambda_src, "_compiled_templates", {})
+    monkeypatch.setattr(lambda_src, "FRAGMENT_CACHE", fragment_cache.FragmentCache())
+    resources = [StackResourceSummary("bucket-a", "BucketA", "us-east-1"),
+                 StackResourceSummary("bucket-b", "BucketB", "us-east-1")]
+    for r in resources:
+        lambda_src.populate_resource_summary({"label": "{{ physical_id", "resource_link": "", "links": {}}, r)
+    assert resources[0].label == ''
+    assert "error rendering resource label for 'BucketA'" in caplog.text
+    assert "error rendering resource label for 'BucketB'" in caplog.text
+
+
+def test_rendered_rows_cached_by_content_and_spilled_to_disk(tmp_path, monkeypatch):
+    cache = fragment_cache.FragmentCache(max_entries=1, directory=str(tmp_path))
+    monkeypatch.setattr(lambda_src, "FRAGMENT_CACHE", cache)
+    template = {"label": "{{ physical_id }}{% if depth is defined %} ({{ depth }}){% endif %}",
+                "resource_link": "https://example.com/{{ region }}/{{ physical_id }}", "links": {"Logs": "{{ logical_id }}"},
+                "metrics": [{"label": "Depth", "namespace": "AWS/SQS", "name": "Depth", "stat": "Maximum",
+                             "dimensions": {"QueueName": "{{ physical_id }}"}}]}
+
+    def populate(physical_id, logical_id="Queue", enriched_vars=None, row_template=template):
+        resource = StackResourceSummary(physical_id, logical_id, "us-east-1")
+        cached = lambda_src.populate_resource_summary(row_template, resource, enriched_vars or {}, "AWS::SQS::Queue")
+        return cached, resource
+
+    assert not populate("queue-a")[0]
+    cached, resource = populate("queue-a")
+    assert cached and resource.label == "queue-a" and resource.links["Logs"]["href"] == "Queue"
+    assert resource.metrics[0]["metric"]["Dimensions"] == [{"Name": "QueueName", "Value": "queue-a"}]
+    # variables used by the template, and the template itself, address new fragments
+    assert not populate("queue-a", logical_id="OtherQueue")[0]
+    assert not populate("queue-a", enriched_vars={"depth": 3})[0]
+    assert populate("queue-a", enriched_vars={"depth": 3})[1].label == "queue-a (3)"
+    assert not populate("queue-a", row_template=dict(template, label="{{ physical_id }}!"))[0]
+
+    # fragments evicted from memory are read back from disk
+    assert len(list(tmp_path.glob("*.frag"))) == 3
+    assert populate("queue-a", enriched_vars={"depth": 3})[1].label == "queue-a (3)"
+    assert cache.stats()["entries"] == 1
+
+
+class FakeLambdaContext:
+    def __init__(self, remaining_millis: int):
+        self.remaining_millis = remaining_millis
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_millis
+
+
+def test_render_stacks_concurrently_in_order(monkeypatch):
+    def fake_render_stack_summary(stack_name, cloudformation, force_refresh=False, options=None, role_arn=None):
+        if stack_name == "SlowStack":
+            time.sleep(1)
+        elif stack_name == "ThrottledStack":
+            raise ClientError({"Error": {"Code": "Throttling", "Message": "Rate exceeded"}}, "DescribeStacks")
+        else:
+            time.sleep(0.1)
+        return StackSummary(f"<p>{stack_name}</p>", stack_name)
+
+    monkeypatch.setattr(lambda_src, "prepare_stack_summary", fake_render_stack_summary)
+    monkeypatch.setattr(lambda_src, "DEADLINE_MARGIN_SECONDS", 0)
+    stack_names = ["StackA", "SlowStack", "ThrottledStack"] + [f"Stack{i}" for i in range(5)]
+
+    started = time.monotonic()
+    html = lambda_src.render({"stacks": stack_names}, None, FakeLambdaContext(remaining_millis=500))
+    assert time.monotonic() - started < 0.9
+
+    assert html.index("<p>StackA</p>") < html.index("timed out summarizing stack &#x27;SlowStack&#x27;")
+    assert "timed out summarizing stack &#x27;ThrottledStack&#x27; (throttled)" in html
+    assert html.index("(throttled)") < html.index("<p>Stack0</p>") < html.index("<p>Stack4</p>")
+
+
+def add_describe_stacks_response(stubber, stack_name, last_updated):
+    stubber.add_response("describe_stacks", {"Stacks": [{
+        "StackName": stack_name,
+        "StackId": f"arn:aws:cloudformation:us-east-1:123456789012:stack/{stack_name}/abc",
+        "CreationTime": datetime.datetime(2023, 1, 1),
+        "LastUpdatedTime": last_updated,
+        "StackStatus": "UPDATE_COMPLETE",
+    }]}, {"StackName": stack_name})
+
+
+def add_describe_stack_events_response(stubber, stack_name, events=()):
+    stubber.add_response("describe_stack_events", {"StackEvents": list(events)},
+                         {"StackName": f"arn:aws:cloudformation:us-east-1:123456789012:stack/{stack_name}/abc"})
+
+
+def add_list_stack_resources_response(stubber, bucket_name):
+    stubber.add_response("list_stack_resources", {"StackResourceSummaries": [{
+        "ResourceType": "AWS::S3::Bucket",
+        "PhysicalResourceId": bucket_name,
+        "LogicalResourceId": "MyBucket",
+        "LastUpdatedTimestamp": datetime.datetime(2023, 1, 1),
+        "ResourceStatus": "CREATE_COMPLETE"
+    }]})
+
+
+def test_unchanged_stack_summary_cached(monkeypatch):
+    monkeypatch.setattr(lambda_src, "SUMMARY_CACHE", summary_cache.SummaryCache())
+    monkeypatch.setattr(lambda_src, "RESOURCE_STATES", None)
+    with stubbed_client("cloudformation") as (client, stubber):
+        add_describe_stacks_response(stubber, "MyStack", datetime.datetime(2023, 2, 1))
+        add_list_stack_resources_response(stubber, "bucket-one")
+        add_describe_stacks_response(stubber, "MyStack", datetime.datetime(2023, 2, 1))
+        add_describe_stacks_response(stubber, "MyStack", datetime.datetime(2023, 2, 1))
+        add_list_stack_resources_response(stubber, "bucket-forced")
+        add_describe_stacks_response(stubber, "MyStack", datetime.datetime(2023, 3, 1))
+        add_list_stack_resources_response(stubber, "bucket-updated")
+
+        first = lambda_src.render_stack_summary("MyStack", client)
+        cached = lambda_src.render_stack_summary("MyStack", client)
+        forced = lambda_src.render_stack_summary("MyStack", client, force_refresh=True)
+        updated = lambda_src.render_stack_summary("MyStack", client)
+
+    assert "bucket-one" in first.html
+    assert cached.html == first.html
+    assert "bucket-forced" in forced.html
+    assert "bucket-updated" in updated.html
+    assert lambda_src.SUMMARY_CACHE.stats()["hits"] == 1
+
+
+def test_summary_cache_eviction(tmp_path, monkeypatch):
+    cache = summary_cache.SummaryCache(max_entries=2, ttl_seconds=60, directory=str(tmp_path))
+    cache.put("a", "<p>a</p>")
+    cache.put("b", "<p>b</p>")
+    assert cache.get("a") == "<p>a</p>"
+    cache.put("c", "<p>c</p>")
+    assert set(cache._entries) == {"a", "c"}
+    assert len(list(tmp_path.glob("*.json"))) == 2
+
+    reloaded = summary_cache.SummaryCache(max_entries=2, ttl_seconds=60, directory=str(tmp_path))
+    assert reloaded.get("c") == "<p>c</p>"
+
+    now = time.time()
+    monkeypatch.setattr(summary_cache.time, "time", lambda: now + 61)
+    assert cache.get("c") is None
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def stack_notification_record(message_id, stack_name, resource_status):
+    message = "\n".join([
+        f"StackId='arn:aws:cloudformation:us-east-1:123456789012:stack/{stack_name}/abc'",
+        "Timestamp='2023-02-01T00:00:00.000Z'",
+        f"LogicalResourceId='{stack_name}'",
+        f"StackName='{stack_name}'",
+        f"ResourceStatus='{resource_status}'",
+        "ResourceType='AWS::CloudFormation::Stack'",
+    ])
+    return {"messageId": message_id, "eventSource": "aws:sqs",
+            "body": json.dumps({"Type": "Notification", "Message": message})}
+
+
+def test_notifications_pre_render_summaries(tmp_path, monkeypatch):
+    rendered = []
+
+    def fake_render_stack_summary(stack_name, cloudformation, force_refresh=False, options=None):
+        rendered.append(stack_name)
+        if stack_name == "BrokenStack":
+            raise ClientError({"Error": {"Code": "AccessDenied", "Message": "denied"}}, "DescribeStacks")
+        return StackSummary(f"<p>{stack_name}</p>", stack_name)
+
+    store = summary_store.LocalFileSummaryStore(str(tmp_path))
+    monkeypatch.setattr(lambda_src, "SUMMARY_STORE", store)
+    monkeypatch.setattr(lambda_src, "render_stack_summary", fake_render_stack_summary)
+    response = lambda_src.render({"Records": [
+        stack_notification_record("1", "StackA", "UPDATE_IN_PROGRESS"),
+        stack_notification_record("2", "BrokenStack", "UPDATE_COMPLETE"),
+        stack_notification_record("3", "StackA", "UPDATE_COMPLETE"),
+    ]}, None)
+
+    assert rendered == ["StackA", "BrokenStack"]
+    assert response == {"batchItemFailures": [{"itemIdentifier": "2"}]}
+    assert store.get("StackA") == "<p>StackA</p>"
+    assert store.get("BrokenStack") is None
+
+
+def test_widget_reads_pre_rendered_summary(tmp_path, monkeypatch):
+    store = summary_store.LocalFileSummaryStore(str(tmp_path))
+    store.put("My/Stack", "<p>stored</p>")
+    monkeypatch.setattr(lambda_src, "SUMMARY_STORE", store)
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with stubbed_client("cloudformation") as (client, stubber):
+        assert lambda_src.render({"stacks": ["My/Stack"]}, client) == lambda_src.WIDGET_STYLE + "<p>stored</p>"
+
+        # a summary stored longer ago than SUMMARY_STORE_MAX_AGE_SECONDS is rendered again
+        stored_at = time.time() - lambda_src.SUMMARY_STORE_MAX_AGE_SECONDS - 60
+        os.utime(tmp_path.joinpath(summary_store.SummaryStore.object_name("My/Stack")), (stored_at, stored_at))
+        stubber.add_client_error("describe_stacks", service_message="Stack with id My/Stack does not exist")
+        assert "<p>stored</p>" not in lambda_src.render({"stacks": ["My/Stack"]}, client)
+        stubber.assert_no_pending_responses()
+
+
+def test_s3_summary_store_uses_shared_s3_client(monkeypatch):
+    store = summary_store.summary_store_from_url("s3://summaries/widgets/")
+    with stubbed_client("s3") as (s3, stubber):
+        requested = []
+        monkeypatch.setattr(summary_store, "get_client", lambda service_name: requested.append(service_name) or s3)
+        stubber.add_response("put_object", {}, {"Bucket": "summaries", "Key": store.key("My/Stack"),
+                                                "Body": b"<p>stored</p>", "ContentType": "text/html; charset=utf-8"})
+        store.put("My/Stack", "<p>stored</p>")
+    assert requested == ["s3"]
+
+
+def test_batch_enrichers_use_bulk_calls_and_memoize():
+    arns = [f"arn:aws:elasticloadbalancing:us-east-1:123456789012:loadbalancer/app/lb-{i}/{i:016x}" for i in range(25)]
+    load_balancers = [StackResourceSummary(arn, f"LoadBalancer{i}", "us-east-1") for i, arn in enumerate(arns)]
+    service_arn = "arn:aws:ecs:us-east-1:123456789012:service/my-cluster/my-service"
+    services = [StackResourceSummary(service_arn, "Service", "us-east-1")]
+    elbv2.describe_load_balancers.cache_clear()
+    ecs.describe_services.cache_clear()
+
+    with stubbed_client("elbv2") as (elbv2_client, elbv2_stubber), stubbed_client("ecs") as (ecs_client, ecs_stubber):
+        for batch in (arns[:20], arns[20:]):
+            elbv2_stubber.add_response("describe_load_balancers", {"LoadBalancers": [
+                {"LoadBalancerArn": arn, "DNSName": f"{arn[-4:]}.elb.amazonaws.com", "State": {"Code": "active"}}
+                for arn in batch
+            ]}, {"LoadBalancerArns": batch})
+        ecs_stubber.add_response("describe_services", {"services": [
+            {"serviceArn": service_arn, "desiredCount": 3, "runningCount": 2}
+        ]}, {"cluster": "my-cluster", "services": [service_arn]})
+        clients = {"elbv2": elbv2_client, "ecs": ecs_client}.get
+
+        lambda_src.summarize_resource({"AWS::ElasticLoadBalancingV2::LoadBalancer": load_balancers,
+                                       "AWS::ECS::Service": services}, clients)
+        lambda_src.summarize_resource({"AWS::ElasticLoadBalancingV2::LoadBalancer": load_balancers[:1],
+                                       "AWS::ECS::Service": services}, clients)
+
+    assert load_balancers[0].label == f"app: {arns[0]} (active)"
+    assert services[0].label == "my-service (2/3 tasks running)"
+    assert services[0].href.endswith("/clusters/my-cluster/services/my-service/details")
+
+
+def test_queue_depth_calls_counted_in_invocation():
+    queues = [StackResourceSummary(f"https://sqs.us-east-1.amazonaws.com/123456789012/queue-{i}", f"Queue{i}", "us-east-1")
+              for i in range(3)]
+    sqs.get_queue_depths.cache_clear()
+    with stubbed_client("sqs") as (client, stubber), instrumentation.invocation() as recorder:
+        client.meta.events.register_first("before-call.*.*", instrumentation.count_api_call)
+        for _ in queues:
+            stubber.add_response("get_queue_attributes", {"Attributes": {
+                "ApproximateNumberOfMessages": "5", "ApproximateNumberOfMessagesNotVisible": "0"}})
+        assert sqs.get_queue_depths(queues, lambda service_name: client)[0]["messages_visible"] == 5
+    assert recorder.breakdown()["GetQueueAttributesCalls"] == 3
+
+
+def test_metrics_for_all_stacks_fetched_together(monkeypatch):
+    monkeypatch.setattr(lambda_src, "SUMMARY_CACHE", summary_cache.SummaryCache())
+    monkeypatch.setattr(resource_metrics, "GET_METRIC_DATA_MAX_QUERIES", 3)
+
+    def fake_prepare_stack_summary(stack_name, cloudformation, force_refresh=False, options=None, role_arn=None):
+        functions = [StackResourceSummary(f"{stack_name}-fn{i}", f"Function{i}", "us-east-1") for i in range(2)]
+        return StackSummary(None, stack_name, resources=lambda_src.summarize_resource({"AWS::Lambda::Function": functions}),
+                            resource_count=2, aws_region="us-east-1")
+
+    with stubbed_client("cloudwatch") as (cloudwatch, stubber):
+        # 2 stacks x 2 functions x 2 metrics, in batches of at most 3 queries
+        for batch_size in (3, 3, 2):
+            stubber.add_response("get_metric_data", {"MetricDataResults": [
+                {"Id": f"m{i}", "Values": [1.0, 4.0, 2.0]} for i in range(batch_size)
+            ]})
+        monkeypatch.setattr(lambda_src, "prepare_stack_summary", fake_prepare_stack_summary)
+        monkeypatch.setattr(lambda_src, "get_client", lambda service_name, region_name=None, role_arn=None: cloudwatch)
+        cloudwatch.meta.events.register_first("before-call.*.*", instrumentation.count_api_call)
+        with instrumentation.invocation() as recorder:
+            html = lambda_src.render({"stacks": ["StackA", "StackB"]}, None)
+
+    assert recorder.breakdown()["GetMetricDataCalls"] == 3
+    assert html.count("Invocations <span title=\"last hour\">▁█▃</span> 2") == 4
+    assert html.count("Errors") == 4
+    assert resource_metrics.sparkline([5, 5]) == "▁▁"
+
+
+def test_metrics_not_fetched_by_deadline_left_out():
+    function = StackResourceSummary("my-function", "MyFunction", "us-east-1")
+    lambda_src.populate_resource_summary(lambda_src.TEMPLATES["AWS::Lambda::Function"], function)
+    with stubbed_client("cloudwatch") as (cloudwatch, stubber):
+        cloudwatch.meta.events.register_first("before-call.*.*", lambda **kwargs: time.sleep(0.5))
+        stubber.add_response("get_metric_data", {"MetricDataResults": [{"Id": "m0", "Values": [1.0]}]})
+        started = time.monotonic()
+        calls = resource_metrics.fetch_resource_metrics([function], lambda region: cloudwatch, started + 0.1)
+        waited = time.monotonic() - started
+        assert resource_metrics.fetch_resource_metrics([function], lambda region: cloudwatch, started) == 0
+        # the call left behind still gets its stubbed response
+        time.sleep(1)
+
+    assert calls == 0 and waited < 0.4
+    assert not any(metric["datapoints"] for metric in function.metrics)
+
+
+IMPORT_TIME_BUDGET_SECONDS = float(os.getenv("IMPORT_TIME_BUDGET_SECONDS", "3"))
+FIRST_RENDER_BUDGET_SECONDS = float(os.getenv("FIRST_RENDER_BUDGET_SECONDS", "1"))
+
+COLD_START_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import aws_clients
+import lambda_src
+imported = time.perf_counter()
+enricher_modules_imported = "resource_types.ecs" in sys.modules
+from resource_types.common import StackResourceSummary
+resources = lambda_src.summarize_resource({
+    "AWS::Lambda::Function": [StackResourceSummary("my-function", "MyFunction", "us-east-1")],
+    "AWS::ECS::TaskDefinition": [StackResourceSummary(
+        "arn:aws:ecs:us-east-1:123456789012:task-definition/my-task:3", "MyTask", "us-east-1")],
+})
+lambda_src.render_html_summary(resources, "MyStack", "us-east-1", 2, 2)
+rendered = time.perf_counter()
+print(json.dumps({"import": imported - started, "first_render": rendered - imported,
+                  "enricher_modules_imported": enricher_modules_imported,
+                  "unused_modules_imported": "resource_types.sqs" in sys.modules}))
+"""
+
+
+def test_cold_start_within_budget():
+    output = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT], cwd=pathlib.Path(__file__).parent,
+                            capture_output=True, text=True, check=True).stdout
+    timings = json.loads(output)
+    assert not timings["enricher_modules_imported"]
+    assert not timings["unused_modules_imported"]
+    assert timings["import"] < IMPORT_TIME_BUDGET_SECONDS
+    assert timings["first_render"] < FIRST_RENDER_BUDGET_SECONDS
+
+
+def test_resource_types_registered_from_index_and_user_templates(tmp_path, monkeypatch):
+    assert registry.load_index() == registry.build_index()
+
+    templates_file = tmp_path / "templates.json"
+    templates_file.write_text(json.dumps({
+        "AWS::SNS::Topic": {"label": "{{ physical_id }}", "resource_link": "https://example.com/{{ physical_id }}"},
+        "AWS::S3::Bucket": {"label": "file", "resource_link": ""},
+    }))
+    monkeypatch.setenv("RESOURCE_TEMPLATES_FILE", str(templates_file))
+    monkeypatch.setenv("RESOURCE_TEMPLATES", json.dumps({"AWS::S3::Bucket": {"label": "bucket {{ physical_id }}",
+                                                                            "resource_link": ""}}))
+    templates = registry.TemplateRegistry.from_environment()
+    assert "AWS::SNS::Topic" in templates and "AWS::ECS::Service" in templates and "AWS::Foo::Bar" not in templates
+    assert len(templates) == len(list(templates)) == len(registry.load_index()) + 1
+    assert templates["AWS::SNS::Topic"]["links"] == {}
+    assert templates["AWS::ECS::Service"] is lambda_src.TEMPLATES["AWS::ECS::Service"]
+
+    monkeypatch.setattr(lambda_src, "TEMPLATES", templates)
+    resources = lambda_src.summarize_resource({
+        "AWS::S3::Bucket": [StackResourceSummary("my-bucket", "MyBucket", "us-east-1")],
+        "AWS::SNS::Topic": [StackResourceSummary("my-topic", "MyTopic", "us-east-1")],
+    })
+    assert resources["AWS::S3::Bucket"][0].label == "bucket my-bucket"
+    assert resources["AWS::SNS::Topic"][0].href == "https://example.com/my-topic"
+
+    monkeypatch.setenv("RESOURCE_TEMPLATES", json.dumps({"AWS::SNS::Topic": {"label": ""}}))
+    with pytest.raises(ValueError, match="AWS::SNS::Topic in RESOURCE_TEMPLATES is missing resource_link"):
+        registry.load_user_templates()
+
+
+def test_clients_reset_when_region_changes(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.delenv("AWS_REGION", raising=False)
+    aws_clients.reset()
+    client = aws_clients.get_client("cloudformation")
+    assert aws_clients.get_client("cloudformation") is client
+    assert client.meta.config.retries["mode"] == "adaptive"
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-1")
+    assert aws_clients.get_client("cloudformation").meta.region_name == "eu-west-1"
+    aws_clients.reset()
+
+
+def test_synthetic_benchmark_stages_run_offline():
+    resources = synthetic.synthetic_stack_resources(60, synthetic.parse_mix(""))
+    assert len(synthetic.count_types(resources)) > len(lambda_src.TEMPLATES)
+    assert bench_stages.time_list(resources, page_size=7) > 0
+    assert bench_stages.time_summarize(resources) > 0
+    assert bench_stages.time_handler(resources, page_size=7) > 0
+    concatenated = bench_output.measure(bench_output.render_concatenated, 2, resources)
+    streamed = bench_output.measure(bench_output.render_streamed, 2, resources)
+    assert streamed["output_bytes"] < concatenated["output_bytes"]
+    assert (bench_memory.measure(resources, StackResourceSummary)["retained_bytes"]
+            < bench_memory.measure(resources, bench_memory.DataclassResourceSummary)["retained_bytes"])
+
+
+def test_load_test_reports_latency_api_calls_and_errors(monkeypatch):
+    monkeypatch.setattr(lambda_src, "SUMMARY_CACHE", summary_cache.SummaryCache())
+    monkeypatch.setattr(aws_clients, "CLOUDFORMATION_RATE_LIMIT", 0)
+    resources = synthetic.synthetic_stack_resources(150, synthetic.parse_mix(""))
+    stacks = {f"Stack{i}": resources for i in range(4)}
+    widgets = [[name] for name in stacks]
+
+    results = load_test.run(load_test.FakeBackend(stacks), widgets, concurrency=4, refreshes=2, cold=True)
+    assert results["invocations"] == 8
+    assert results["latency_seconds"]["p50"] <= results["latency_seconds"]["p99"]
+    assert results["api_calls_per_refresh"]["by_operation"]["cloudformation.ListStackResources"] == 8
+    assert results["error_rates"] == {"handler": 0, "unavailable_stacks": 0, "throttled_api_calls": 0}
+
+    monkeypatch.setattr(lambda_src, "FRAGMENT_CACHE", fragment_cache.FragmentCache())
+    monkeypatch.setattr(synthetic, "clear_enrichment_caches", lambda: None)
+    bucket_template = lambda_src.TEMPLATES["AWS::S3::Bucket"]
+
+    def populate_bucket():
+        return lambda_src.populate_resource_summary(bucket_template, StackResourceSummary("bucket-one", "Bucket", "us-east-1"),
+                                                    resource_type="AWS::S3::Bucket")
+
+    assert [populate_bucket(), populate_bucket()] == [False, True]
+    load_test.clear_caches()
+    assert not populate_bucket()
+
+    results = load_test.run(load_test.FakeBackend(stacks, throttle_rate=1), widgets, concurrency=4, refreshes=1,
+                            cold=True)
+    assert results["error_rates"] == {"handler": 0, "unavailable_stacks": 1, "throttled_api_calls": 1}
+
+
+def test_async_fetch_engine_latency_follows_longest_call_chain(monkeypatch):
+    latency = 0.04
+    mix = {"AWS::ECS::Service": 1, "AWS::SQS::Queue": 1, "AWS::ElasticLoadBalancingV2::LoadBalancer": 1}
+    stacks = {f"Stack{size}": synthetic.synthetic_stack_resources(size, mix) for size in (300, 900)}
+    backend = load_test.FakeBackend(stacks)
+    session = Session(region_name="us-east-1", aws_access_key_id="AKIAFAKEFAKEFAKE", aws_secret_access_key="fake")
+    clients = {name: backend.attach(session.client(name)) for name in ("cloudformation", "ecs", "elbv2", "sqs")}
+    monkeypatch.setattr(lambda_src, "get_client", lambda name, region_name=None, role_arn=None: clients[name])
+    monkeypatch.setattr(lambda_src, "RESOURCE_STATES", None)
+
+    def summarize(engine, stack_name, latency_seconds):
+        monkeypatch.setattr(lambda_src, "FETCH_ENGINE", engine)
+        backend.latency_seconds = latency_seconds
+        synthetic.clear_enrichment_caches()
+        backend.reset_counts()
+        started = time.perf_counter()
+        summary = lambda_src.prepare_stack_summary(stack_name, clients["cloudformation"], force_refresh=True)
+        return time.perf_counter() - started, sum(backend.calls.values()), summary
+
+    sync_seconds, sync_calls, sync_summary = summarize(fetch_engine.SyncFetchEngine(), "Stack300", latency)
+    async_seconds, async_calls, async_summary = summarize(fetch_engine.AsyncFetchEngine(), "Stack300", latency)
+    # 1 DescribeStacks, 3 ListStackResources pages, ~100 queues 8 at a time, ~10 DescribeServices and ~5 DescribeLoadBalancers
+    assert sync_seconds > 30 * latency
+    assert async_calls == sync_calls
+    assert ([(r.label, dict(r.links)) for rows in async_summary.resources.values() for r in rows]
+            == [(r.label, dict(r.links)) for rows in sync_summary.resources.values() for r in rows])
+
+    for size in (300, 900):
+        engine = fetch_engine.AsyncFetchEngine()
+        # the time spent processing the calls' responses, with no latency to overlap
+        overhead = max(summarize(engine, f"Stack{size}", 0)[0] for _ in range(2))
+        seconds = min(summarize(engine, f"Stack{size}", latency)[0] for _ in range(2))
+        # DescribeStacks, then the pages one after another, then the lookups of the resources on the last page
+        chain = 1 + size // synthetic.PAGE_SIZE + 1
+        assert seconds - overhead < 3 * chain * latency
+    assert list(fetch_engine.AsyncFetchEngine(prefetch_pages=1).pages(clients["cloudformation"], "list_stack_resources",
+                                                                     StackName="Stack300"))[-1]["StackResourceSummaries"]
+
+
+def test_export_writes_stacks_and_index_and_resumes_after_failures(monkeypatch, tmp_path):
+    resources = synthetic.synthetic_stack_resources(5, synthetic.parse_mix(""))
+    backend = load_test.FakeBackend({f"Stack{i}": resources for i in range(load_test.LIST_STACKS_PAGE_SIZE + 5)})
+    session = Session(region_name="us-east-1", aws_access_key_id="AKIAFAKEFAKEFAKE", aws_secret_access_key="fake")
+    clients = {}
+    monkeypatch.setattr(lambda_src, "get_client", lambda name, region_name=None, role_arn=None:
+                        clients.setdefault(name, backend.attach(session.client(name))))
+    monkeypatch.setattr(lambda_src, "SUMMARY_CACHE", summary_cache.SummaryCache())
+    monkeypatch.setattr(lambda_src, "RESOURCE_STATES", None)
+    cloudformation = lambda_src.get_client("cloudformation")
+    render_stack_summary = lambda_src.render_stack_summary
+
+    def interrupted_render_stack_summary(stack_name, cloudformation):
+        if stack_name in ("Stack3", "Stack101"):
+            raise ClientError({"Error": {"Code": "Throttling", "Message": "Rate exceeded"}}, "DescribeStacks")
+        return render_stack_summary(stack_name, cloudformation)
+
+    monkeypatch.setattr(lambda_src, "render_stack_summary", interrupted_render_stack_summary)
+    result = export.export_stacks(cloudformation, str(tmp_path), workers=4)
+    assert (result["exported"], result["skipped"], result["failed"]) == (103, 0, 2)
+    assert result["stacks_per_second"] > 0
+    assert backend.calls["cloudformation.ListStacks"] == 2
+    index = tmp_path.joinpath("index.html").read_text()
+    assert '<a href="Stack0.html">Stack0</a>' in index and "Stack3.html" not in index
+    assert "Stack104" in tmp_path.joinpath("Stack104.html").read_text()
+
+    monkeypatch.setattr(lambda_src, "render_stack_summary", render_stack_summary)
+    backend.last_updated["Stack7"] = datetime.datetime(2023, 2, 1, tzinfo=datetime.timezone.utc)
+    backend.reset_counts()
+    result = export.export_stacks(cloudformation, str(tmp_path), workers=4)
+    assert (result["exported"], result["skipped"], result["failed"]) == (3, 102, 0)
+    assert backend.calls["cloudformation.DescribeStacks"] == 3
+    assert "Stack3.html" in tmp_path.joinpath("index.html").read_text()
+    manifest = [json.loads(line) for line in tmp_path.joinpath("manifest.jsonl").read_text().splitlines()]
+    assert len(manifest) == 105
+    assert {entry["stack_name"]: entry["status"] for entry in manifest}["Stack7"] == "UPDATE_COMPLETE"
+
+
+def test_handler_emits_embedded_metrics(monkeypatch, capsys):
+    monkeypatch.setattr(lambda_src, "SUMMARY_CACHE", summary_cache.SummaryCache())
+    monkeypatch.setattr(lambda_src, "RESOURCE_STATES", summary_cache.SummaryCache())
+    with stubbed_client("cloudformation") as (client, stubber):
+        add_describe_stacks_response(stubber, "MyStack", datetime.datetime(2023, 2, 1))
+        add_describe_stack_events_response(stubber, "MyStack")
+        add_list_stack_resources_response(stubber, "bucket-one")
+        monkeypatch.setattr(lambda_src, "get_client", lambda service_name, region_name=None, role_arn=None: client)
+        lambda_src.handler({"stacks": ["MyStack"]}, None)
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert all(record["_aws"]["CloudWatchMetrics"][0]["Namespace"] == "StackSummarizer" for record in records)
+    totals = next(r for r in records if "StackName" not in r and "ResourceType" not in r)
+    assert totals["HandlerDuration"] > 0
+    assert totals["SummaryCacheMisses"] == 1
+    assert totals["SummaryCacheHitRate"] == 0
+    stack = next(r for r in records if r.get("StackName") == "MyStack" and "ResourceType" not in r)
+    assert {"DescribeStacksDuration", "ListStackResourcesPageDuration", "RenderHtmlDuration"} <= set(stack)
+    assert stack["Resources"] == 1
+    buckets = next(r for r in records if r.get("ResourceType") == "AWS::S3::Bucket")
+    assert buckets["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["StackName", "ResourceType"]]
+    assert buckets["DisplayedResources"] == 1
+
+
+def test_debug_response_includes_timings(monkeypatch):
+    monkeypatch.setattr(lambda_src, "SUMMARY_CACHE", summary_cache.SummaryCache())
+    monkeypatch.setenv("DEBUG", "true")
+    monkeypatch.setattr(lambda_src, "RESOURCE_STATES", summary_cache.SummaryCache())
+    with stubbed_client("cloudformation") as (client, stubber):
+        add_describe_stacks_response(stubber, "MyStack", datetime.datetime(2023, 2, 1))
+        add_describe_stack_events_response(stubber, "MyStack")
+        stubber.add_client_error("list_stack_resources", "InternalFailure", http_status_code=500)
+        monkeypatch.setattr(lambda_src, "get_client", lambda service_name, region_name=None, role_arn=None: client)
+        response = json.loads(lambda_src.handler({"stacks": ["MyStack"]}, None))
+    assert response["timings"]["stacks"]["MyStack"]["DescribeStacksCount"] == 1
+    assert response["timings"]["SummaryCacheMisses"] == 1
+
+
+def test_stack_resources_filtered_while_paging():
+    resources = [{"ResourceType": resource_type, "PhysicalResourceId": f"{logical_id.lower()}-123",
+                  "LogicalResourceId": logical_id, "ResourceStatus": "CREATE_COMPLETE",
+                  "LastUpdatedTimestamp": datetime.datetime(2023, 1, 1)}
+                 for resource_type, logical_id in [
+                     ("AWS::IAM::Role", "ApiRole"),
+                     ("AWS::Lambda::Function", "ApiHandler"),
+                     ("AWS::Lambda::Function", "ApiAuthorizer"),
+                     ("AWS::Lambda::Function", "ApiWorker"),
+                     ("AWS::Lambda::Function", "BatchJob"),
+                     ("AWS::SQS::Queue", "ApiQueue"),
+                     ("AWS::S3::Bucket", "ApiBucket"),
+                 ]]
+    resource_filter = ResourceFilter.from_event({"resourceTypes": ["AWS::Lambda::*", "AWS::SQS::Queue", "AWS::IAM::*"],
+                                                 "excludeResourceTypes": "AWS::SQS::*",
+                                                 "logicalIds": ["Api*"],
+                                                 "maxRowsPerType": 2})
+    listed_counts = Counter()
+    with stubbed_client("cloudformation") as (client, stubber):
+        synthetic.add_list_stack_resources_pages(stubber, "MyStack", resources, page_size=3)
+        by_type = lambda_src.get_stack_resources_by_type(client, "MyStack", resource_filter, listed_counts)
+
+    assert list(by_type) == ["AWS::Lambda::Function"]
+    assert [r.logical_id for r in by_type["AWS::Lambda::Function"]] == ["ApiHandler", "ApiAuthorizer"]
+    assert sum(listed_counts.values()) == 7
+
+    html = lambda_src.render_html_summary(lambda_src.summarize_resource(by_type), "MyStack", "us-east-1", 7, 2,
+                                          {"AWS::Lambda::Function": 2})
+    assert "2 more not shown" in html
+
+
+def test_unhealthy_resources_badged_first_and_problems_only():
+    resources = [{"ResourceType": "AWS::Lambda::Function", "PhysicalResourceId": f"{logical_id.lower()}-123",
+                  "LogicalResourceId": logical_id, "ResourceStatus": status,
+                  "LastUpdatedTimestamp": datetime.datetime(2023, 1, 1),
+                  "DriftInformation": {"StackResourceDriftStatus": drift}}
+                 for logical_id, status, drift in [
+                     ("Healthy", "CREATE_COMPLETE", "IN_SYNC"),
+                     ("Failed", "UPDATE_FAILED", "NOT_CHECKED"),
+                     ("Drifted", "UPDATE_COMPLETE", "MODIFIED"),
+                 ]]
+    resources[1]["ResourceStatusReason"] = "Resource handler returned message: Rate exceeded"
+    with stubbed_client("cloudformation") as (client, stubber):
+        synthetic.add_list_stack_resources_pages(stubber, "MyStack", resources)
+        by_type = lambda_src.get_stack_resources_by_type(client, "MyStack")
+
+    functions = by_type["AWS::Lambda::Function"]
+    assert [r.logical_id for r in functions] == ["Failed", "Drifted", "Healthy"]
+    assert [r.status_severity for r in functions] == ["problem", None, None]
+    html = lambda_src.render_html_summary(lambda_src.summarize_resource(by_type), "MyStack", "us-east-1", 3, 3)
+    assert '<span class="badge badge-problem" title="Resource handler returned message: Rate exceeded">UPDATE_FAILED</span>' in html
+    assert "DRIFTED: MODIFIED" in html
+    assert "CREATE_COMPLETE" not in html
+
+    listed_counts = Counter()
+    with stubbed_client("cloudformation") as (client, stubber):
+        synthetic.add_list_stack_resources_pages(stubber, "MyStack", resources)
+        by_type = lambda_src.get_stack_resources_by_type(client, "MyStack", ResourceFilter(problems_only=True),
+                                                         listed_counts)
+    assert [r.logical_id for r in by_type["AWS::Lambda::Function"]] == ["Failed", "Drifted"]
+    assert ResourceFilter.from_event({"problemsOnly": True}).problems_only
+
+
+def test_problem_resources_listed_past_max_rows_per_type_selected():
+    resources = [{"ResourceType": "AWS::Lambda::Function", "PhysicalResourceId": f"{logical_id.lower()}-123",
+                  "LogicalResourceId": logical_id, "ResourceStatus": status,
+                  "LastUpdatedTimestamp": datetime.datetime(2023, 1, 1)}
+                 for logical_id, status in [
+                     ("Healthy", "CREATE_COMPLETE"),
+                     ("Failed", "UPDATE_FAILED"),
+                     ("AlsoHealthy", "CREATE_COMPLETE"),
+                 ]]
+    listed_counts = Counter()
+    with stubbed_client("cloudformation") as (client, stubber):
+        synthetic.add_list_stack_resources_pages(stubber, "MyStack", resources, page_size=1)
+        by_type = lambda_src.get_stack_resources_by_type(client, "MyStack", ResourceFilter(max_rows_per_type=1),
+                                                         listed_counts)
+
+    assert [r.logical_id for r in by_type["AWS::Lambda::Function"]] == ["Failed", "Healthy"]
+    assert sum(listed_counts.values()) == 3
+
+
+def test_nested_stacks_summarized_once_in_order(monkeypatch):
+    nested = {"Root": ["ChildA", "ChildB"], "ChildA": ["Grandchild", "Shared"], "ChildB": ["Shared"],
+              "Grandchild": ["TooDeep"]}
+    prepared = Counter()
+
+    def fake_prepare_stack_summary(stack_name, cloudformation, force_refresh=False, options=None, role_arn=None):
+        name = stack_name.split("/")[-1]
+        prepared[name] += 1
+        time.sleep(0.05 if name == "ChildA" else 0.01)
+        return StackSummary(f"<p>{name}</p>", name, stack_id=f"arn:aws:cloudformation:stack/{name}",
+                            nested_stacks=[f"arn:aws:cloudformation:stack/{child}" for child in nested.get(name, [])])
+
+    monkeypatch.setattr(lambda_src, "prepare_stack_summary", fake_prepare_stack_summary)
+    summaries = lambda_src.render_stack_summaries(["Root", "ChildB"], None,
+                                                  options=SummaryOptions.from_event({"nestedDepth": 2}))
+
+    assert [s.name for s in summaries] == ["Root", "ChildA", "Grandchild", "Shared", "ChildB"]
+    assert [s.parent_name for s in summaries] == [None, "Root", "ChildA", "ChildA", "Root"]
+    assert "TooDeep" not in prepared
+    assert prepared["Shared"] == 1
+
+
+def test_cached_summary_says_which_stack_it_is_nested_in_per_widget(monkeypatch):
+    monkeypatch.setattr(lambda_src, "SUMMARY_CACHE", summary_cache.SummaryCache())
+    resources = lambda_src.summarize_resource({"AWS::Lambda::Function": [StackResourceSummary("fn", "Fn", "us-east-1")]})
+    nested = StackSummary(None, "Child", resources=resources, resource_count=1, aws_region="us-east-1",
+                          cache_key="Child|key", parent_name="Root")
+    assert "nested in Root" in lambda_src.finish_stack_summary(nested).html
+
+    cached = lambda_src.SUMMARY_CACHE.get("Child|key")["html"]
+    listed = lambda_src.finish_stack_summary(StackSummary(cached, "Child"))
+    assert "nested in" not in listed.html and lambda_src.NESTED_IN_MARKER not in listed.html
+    assert "nested in Other" in lambda_src.finish_stack_summary(StackSummary(cached, "Child", parent_name="Other")).html
+
+
+def test_stack_selectors_resolved_from_cached_index(monkeypatch):
+    def stack(name, tags=(), updated=datetime.datetime(2023, 1, 1), parent=None):
+        stack = {"StackName": name, "StackId": f"arn:aws:cloudformation:us-east-1:123456789012:stack/{name}/abc",
+                 "CreationTime": datetime.datetime(2023, 1, 1), "LastUpdatedTime": updated,
+                 "StackStatus": "UPDATE_COMPLETE", "Tags": [{"Key": k, "Value": v} for k, v in tags]}
+        if parent:
+            stack["ParentId"] = parent
+        return stack
+
+    def summary(stack):
+        return {key: stack[key] for key in ("StackName", "StackId", "CreationTime", "LastUpdatedTime", "StackStatus")}
+
+    payments = stack("payments-api", [(lambda_src.TAG_GROUP, "payments")])
+    prod_web = stack("prod-web")
+    prod_db = stack("prod-db", [(lambda_src.TAG_GROUP, "payments")])
+    nested = stack("prod-web-Child", parent=prod_web["StackId"])
+    index = stack_index.StackIndex(ttl_seconds=60)
+    selectors = ["prod-*", f"{lambda_src.TAG_GROUP}=payments", "ExactStack"]
+    with stubbed_client("cloudformation") as (client, stubber):
+        stubber.add_response("describe_stacks", {"Stacks": [payments, prod_web], "NextToken": "page-1"}, {})
+        stubber.add_response("describe_stacks", {"Stacks": [prod_db, nested]}, {"NextToken": "page-1"})
+        first = index.resolve(selectors, client)
+        cached = index.resolve(selectors, client)
+
+        prod_web_updated = stack("prod-web", [(lambda_src.TAG_GROUP, "payments")], datetime.datetime(2023, 2, 1))
+        stubber.add_response("list_stacks", {"StackSummaries": [summary(prod_web_updated), summary(prod_db)]}, {})
+        stubber.add_response("describe_stacks", {"Stacks": [prod_web_updated]}, {"StackName": prod_web["StackId"]})
+        now = time.time()
+        monkeypatch.setattr(stack_index.time, "time", lambda: now + 61)
+        refreshed = index.resolve(selectors, client)
+
+    assert first == cached == ["prod-db", "prod-web", "payments-api", "ExactStack"]
+    assert refreshed == ["prod-db", "prod-web", "ExactStack"]
+
+
+def test_role_clients_pooled_and_share_credentials(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "local")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "local")
+    aws_clients.reset()
+    role_arn = "arn:aws:iam::210987654321:role/StackSummarizerReadOnly"
+    with stub.Stubber(aws_clients.get_client("sts")) as sts:
+        sts.add_response("assume_role", {"Credentials": {
+            "AccessKeyId": "ASIAASSUMEDROLEKEY", "SecretAccessKey": "secret", "SessionToken": "token",
+            "Expiration": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1),
+        }}, {"RoleArn": role_arn, "RoleSessionName": aws_clients.ROLE_SESSION_NAME})
+        cloudformation = aws_clients.get_client("cloudformation", "eu-west-1", role_arn)
+        cloudwatch = aws_clients.get_client("cloudwatch", "us-west-2", role_arn)
+        assert aws_clients.get_client("cloudformation", "eu-west-1", role_arn) is cloudformation
+        assert aws_clients.get_client("cloudformation", "eu-west-1") is not cloudformation
+        for client in (cloudformation, cloudwatch, cloudformation):
+            assert client._request_signer._credentials.get_frozen_credentials().access_key == "ASIAASSUMEDROLEKEY"
+        sts.assert_no_pending_responses()
+    aws_clients.reset()
+
+
+def test_stacks_summarized_across_regions_and_accounts(monkeypatch):
+    role_arn = "arn:aws:iam::210987654321:role/StackSummarizerReadOnly"
+    requested = []
+
+    def fake_prepare_stack_summary(stack_name, cloudformation, force_refresh=False, options=None, role_arn=None):
+        requested.append((stack_name, cloudformation, role_arn))
+        return StackSummary(f"<p>{stack_name}</p>", stack_name, stack_id=f"{cloudformation}:{stack_name}")
+
+    monkeypatch.setattr(lambda_src, "prepare_stack_summary", fake_prepare_stack_summary)
+    monkeypatch.setattr(lambda_src, "get_client", lambda service_name, region_name=None, role_arn=None:
+                        f"{service_name}@{region_name}/{role_arn}")
+    html = lambda_src.render({"stacks": ["LocalStack",
+                                         {"name": "EuropeStack", "region": "eu-west-1"},
+                                         {"name": "PartnerStack", "region": "eu-west-1", "roleArn": role_arn},
+                                         {"name": "EuropeStack", "region": "eu-west-1"}]}, "local-cloudformation")
+
+    assert html == lambda_src.WIDGET_STYLE + "<p>LocalStack</p><p>EuropeStack</p><p>PartnerStack</p>"
+    assert sorted(requested) == [
+        ("EuropeStack", "cloudformation@eu-west-1/None", None),
+        ("LocalStack", "local-cloudformation", None),
+        ("PartnerStack", f"cloudformation@eu-west-1/{role_arn}", role_arn),
+    ]
+
+
+def test_stacks_that_cannot_be_accessed_rendered_unavailable(monkeypatch):
+    role_arn = "arn:aws:iam::210987654321:role/StackSummarizerReadOnly"
+
+    def fake_prepare_stack_summary(stack_name, cloudformation, force_refresh=False, options=None, role_arn=None):
+        if stack_name == "PartnerStack":
+            raise ClientError({"Error": {"Code": "AccessDenied", "Message": "not authorized"}}, "AssumeRole")
+        if stack_name == "LockedStack":
+            raise ClientError({"Error": {"Code": "AccessDeniedException", "Message": "denied"}}, "DescribeStacks")
+        return StackSummary(f"<p>{stack_name}</p>", stack_name)
+
+    monkeypatch.setattr(lambda_src, "prepare_stack_summary", fake_prepare_stack_summary)
+    monkeypatch.setattr(lambda_src, "get_client", lambda service_name, region_name=None, role_arn=None: None)
+    html = lambda_src.render({"stacks": ["LocalStack", {"name": "PartnerStack", "roleArn": role_arn},
+                                         "LockedStack"]}, None)
+
+    assert html == lambda_src.WIDGET_STYLE + (
+        "<p>LocalStack</p>"
+        "<p class=\"stack-message\">could not access stack &#x27;PartnerStack&#x27; (AccessDenied)</p>"
+        "<p class=\"stack-message\">could not access stack &#x27;LockedStack&#x27; (AccessDeniedException)</p>")
+
+
+def test_stack_resources_updated_from_stack_events(monkeypatch):
+    monkeypatch.setattr(lambda_src, "SUMMARY_CACHE", summary_cache.SummaryCache())
+    monkeypatch.setattr(lambda_src, "RESOURCE_STATES", summary_cache.SummaryCache())
+    stack_id = "arn:aws:cloudformation:us-east-1:123456789012:stack/MyStack/abc"
+
+    def resource(logical_id, physical_id, resource_type="AWS::Lambda::Function"):
+        return {"ResourceType": resource_type, "LogicalResourceId": logical_id, "PhysicalResourceId": physical_id,
+                "LastUpdatedTimestamp": datetime.datetime(2023, 1, 1), "ResourceStatus": "CREATE_COMPLETE"}
+
+    def event(event_id, status, logical_id="MyStack", physical_id=stack_id, resource_type="AWS::CloudFormation::Stack"):
+        return {"StackId": stack_id, "EventId": event_id, "StackName": "MyStack", "LogicalResourceId": logical_id,
+                "PhysicalResourceId": physical_id, "ResourceType": resource_type, "ResourceStatus": status,
+                "Timestamp": datetime.datetime(2023, 1, 1)}
+
+    with stubbed_client("cloudformation") as (client, stubber):
+        add_describe_stacks_response(stubber, "MyStack", datetime.datetime(2023, 2, 1))
+        add_describe_stack_events_response(stubber, "MyStack", [event("e1", "CREATE_COMPLETE")])
+        stubber.add_response("list_stack_resources", {"StackResourceSummaries": [
+            resource("Handler", "handler-1"), resource("Worker", "worker-1"), resource("Cron", "cron-1")]})
+        first = lambda_src.prepare_stack_summary("MyStack", client)
+
+        add_describe_stacks_response(stubber, "MyStack", datetime.datetime(2023, 3, 1))
+        add_describe_stack_events_response(stubber, "MyStack", [
+            event("e6", "UPDATE_COMPLETE"),
+            event("e5", "DELETE_COMPLETE", "Handler", "handler-1", "AWS::Lambda::Function"),
+            event("e4", "DELETE_COMPLETE", "Cron", "cron-1", "AWS::Lambda::Function"),
+            event("e3", "UPDATE_COMPLETE", "Handler", "handler-2", "AWS::Lambda::Function"),
+            event("e2", "CREATE_COMPLETE", "Uploads", "uploads-bucket", "AWS::S3::Bucket"),
+            event("e1", "CREATE_COMPLETE"),
+        ])
+        updated = lambda_src.prepare_stack_summary("MyStack", client)
+
+        add_describe_stacks_response(stubber, "MyStack", datetime.datetime(2023, 4, 1))
+        add_describe_stack_events_response(stubber, "MyStack", [event("e9", "UPDATE_COMPLETE")])
+        add_describe_stack_events_response(stubber, "MyStack", [event("e9", "UPDATE_COMPLETE")])
+        stubber.add_response("list_stack_resources", {"StackResourceSummaries": [resource("Worker", "worker-2")]})
+        rebuilt = lambda_src.prepare_stack_summary("MyStack", client)
+
+    functions = {r.logical_id: r for r in first.resources["AWS::Lambda::Function"]}
+    updated_functions = {r.logical_id: r for r in updated.resources["AWS::Lambda::Function"]}
+    assert [r.physical_id for r in updated_functions.values()] == ["handler-2", "worker-1"]
+    assert updated_functions["Worker"] is not functions["Worker"]
+    assert updated_functions["Worker"].label == functions["Worker"].label
+    assert [r.physical_id for r in updated.resources["AWS::S3::Bucket"]] == ["uploads-bucket"]
+    assert updated.resource_count == 3
+    assert [r.physical_id for r in rebuilt.resources["AWS::Lambda::Function"]] == ["worker-2"]
+
+
+def test_stack_resources_listed_again_once_their_drift_could_be_stale(monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    monkeypatch.setattr(lambda_src, "SUMMARY_CACHE", summary_cache.SummaryCache())
+    monkeypatch.setattr(lambda_src, "RESOURCE_STATES", summary_cache.SummaryCache(ttl_seconds=3600))
+    stack_id = "arn:aws:cloudformation:us-east-1:123456789012:stack/MyStack/abc"
+    event = {"StackId": stack_id, "EventId": "e1", "StackName": "MyStack", "LogicalResourceId": "MyStack",
+             "PhysicalResourceId": stack_id, "ResourceType": "AWS::CloudFormation::Stack",
+             "ResourceStatus": "CREATE_COMPLETE", "Timestamp": datetime.datetime(2023, 1, 1)}
+
+    def add_list_stack_resources_response(stubber, drift_status):
+        stubber.add_response("list_stack_resources", {"StackResourceSummaries": [{
+            "ResourceType": "AWS::Lambda::Function", "LogicalResourceId": "Handler", "PhysicalResourceId": "handler-1",
+            "LastUpdatedTimestamp": datetime.datetime(2023, 1, 1), "ResourceStatus": "CREATE_COMPLETE",
+            "DriftInformation": {"StackResourceDriftStatus": drift_status}}]})
+
+    drifted = []
+    with stubbed_client("cloudformation") as (client, stubber):
+        for day, seconds_later in ((1, 0), (2, 1800), (3, 1900)):
+            now[0] += seconds_later
+            add_describe_stacks_response(stubber, "MyStack", datetime.datetime(2023, 2, day))
+            add_describe_stack_events_response(stubber, "MyStack", [event])
+            if day != 2:
+                add_list_stack_resources_response(stubber, "IN_SYNC" if day == 1 else "MODIFIED")
+            summary = lambda_src.prepare_stack_summary("MyStack", client)
+            drifted.append(summary.resources["AWS::Lambda::Function"][0].drifted)
+
+    # updated from stack events on the second day, though that renewed the state, listed again on the third
+    assert drifted == [False, False, True]
+
+
+def test_unchanged_resources_enriched_again_when_updated_from_stack_events(monkeypatch):
+    monkeypatch.setattr(lambda_src, "SUMMARY_CACHE", summary_cache.SummaryCache())
+    monkeypatch.setattr(lambda_src, "RESOURCE_STATES", summary_cache.SummaryCache())
+    monkeypatch.setattr(common, "ENRICHMENT_CACHE_TTL_SECONDS", 0)
+    monkeypatch.setattr(lambda_src, "FETCH_ENGINE", fetch_engine.SyncFetchEngine())
+    queue_url = "https://sqs.us-east-1.amazonaws.com/123456789012/jobs"
+    stack_id = "arn:aws:cloudformation:us-east-1:123456789012:stack/MyStack/abc"
+    event = {"StackId": stack_id, "EventId": "e1", "StackName": "MyStack", "LogicalResourceId": "MyStack",
+             "PhysicalResourceId": stack_id, "ResourceType": "AWS::CloudFormation::Stack",
+             "ResourceStatus": "CREATE_COMPLETE", "Timestamp": datetime.datetime(2023, 1, 1)}
+
+    with stubbed_client("cloudformation") as (client, stubber), stubbed_client("sqs") as (sqs_client, sqs_stubber):
+        monkeypatch.setattr(lambda_src, "get_client", lambda service_name, region_name=None, role_arn=None: sqs_client)
+        labels = []
+        for updated, depth in ((datetime.datetime(2023, 2, 1), "5"), (datetime.datetime(2023, 3, 1), "9")):
+            add_describe_stacks_response(stubber, "MyStack", updated)
+            add_describe_stack_events_response(stubber, "MyStack", [event])
+            if not labels:
+                stubber.add_response("list_stack_resources", {"StackResourceSummaries": [{
+                    "ResourceType": "AWS::SQS::Queue", "LogicalResourceId": "Jobs", "PhysicalResourceId": queue_url,
+                    "LastUpdatedTimestamp": datetime.datetime(2023, 1, 1), "ResourceStatus": "CREATE_COMPLETE"}]})
+            sqs_stubber.add_response("get_queue_attributes", {"Attributes": {
+                "ApproximateNumberOfMessages": depth, "ApproximateNumberOfMessagesNotVisible": "0"}})
+            summary = lambda_src.prepare_stack_summary("MyStack", client)
+            labels.append(summary.resources["AWS::SQS::Queue"][0].label)
+
+    assert labels == ["jobs (5 visible, 0 in flight)", "jobs (9 visible, 0 in flight)"]
+
+
+def test_concurrent_requests_for_a_stack_share_one_upstream_call(monkeypatch):
+    monkeypatch.setattr(lambda_src, "SUMMARY_CACHE", summary_cache.SummaryCache())
+    monkeypatch.setattr(lambda_src, "RESOURCE_STATES", None)
+    with stubbed_client("cloudformation") as (client, stubber):
+        client.meta.events.register_first("before-call", lambda **kwargs: time.sleep(0.2))
+        add_describe_stacks_response(stubber, "MyStack", datetime.datetime(2023, 2, 1))
+        add_list_stack_resources_response(stubber, "bucket-one")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            summaries = list(executor.map(lambda _: lambda_src.render_stack_summary("MyStack", client), range(8)))
+
+    assert len({summary.html for summary in summaries}) == 1
+    assert "bucket-one" in summaries[0].html
+
+
+def test_concurrent_requests_for_a_stack_each_get_their_own_summary(monkeypatch):
+    prepared = []
+    started = threading.Barrier(2)
+
+    def fake_prepare_stack_summary(stack_name, cloudformation, force_refresh=False, options=None, role_arn=None):
+        time.sleep(0.2)
+        bucket = StackResourceSummary("bucket-one", "Bucket", "us-east-1")
+        prepared.append(StackSummary(None, stack_name, resources={"AWS::S3::Bucket": [bucket]}))
+        return prepared[-1]
+
+    def prepare(_):
+        started.wait()
+        return lambda_src.coalesced_prepare_stack_summary("MyStack", None)
+
+    monkeypatch.setattr(lambda_src, "prepare_stack_summary", fake_prepare_stack_summary)
+    monkeypatch.setattr(lambda_src, "STACK_REQUESTS", throttling.SingleFlight(share=copy.deepcopy))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        summaries = list(executor.map(prepare, range(2)))
+
+    assert len(prepared) == 1
+    # the request that made the call keeps the summary, the one that joined it gets a copy
+    assert sorted(summary is prepared[0] for summary in summaries) == [False, True]
+    assert summaries[0].resources["AWS::S3::Bucket"][0] is not summaries[1].resources["AWS::S3::Bucket"][0]
+    assert lambda_src.coalesced_prepare_stack_summary("MyStack", None) is prepared[-1]
+
+
+def test_token_bucket_limits_rate_after_burst():
+    bucket = throttling.TokenBucket(rate=20, capacity=2)
+    started = time.monotonic()
+    for _ in range(4):
+        bucket.acquire()
+    assert 0.09 < time.monotonic() - started < 0.5
+
+
+def test_output_minified_and_cut_off_at_byte_budget(monkeypatch):
+    def fake_prepare_stack_summary(stack_name, cloudformation, force_refresh=False, options=None, role_arn=None):
+        buckets = [StackResourceSummary(f"{stack_name.lower()}-bucket-{i}", f"Bucket{i}", "us-east-1") for i in range(50)]
+        return StackSummary(None, stack_name, resources=lambda_src.summarize_resource({"AWS::S3::Bucket": buckets}),
+                            resource_count=50, aws_region="us-east-1")
+
+    monkeypatch.setattr(lambda_src, "prepare_stack_summary", fake_prepare_stack_summary)
+    html = lambda_src.render({"stacks": ["StackA", "StackB", "StackC"]}, None)
+    assert html.count('class="stack-summary"') == 3
+    assert "  " not in html and "> <" not in html and 'id="th1"' not in html
+
+    rendered = []
+    render_html_summary = lambda_src.render_html_summary
+    monkeypatch.setattr(lambda_src, "render_html_summary",
+                        lambda resources, stack_name, *args: rendered.append(stack_name) or render_html_summary(
+                            resources, stack_name, *args))
+    monkeypatch.setattr(lambda_src, "OUTPUT_BYTE_BUDGET", len(html.encode()) // 2)
+    truncated = lambda_src.render({"stacks": ["StackA", "StackB", "StackC"]}, None)
+    assert len(truncated.encode()) <= lambda_src.OUTPUT_BYTE_BUDGET
+    assert truncated.count('class="stack-summary"') == 1
+    assert "100 more resources in 2 stacks not shown" in truncated
+    # the stack that did not fit was rendered to find out, but not the stack after it
+    assert rendered == ["StackA", "StackB"]
+
+
+def test_minified_output_keeps_spaces_between_inline_elements(monkeypatch):
+    function = StackResourceSummary("handler-123", "Handler", "us-east-1", status="UPDATE_FAILED",
+                                    drift_status="MODIFIED")
+    function.set_resource_link("handler", "https://example.com/handler")
+    html = lambda_src.render_html_summary({"AWS::Lambda::Function": [function]}, "MyStack", "us-east-1", 1, 1)
+
+    assert ('<td><a target="_blank" href="https://example.com/handler">handler</a> '
+            '<span class="badge badge-problem" title="">UPDATE_FAILED</span> '
+            '<span class="badge badge-problem" title="drift detected">DRIFTED: MODIFIED</span></td>') in html
+    assert "  " not in html and "<tr> " not in html and " <td>" not in html
+    chunks = ["<td>\n  a", "  ", "<b>b</b>\n", "  </td> ", " <td> c"]
+    assert "".join(lambda_src.minify_html(chunks)) == "<td>a <b>b</b></td><td>c"
+    monkeypatch.setattr(lambda_src, "MINIFY_BATCH_CHARACTERS", 1)
+    assert "".join(lambda_src.minify_html(chunks)) == "<td>a <b>b</b></td><td>c"
@@ -0,0 +1,76 @@
+import concurrent.futures
+import threading
+import time
+from collections import Counter
+from typing import Callable, Hashable, Optional, Tuple
+
+
+class SingleFlight:
+    """
+    Runs at most one call at a time per key; concurrent callers with the same key share its result.
+
+    A call that raises an exception raises it for every caller sharing it. Results are not kept once
+    the call finishes, so a later call with the same key runs again.
+
+    With `share`, the callers that joined a call get `share(result)` instead of the result, which the
+    caller that made the call keeps; that is only copied when there were callers to share it with.
+    """
+
+    def __init__(self, share: Optional[Callable] = None):
+        self._share = share
+        self._calls = {}
+        self._followers = Counter()
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Tuple[object, bool]:
+        """Return the result of `fn(*args, **kwargs)` and whether it was shared with a call already in flight."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = concurrent.futures.Future()
+            else:
+                self._followers[key] += 1
+        if not leader:
+            result = future.result()
+            return (self._share(result) if self._share else result), True
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                followers = self._followers.pop(key, 0)
+        # followers copy this snapshot rather than the result, which the caller goes on to change
+        future.set_result(self._share(result) if self._share and followers else result)
+        return result, False
+
+
+class TokenBucket:
+    """
+    A rate limiter allowing `rate` calls per second on average, in bursts of up to `capacity` calls.
+
+    Its acquire method can be registered as a botocore `before-call` event handler, to limit the
+    API calls made by a client.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, **kwargs) -> None:
+        """Take a token, first waiting for one to become available if there are none."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # a token is taken even when there are none, so waiting callers queue up for later tokens
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)